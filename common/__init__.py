@@ -0,0 +1 @@
+"""Modules shared by model_service and main_backend (both run from the repository root)."""
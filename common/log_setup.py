@@ -0,0 +1,147 @@
+"""Queued, non-blocking logging.
+
+Handlers that touch the disk (or the console) run on a background
+``QueueListener`` thread; code on the event loop only formats the message and
+enqueues the record. High-volume lines can be sampled and records can carry
+structured fields that are rendered as ``key=value`` pairs::
+
+    logger.info("frame", extra=fields(path="/recognise", ms=12.5))
+    logger.info("request done", extra=sampled(10, status=200))
+"""
+import atexit
+import itertools
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
+from typing import Any, Dict, Optional
+
+
+def fields(**kv: Any) -> Dict[str, Any]:
+    """`extra=` payload attaching structured key/value fields to a record."""
+    return {"kv": kv}
+
+
+def sampled(every: int, **kv: Any) -> Dict[str, Any]:
+    """Like fields(), but only 1 in `every` such records (per message) is kept."""
+    return {"kv": kv, "sample_every": every}
+
+
+def _format_value(v: Any) -> str:
+    s = str(v)
+    if s == "" or any(c in s for c in " \"="):
+        return '"' + s.replace('"', '\\"') + '"'
+    return s
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Standard text line followed by the record's structured fields as key=value."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        kv = getattr(record, "kv", None)
+        if kv:
+            line += " " + " ".join(f"{k}={_format_value(v)}" for k, v in kv.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records that ask for sampling; warnings and above always pass."""
+
+    def __init__(self):
+        super().__init__()
+        self._counters: Dict[Any, "itertools.count[int]"] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg)
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, itertools.count())
+        # itertools.count.__next__ is atomic under the GIL
+        return next(counter) % every == 0
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records (and counts them) instead of blocking when the queue is full."""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listeners: Dict[str, QueueListener] = {}
+
+
+def configure_logging(
+    name: str,
+    level: int = logging.INFO,
+    log_file: Optional[str] = None,
+    rotate: bool = True,
+    queue_size: int = 10000,
+    fmt: str = "%(asctime)s %(levelname)s %(name)s: %(message)s",
+) -> logging.Logger:
+    """Route logger `name` through a bounded queue to console (+ optional file) handlers.
+
+    Idempotent per logger name. The listener thread is stopped (and the queue
+    flushed) at interpreter exit, or earlier via shutdown_logging().
+    """
+    logger = logging.getLogger(name)
+    if name in _listeners:
+        return logger
+
+    formatter = KeyValueFormatter(fmt)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        try:
+            if rotate:
+                handlers.append(TimedRotatingFileHandler(log_file, when="midnight", backupCount=7, encoding="utf-8"))
+            else:
+                handlers.append(logging.FileHandler(log_file, mode="a", encoding="utf-8"))
+        except Exception:
+            # fall back to console-only logging
+            logging.getLogger(__name__).exception("Could not create file handler for %s; console only", log_file)
+    for h in handlers:
+        h.setLevel(level)
+        h.setFormatter(formatter)
+
+    q: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    qh = DroppingQueueHandler(q)
+    qh.setLevel(level)
+    qh.addFilter(SamplingFilter())
+
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.addHandler(qh)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = QueueListener(q, *handlers, respect_handler_level=True)
+    listener.start()
+    _listeners[name] = listener
+    return logger
+
+
+@atexit.register
+def shutdown_logging(name: Optional[str] = None) -> None:
+    """Flush and stop the listener for `name` (all listeners if None)."""
+    names = [name] if name else list(_listeners)
+    for n in names:
+        listener = _listeners.pop(n, None)
+        if listener is not None:
+            listener.stop()
+
+
+def queue_depth(name: str) -> int:
+    listener = _listeners.get(name)
+    return listener.queue.qsize() if listener else 0
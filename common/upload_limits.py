@@ -0,0 +1,104 @@
+"""Bounded uploads: body size caps and chunked reads of uploaded files.
+
+Limits come from the calling service's config module, passed as `settings`
+and read on every call:
+
+- ``MAX_UPLOAD_SIZE_MB`` per uploaded file,
+- ``MAX_UPLOAD_FILES`` files per request.
+
+``BodyLimit`` (ASGI middleware) caps every request body. A multipart body
+may carry ``MAX_UPLOAD_FILES`` full-size files; any other body (JSON with an
+``image_b64``) one base64-encoded file. A body over its cap is refused with
+413 from its Content-Length header, before any of it is read, or, when it is
+sent chunked, as soon as the bytes received pass the cap.
+
+Starlette keeps at most 1 MB of each multipart file in memory and spools the
+rest to disk, and the routes read uploaded files with ``iter_upload()`` in
+``CHUNK_BYTES`` pieces, so memory per request stays bounded whatever the
+size of the photos.
+"""
+from typing import AsyncIterator, Sequence
+
+CHUNK_BYTES = 64 * 1024
+# room for multipart part headers and the small form fields next to the files
+_FORM_OVERHEAD = 64 * 1024
+_MB = 1024 * 1024
+
+
+def file_limit(settings) -> int:
+    return int(settings.MAX_UPLOAD_SIZE_MB * _MB)
+
+
+def body_limit(settings, content_type: str) -> int:
+    """Largest request body accepted with this Content-Type."""
+    if content_type.startswith("multipart/form-data"):
+        return settings.MAX_UPLOAD_FILES * (file_limit(settings) + _FORM_OVERHEAD)
+    # read whole: one base64 image
+    return file_limit(settings) * 4 // 3 + _FORM_OVERHEAD
+
+
+def _too_large(message: str):
+    from fastapi import HTTPException
+
+    return HTTPException(413, message)
+
+
+class BodyLimit:
+    """ASGI middleware refusing request bodies over ``body_limit()`` with 413."""
+
+    def __init__(self, app, settings):
+        self.app = app
+        self.settings = settings
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        limit = body_limit(self.settings, headers.get(b"content-type", b"").decode("latin-1"))
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            from fastapi.responses import JSONResponse
+
+            response = JSONResponse({"detail": f"Request body is larger than {limit / _MB:.1f} MB"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # raised inside the route's body parsing; FastAPI answers it as a 413
+                    raise _too_large(f"Request body is larger than {limit / _MB:.1f} MB")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def check_files(files: Sequence, settings) -> None:
+    """413 for too many files, or for a file whose size (known once spooled) is over the limit."""
+    if len(files) > settings.MAX_UPLOAD_FILES:
+        raise _too_large(f"{len(files)} files sent; at most {settings.MAX_UPLOAD_FILES} per request")
+    for f in files:
+        if f.size is not None and f.size > file_limit(settings):
+            raise _too_large(f"{f.filename} is {f.size / _MB:.1f} MB; at most {settings.MAX_UPLOAD_SIZE_MB:g} MB per file")
+
+
+async def iter_upload(upload, settings) -> AsyncIterator[bytes]:
+    """The uploaded file's bytes in CHUNK_BYTES pieces; 413 once it passes MAX_UPLOAD_SIZE_MB."""
+    limit, seen = file_limit(settings), 0
+    await upload.seek(0)
+    while True:
+        chunk = await upload.read(CHUNK_BYTES)
+        if not chunk:
+            return
+        seen += len(chunk)
+        if seen > limit:
+            raise _too_large(f"{upload.filename} is larger than {settings.MAX_UPLOAD_SIZE_MB:g} MB")
+        yield chunk
+
+
+async def read_upload(upload, settings) -> bytes:
+    return b"".join([chunk async for chunk in iter_upload(upload, settings)])
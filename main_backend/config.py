@@ -33,3 +33,22 @@ MODEL_SERVICE_REFRESH_MARGIN = int(os.environ.get("MODEL_SERVICE_REFRESH_MARGIN"
 
 # Stream defaults
 DEFAULT_KEYFRAME_INTERVAL = int(os.environ.get("MAIN_BACKEND_KEYFRAME_INTERVAL", 10))  # send every N frames to model
+
+# Logging: records are queued and written by a background thread (common/log_setup.py)
+LOG_LEVEL = os.environ.get("MAIN_BACKEND_LOG_LEVEL", "DEBUG").upper()
+LOG_FILE = os.environ.get("MAIN_BACKEND_LOG_FILE", str(Path(__file__).resolve().parent / "main.py.log"))
+LOG_QUEUE_SIZE = int(os.environ.get("MAIN_BACKEND_LOG_QUEUE_SIZE", 10000))
+# Per-frame lines (recognition results, streaming requests) are sampled 1 in N
+LOG_SAMPLE_EVERY = int(os.environ.get("MAIN_BACKEND_LOG_SAMPLE_EVERY", 20))
+
+# Frames whose /recognise round trip exceeds this budget are logged with the model service's Server-Timing breakdown
+RECOGNITION_LATENCY_BUDGET_MS = float(os.environ.get("MAIN_BACKEND_RECOGNITION_BUDGET_MS", 750))
+# How long we wait for /recognise and /refresh-db; sent along as X-Request-Deadline-Ms so the
+# model service drops work we have already given up on
+RECOGNITION_TIMEOUT_SECONDS = float(os.environ.get("MAIN_BACKEND_RECOGNITION_TIMEOUT_S", 10.0))
+ENROLL_TIMEOUT_SECONDS = float(os.environ.get("MAIN_BACKEND_ENROLL_TIMEOUT_S", 30.0))
+
+# Uploaded photos (common/upload_limits.py); keep these equal to the model service's,
+# which applies the same limits to what we forward
+MAX_UPLOAD_SIZE_MB = float(os.environ.get("MAIN_BACKEND_MAX_UPLOAD_SIZE_MB", 10))
+MAX_UPLOAD_FILES = int(os.environ.get("MAIN_BACKEND_MAX_UPLOAD_FILES", 10))
@@ -3,14 +3,15 @@ from fastapi.middleware.cors import CORSMiddleware
 from . import config
 import logging
 
-# set up basic logging for the main_backend app
-LOG = logging.getLogger("main_backend")
-LOG.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename=str(__file__) + '.log', mode='a', encoding='utf-8')
-fmt = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
-handler.setFormatter(fmt)
-LOG.addHandler(handler)
-LOG.addHandler(logging.StreamHandler())
+from common.log_setup import configure_logging, fields, sampled
+
+# set up queued logging for the main_backend app (file + console written off the event loop)
+LOG = configure_logging(
+    "main_backend",
+    level=getattr(logging, config.LOG_LEVEL, logging.DEBUG),
+    log_file=config.LOG_FILE,
+    queue_size=config.LOG_QUEUE_SIZE,
+)
 
 app = FastAPI(
     title="Main Backend - Attendance & Stream Gateway",
@@ -30,6 +31,12 @@ origins = [
     "http://127.0.0.1:3000",
 ]
 
+from common.upload_limits import BodyLimit
+
+# request bodies over the upload limits are refused before they are read
+# (added before CORS so the 413 still carries CORS headers)
+app.add_middleware(BodyLimit, settings=config)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -39,30 +46,25 @@ app.add_middleware(
 )
 
 
-# Request logging middleware - logs method, path, status and duration
+# Request logging middleware - one structured line per request with method, path, status and duration
 @app.middleware("http")
 async def log_requests(request, call_next):
     import time
-    try:
-        LOG.info("HTTP request start: %s %s", request.method, request.url.path)
-    except Exception:
-        pass
-        
-    start = time.time()
+
+    start = time.perf_counter()
+    meta = {"method": request.method, "path": request.url.path}
     try:
         response = await call_next(request)
-    except Exception as exc:
-        try:
-            LOG.exception("Unhandled exception for %s %s", request.method, request.url.path)
-        except Exception:
-            pass
-        raise
-    duration = (time.time() - start) * 1000.0
-    
-    try:
-        LOG.info("HTTP request finished: %s %s -> %s (%.2f ms)", request.method, request.url.path, response.status_code, duration)
     except Exception:
-        pass
+        LOG.exception("Unhandled exception", extra=fields(**meta))
+        raise
+    duration = round((time.perf_counter() - start) * 1000.0, 2)
+
+    # streaming/snapshot endpoints are polled per frame; sample them
+    if request.url.path.startswith("/stream"):
+        LOG.info("HTTP request", extra=sampled(config.LOG_SAMPLE_EVERY, **meta, status=response.status_code, ms=duration))
+    else:
+        LOG.info("HTTP request", extra=fields(**meta, status=response.status_code, ms=duration))
     return response
 
 # include routers
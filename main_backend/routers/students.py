@@ -110,24 +110,30 @@ async def enroll_photos(reg_no: str, files: List[UploadFile] = File(...), db: Se
 
     Only faculty or admin may enroll photos on behalf of students.
     """
+    from common import upload_limits
+
     multipart = []
     try:
         # validate student exists
         student = db.query(m.Student).filter(m.Student.reg_no == reg_no).first()
         if not student:
             raise HTTPException(status_code=404, detail="student not found")
+        # too many or too large photos are refused here rather than by the model service
+        upload_limits.check_files(files, config)
 
         LOG.info("user %s uploading %d files for enroll %s", getattr(user, 'username', None), len(files), reg_no)
         async with httpx.AsyncClient() as client:
             for f in files:
-                content = await f.read()
-                multipart.append(("files", (f.filename, content, f.content_type)))
+                # the spooled upload itself: httpx streams it out in chunks instead of holding it in memory
+                await f.seek(0)
+                multipart.append(("files", (f.filename, f.file, f.content_type)))
 
-            data = {"identity": reg_no}
+            from ..services.model_client import deadline_header, get_headers_async, student_shard
+            # enrolling only rewrites this student's department/batch shard on the model service
+            data = {"identity": reg_no, "shard": student_shard(student.department, student.reg_no)}
             url = f"{config.MODEL_SERVICE_URL}/refresh-db"
-            from ..services.model_client import get_headers_async
-            headers = await get_headers_async()
-            resp = await client.post(url, files=multipart, data=data, headers=headers, timeout=30.0)
+            headers = {**await get_headers_async(), **deadline_header(config.ENROLL_TIMEOUT_SECONDS)}
+            resp = await client.post(url, files=multipart, data=data, headers=headers, timeout=config.ENROLL_TIMEOUT_SECONDS)
             LOG.info("model service refresh-db status=%s detail=%s", resp.status_code, resp.text[:200])
             
             if resp.status_code != 200:
@@ -135,6 +141,8 @@ async def enroll_photos(reg_no: str, files: List[UploadFile] = File(...), db: Se
                 raise HTTPException(status_code=resp.status_code, detail=resp.text)
             
             return {"status": resp.status_code, "detail": resp.text}
+    except HTTPException:
+        raise
     except Exception as e:
         LOG.exception("enroll photos failed for %s: %s", reg_no, e)
         raise HTTPException(status_code=500, detail=str(e))
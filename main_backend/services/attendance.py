@@ -9,6 +9,8 @@ from ..services.db import SessionLocal
 from ..services import models as m
 from ..services import stream as stream_srv
 from ..services.ws_manager import manager as ws_manager
+from common.log_setup import fields, sampled
+from ..services.model_client import cohort_shards, conference_shard
 
 LOG = logging.getLogger("main_backend.attendance_srv")
 
@@ -20,6 +22,8 @@ class AttendanceManager:
         self.current_session = None
         self._thread = None
         self._stop_event = threading.Event()
+        # monotonic time until which frames are skipped after model_service answered 503
+        self._backoff_until = 0.0
 
     @classmethod
     def get_instance(cls):
@@ -93,6 +97,9 @@ class AttendanceManager:
                     db.refresh(new_session)
                     session_id = new_session.id
                     LOG.info(f"Created AttendanceSession ID={session_id} for {subject_code}")
+                # the shards of the students this session covers, whatever semester they were enrolled in
+                cohort = db.query(m.Student).filter(m.Student.department == department_name, m.Student.semester == semester, m.Student.section == section).all()
+                gallery_shards = cohort_shards(cohort)
             except Exception as e:
                 db.rollback()
                 raise e
@@ -107,6 +114,7 @@ class AttendanceManager:
                 "department": department_name,
                 "semester": semester,
                 "section": section,
+                "gallery_shard": gallery_shards,
                 "start_time": datetime.utcnow()
             }
             self._thread = threading.Thread(target=self._attendance_loop, args=(stream_name, session_id))
@@ -157,6 +165,7 @@ class AttendanceManager:
                 "stream_name": stream_name,
                 "type": "guest",
                 "conference_id": conf.id,
+                "gallery_shard": conference_shard(conference_code),
                 "start_time": datetime.utcnow()
             }
             self._thread = threading.Thread(target=self._attendance_loop, args=(stream_name, session_id))
@@ -278,6 +287,7 @@ class AttendanceManager:
 
                 now = time.time()
                 if now - last_process_time < interval: continue
+                if time.monotonic() < self._backoff_until: continue
                 last_process_time = now
 
                 import base64
@@ -296,15 +306,40 @@ class AttendanceManager:
             LOG.info("attendance loop terminated")
 
     async def _process_frame_async(self, image_b64, eligible_ids, id_to_details, session_id):
-        from ..services.model_client import get_headers_async
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
+        from ..services.model_client import deadline_header, get_headers_async, parse_server_timing, retry_after_seconds
+
+        # only the session's cohort (or conference) is searched
+        payload = {"image_b64": image_b64}
+        shard = (self.current_session or {}).get("gallery_shard")
+        if shard:
+            payload["shard"] = shard
+
+        async with httpx.AsyncClient(timeout=config.RECOGNITION_TIMEOUT_SECONDS) as client:
             try:
                 # LOG.debug("Getting headers for recognition request...")
-                headers = await get_headers_async()
+                headers = {**await get_headers_async(), **deadline_header(config.RECOGNITION_TIMEOUT_SECONDS)}
+                # the model service rate-limits each camera on its own, not the shared API key as a whole
+                headers["X-Stream-Id"] = (self.current_session or {}).get("stream_name") or ""
                 # LOG.debug("Sending frame to recognition service...")
-                resp = await client.post(f"{config.MODEL_SERVICE_URL}/recognise", json={"image_b64": image_b64}, headers=headers)
-                
+                started = time.perf_counter()
+                resp = await client.post(f"{config.MODEL_SERVICE_URL}/recognise", json=payload, headers=headers)
+                elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+                if elapsed_ms > config.RECOGNITION_LATENCY_BUDGET_MS:
+                    # per-stage breakdown from the model service, so slow cameras can be told apart
+                    stages = parse_server_timing(resp.headers.get("server-timing"))
+                    LOG.warning(
+                        "Recognition over latency budget",
+                        extra=fields(session=session_id, status=resp.status_code, ms=round(elapsed_ms, 2),
+                                     budget_ms=config.RECOGNITION_LATENCY_BUDGET_MS, **stages),
+                    )
+
+                if resp.status_code == 503:
+                    # model_service's inference queue is full: drop frames until it asks us back
+                    retry_after = retry_after_seconds(resp.headers.get("retry-after"))
+                    self._backoff_until = time.monotonic() + retry_after
+                    LOG.warning("Recognition service overloaded; skipping frames", extra=fields(session=session_id, retry_after_s=retry_after))
+                    return
                 if resp.status_code != 200:
                     LOG.error("Recognition service returned status %s: %s", resp.status_code, resp.text)
                     return
@@ -354,10 +389,10 @@ class AttendanceManager:
         
         if not recognized_map: return
 
-        # Log each recognized identity with its confidence (rounded to 2 decimals)
+        # Log each recognized identity with its confidence (rounded to 2 decimals); one line per frame, so sampled
         try:
             entries = [f"{ident} (confidence: {conf:.2f})" for ident, conf in recognized_map.items()]
-            LOG.info("Recognized: %s", ", ".join(entries))
+            LOG.info("Recognized: %s", ", ".join(entries), extra=sampled(config.LOG_SAMPLE_EVERY, session=session_id, faces=len(entries)))
         except Exception:
             # Fallback to previous behaviour in case of unexpected types
             LOG.info("Recognized: %s", recognized_map.keys())
@@ -1,7 +1,8 @@
+import re
 import threading
 import asyncio
 import time
-from typing import Optional, Dict
+from typing import Dict, Iterable, Optional
 import httpx
 import jwt
 
@@ -202,3 +203,67 @@ async def get_headers_async() -> Dict[str, str]:
     if _access_token:
         headers["Authorization"] = f"Bearer {_access_token}"
     return headers
+
+
+def deadline_header(timeout_seconds: float) -> Dict[str, str]:
+    """X-Request-Deadline-Ms header telling the model service how long we will wait for this call."""
+    return {"X-Request-Deadline-Ms": str(int(timeout_seconds * 1000))}
+
+
+def gallery_shard(*parts) -> str:
+    """Model-service gallery shard for a cohort, e.g. ("CSE", "sem5") -> "CSE/sem5".
+
+    Characters the model service does not accept in shard names become "_".
+    """
+    return "/".join(re.sub(r"[^A-Za-z0-9_.-]", "_", str(p).strip()).lstrip(".") or "_" for p in parts)
+
+
+def admission_year(reg_no) -> Optional[str]:
+    """The year a registration number starts with ("202200248" -> "2022"), or None."""
+    match = re.match(r"((?:19|20)\d\d)\d", str(reg_no).strip())
+    return match.group(1) if match else None
+
+
+def student_shard(department: str, reg_no) -> str:
+    """Gallery shard a student is enrolled into: department plus admission year, e.g. "CSE/batch2022".
+
+    Unlike the semester, the admission year never changes, so moving up a
+    semester needs no re-enrollment. Registration numbers without a leading
+    year share the department's "students" shard.
+    """
+    year = admission_year(reg_no)
+    return gallery_shard(department, f"batch{year}" if year else "students")
+
+
+def cohort_shards(students: Iterable) -> str:
+    """Comma-separated shards holding these students (repeaters can come from an earlier batch)."""
+    return ",".join(sorted({student_shard(s.department, s.reg_no) for s in students}))
+
+
+def conference_shard(code: str) -> str:
+    return gallery_shard("conference", code)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Parse a Server-Timing header ("detect;dur=12.3, search;dur=0.4") into {stage: ms}."""
+    out: Dict[str, float] = {}
+    if not header:
+        return out
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    out[name.strip()] = float(value)
+                except ValueError:
+                    pass
+    return out
+
+
+def retry_after_seconds(header: Optional[str], default: float = 1.0) -> float:
+    """Seconds from a Retry-After header (delta-seconds form), or `default` when absent/unparsable."""
+    try:
+        return max(0.0, float(header)) if header else default
+    except ValueError:
+        return default
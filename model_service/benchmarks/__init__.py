@@ -0,0 +1 @@
+"""Offline benchmarks for model_service. Not imported by the service itself."""
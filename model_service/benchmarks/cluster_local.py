@@ -0,0 +1,89 @@
+"""Run a coordinator and N gallery peers as local processes, for trying scatter-gather search.
+
+Usage:
+  python -m model_service.benchmarks.cluster_local --peers 3 --base-port 8100 --fake
+
+Peer i listens on ``--base-port + 1 + i`` with its own ``ARC_DB_DIR`` under
+``--data-dir`` (one gallery partition each); the coordinator listens on
+``--base-port`` with ``CLUSTER_PEERS`` pointing at them. Every process gets
+the same ``CLUSTER_SECRET``. With ``--fake`` all of them use the fake
+backend, so the load generator can drive the cluster without model weights:
+
+  python -m model_service.benchmarks.loadgen --url http://localhost:8100 --enroll-first ...
+
+Ctrl-C stops every process.
+"""
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--peers", type=int, default=2, help="gallery partitions, one peer process each")
+    p.add_argument("--base-port", type=int, default=8100, help="coordinator port; peers use the next ports")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--data-dir", default=None, help="parent of the peers' ARC_DB_DIRs (default: a temp dir)")
+    p.add_argument("--partition-by", choices=("identity", "shard"), default="identity")
+    p.add_argument("--fake", action="store_true", help="run every process with MODEL_SERVICE_FAKE_BACKEND=1")
+    return p
+
+
+def process_envs(args) -> List[Dict[str, str]]:
+    """Environment overrides for the coordinator (first) and each peer."""
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="model_service_cluster_")
+    common = {"CLUSTER_SECRET": secrets.token_hex(16), "CLUSTER_PARTITION_BY": args.partition_by}
+    if args.fake:
+        common["MODEL_SERVICE_FAKE_BACKEND"] = "1"
+    peers = []
+    for i in range(args.peers):
+        port = args.base_port + 1 + i
+        peers.append(
+            dict(
+                common,
+                HYPERCORN_BIND=f"{args.host}:{port}",
+                ARC_DB_DIR=os.path.join(data_dir, f"peer{i}"),
+                AUTH_DATABASE_URL=f"sqlite:///{os.path.join(data_dir, f'peer{i}_auth.db')}",
+            )
+        )
+    coordinator = dict(
+        common,
+        HYPERCORN_BIND=f"{args.host}:{args.base_port}",
+        ARC_DB_DIR=os.path.join(data_dir, "coordinator"),
+        AUTH_DATABASE_URL=f"sqlite:///{os.path.join(data_dir, 'coordinator_auth.db')}",
+        CLUSTER_PEERS=",".join(f"http://{p['HYPERCORN_BIND']}" for p in peers),
+    )
+    return [coordinator] + peers
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    procs = []
+    try:
+        for env in process_envs(args):
+            procs.append(subprocess.Popen([sys.executable, "-m", "model_service"], env=dict(os.environ, **env)))
+            print(f"started pid={procs[-1].pid} on {env['HYPERCORN_BIND']} (ARC_DB_DIR={env['ARC_DB_DIR']})", flush=True)
+        while all(p.poll() is None for p in procs):
+            time.sleep(0.5)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.send_signal(signal.SIGINT)
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
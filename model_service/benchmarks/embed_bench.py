@@ -0,0 +1,119 @@
+"""Face-embedding batch-size benchmark.
+
+Usage:
+  python -m model_service.benchmarks.embed_bench --faces 32 --batch-sizes 1,4,8,16,32
+  python -m model_service.benchmarks.embed_bench --fake --call-ms 8 --per-face-ms 0.5
+
+Embeds one frame's worth of face crops with ``recognizer.embed_faces`` at each
+batch size (the ``EMBED_BATCH_SIZE`` knob) and reports, per batch size, the
+forward passes per frame and p50/p99/mean latency per frame and per face.
+Output is JSON (one object per batch size under ``results``).
+
+By default the active recognizer is built as the service would (ArcFace via
+DeepFace, fp32 or quantized per ``RECOGNIZER_VARIANT``). With ``--fake`` the
+fake backend's recognizer is used instead, each forward pass costing
+``--call-ms`` plus ``--per-face-ms`` per face (``FAKE_STAGE_COSTS_MS``), so
+the effect of batching on the fixed per-call overhead can be checked
+without model weights.
+"""
+import argparse
+import json
+import sys
+import time
+from typing import Sequence
+
+import numpy as np
+
+from .. import config
+from ..services import recognizer
+
+
+def make_faces(count: int, size: int = 112, seed: int = 0):
+    """Random RGB crops in [0, 1], shaped like extract_faces output."""
+    rng = np.random.default_rng(seed)
+    return [rng.random((size, size, 3), dtype=np.float32) for _ in range(count)]
+
+
+def run_batch_size(faces, batch_size: int, repeats: int) -> dict:
+    rec = recognizer.get_active()
+    calls = []
+    embed = rec.embed
+
+    def counting(batch):
+        calls.append(batch.shape[0])
+        return embed(batch)
+
+    rec.embed = counting
+    try:
+        recognizer.embed_faces(faces, batch_size)  # warm-up, not timed
+        calls.clear()
+        latencies = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            recognizer.embed_faces(faces, batch_size)
+            latencies.append(time.perf_counter() - t0)
+    finally:
+        del rec.embed
+
+    lat_ms = np.asarray(latencies) * 1000.0
+    return {
+        "batch_size": batch_size,
+        "faces": len(faces),
+        "forward_passes": len(calls) // repeats,
+        "p50_ms": round(float(np.percentile(lat_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(lat_ms, 99)), 4),
+        "mean_ms": round(float(lat_ms.mean()), 4),
+        "per_face_ms": round(float(lat_ms.mean()) / len(faces), 4),
+        "repeats": repeats,
+    }
+
+
+def run(faces: int = 32, batch_sizes: Sequence[int] = (1, 4, 8, 16, 32), repeats: int = 20) -> dict:
+    crops = make_faces(faces)
+    rec = recognizer.get_active()
+    results = []
+    for batch_size in batch_sizes:
+        res = run_batch_size(crops, batch_size, repeats)
+        results.append(res)
+        print(
+            f"[embed_bench] batch={batch_size}: {res['forward_passes']} passes, "
+            f"p50={res['p50_ms']}ms/frame, {res['per_face_ms']}ms/face",
+            file=sys.stderr,
+        )
+    return {"variant": rec.variant, "faces_per_frame": faces, "results": results}
+
+
+def _csv(s: str):
+    return [int(x) for x in s.split(",") if x]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=32, help="face crops per frame")
+    parser.add_argument("--batch-sizes", type=_csv, default=[1, 4, 8, 16, 32], help="comma separated")
+    parser.add_argument("--repeats", type=int, default=20, help="timed frames per batch size")
+    parser.add_argument("--fake", action="store_true", help="use the fake backend's recognizer")
+    parser.add_argument("--call-ms", type=float, default=8.0, help="--fake: cost of one forward pass")
+    parser.add_argument("--per-face-ms", type=float, default=0.5, help="--fake: added cost per face in a pass")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        from ..services import fake_backend
+
+        config.FAKE_BACKEND = True
+        config.FAKE_STAGE_COSTS_MS = {"represent": args.call_ms, "represent_per_face": args.per_face_ms}
+        recognizer.set_active(fake_backend.FakeRecognizer())
+
+    report = run(args.faces, args.batch_sizes, args.repeats)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""Headless concurrent load generator for model_service.
+
+Usage:
+  python -m model_service.benchmarks.loadgen --url http://localhost:8080 \\
+      --cameras 8 --fps 2 --enrollers 1 --enroll-rate 0.2 --duration 60 --images photos/
+
+Each simulated camera posts one frame to /recognise every ``1/fps`` seconds
+and each enroller posts ``--photos-per-enroll`` images for a fresh identity to
+/refresh-db at ``--enroll-rate`` per second. Requests are sent on a fixed
+schedule (open loop) whether or not earlier ones finished, and latency is
+measured from the scheduled send time, so a backed-up server shows up as
+latency instead of as a lower offered rate.
+
+Without ``--images``, random bytes stand in for photos; that only works
+against a service started with ``MODEL_SERVICE_FAKE_BACKEND=1`` (see
+``services/fake_backend.py``), where stage costs come from
+``FAKE_STAGE_COSTS_MS``. Enrollers draw from the same image pool as the
+cameras, so frames match enrolled identities.
+
+The report (JSON on stdout or ``--out``) has, per request kind, the offered
+and achieved rate, latency percentiles, status code counts and client-side
+errors; with ``--deadline-ms``, requests the service dropped as too late show
+up as 504s. All traffic uses one API key, so raise ``RATE_LIMIT_*`` on the
+service when the offered rate exceeds the per-key limits (or count the 429s).
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from typing import List, Optional
+
+import httpx
+import numpy as np
+
+
+class Stats:
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.scheduled = 0
+
+    def record(self, latency: float, status: Optional[int] = None, error: Optional[str] = None) -> None:
+        self.latencies.append(latency)
+        if status is not None:
+            self.statuses[str(status)] += 1
+        if error is not None:
+            self.errors[error] += 1
+
+    def report(self, duration: float) -> dict:
+        lat = np.asarray(self.latencies) * 1000.0
+        ok = self.statuses.get("200", 0)
+        out = {
+            "scheduled": self.scheduled,
+            "completed": len(self.latencies),
+            "offered_rps": round(self.scheduled / duration, 3),
+            "throughput_rps": round(len(self.latencies) / duration, 3),
+            "ok_rps": round(ok / duration, 3),
+            "status_codes": dict(self.statuses),
+            "errors": dict(self.errors),
+        }
+        if lat.size:
+            out.update(
+                {
+                    "p50_ms": round(float(np.percentile(lat, 50)), 2),
+                    "p90_ms": round(float(np.percentile(lat, 90)), 2),
+                    "p99_ms": round(float(np.percentile(lat, 99)), 2),
+                    "max_ms": round(float(lat.max()), 2),
+                    "mean_ms": round(float(lat.mean()), 2),
+                }
+            )
+        return out
+
+
+def load_images(path: Optional[str], count: int, seed: int) -> List[bytes]:
+    if path:
+        files = sorted(
+            os.path.join(root, f)
+            for root, _, names in os.walk(path)
+            for f in names
+            if f.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+        if not files:
+            raise SystemExit(f"no images under {path}")
+        images = []
+        for f in files[:count] if count else files:
+            with open(f, "rb") as fh:
+                images.append(fh.read())
+        return images
+    # fake-backend only: any bytes work, distinct bytes give distinct identities
+    rng = random.Random(seed)
+    return [rng.randbytes(30_000) for _ in range(count or 50)]
+
+
+async def get_api_key(client: httpx.AsyncClient, username: str, password: str) -> str:
+    await client.post("/register", data={"username": username, "password": password})
+    r = await client.post("/apikey/create", data={"username": username, "password": password})
+    r.raise_for_status()
+    return r.json()["api_key"]
+
+
+async def _timed(stats: Stats, scheduled_at: float, send) -> None:
+    try:
+        resp = await send()
+        stats.record(time.perf_counter() - scheduled_at, status=resp.status_code)
+    except httpx.HTTPError as exc:
+        stats.record(time.perf_counter() - scheduled_at, error=type(exc).__name__)
+
+
+async def _schedule(interval: float, deadline: float, jitter: float, fire, stats: Stats, tasks: set, sem: asyncio.Semaphore):
+    """Call fire(scheduled_at) every `interval` seconds until `deadline` without waiting for replies."""
+    next_at = time.perf_counter() + random.uniform(0, jitter)
+    while next_at < deadline:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        stats.scheduled += 1
+        scheduled_at = next_at
+
+        async def run(at=scheduled_at):
+            async with sem:
+                await fire(at)
+
+        task = asyncio.create_task(run())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_at += interval
+
+
+async def run_load(args, transport: Optional[httpx.AsyncBaseTransport] = None) -> dict:
+    """Run the load described by parsed `args`; `transport` lets tests drive an in-process app."""
+    images = load_images(args.images, args.pool, args.seed)
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits, transport=transport) as client:
+        api_key = args.api_key or await get_api_key(client, args.username or f"loadgen_{uuid.uuid4().hex[:8]}", args.password)
+        headers = {"X-API-KEY": api_key}
+        if args.deadline_ms > 0:
+            # like main_backend: the service drops frames still queued once this budget is spent
+            headers["X-Request-Deadline-Ms"] = str(int(args.deadline_ms))
+
+        recognise, enroll = Stats("recognise"), Stats("refresh-db")
+        sem = asyncio.Semaphore(args.max_in_flight)
+        tasks: set = set()
+
+        if args.enroll_first:
+            for i, img in enumerate(images):
+                files = [("files", (f"{i}.jpg", img, "image/jpeg"))]
+                await client.post("/refresh-db", data={"identity": f"load_{i}"}, files=files, headers=headers)
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+
+        def camera(cam: int):
+            rng = random.Random(args.seed + cam)
+
+            async def fire(at):
+                body = {"image_b64": base64.b64encode(rng.choice(images)).decode()}
+                await _timed(recognise, at, lambda: client.post("/recognise", json=body, headers=headers))
+
+            return fire
+
+        def enroller(n: int):
+            rng = random.Random(args.seed * 7919 + n)
+
+            async def fire(at):
+                picks = [rng.choice(images) for _ in range(args.photos_per_enroll)]
+                files = [("files", (f"{i}.jpg", img, "image/jpeg")) for i, img in enumerate(picks)]
+                data = {"identity": f"load_{n}_{uuid.uuid4().hex[:8]}"}
+                await _timed(enroll, at, lambda: client.post("/refresh-db", data=data, files=files, headers=headers))
+
+            return fire
+
+        schedulers = [
+            _schedule(1.0 / args.fps, deadline, 1.0 / args.fps, camera(c), recognise, tasks, sem) for c in range(args.cameras)
+        ]
+        if args.enroll_rate > 0:
+            schedulers += [
+                _schedule(1.0 / args.enroll_rate, deadline, 1.0 / args.enroll_rate, enroller(e), enroll, tasks, sem)
+                for e in range(args.enrollers)
+            ]
+        await asyncio.gather(*schedulers)
+        # let in-flight requests finish (they are bounded by the client timeout)
+        if tasks:
+            await asyncio.gather(*list(tasks))
+        elapsed = time.perf_counter() - start
+
+    report = {
+        "config": {
+            "url": args.url,
+            "cameras": args.cameras,
+            "fps_per_camera": args.fps,
+            "enrollers": args.enrollers,
+            "enroll_rate_per_enroller": args.enroll_rate,
+            "duration_s": args.duration,
+            "images": len(images),
+            "max_in_flight": args.max_in_flight,
+            "deadline_ms": args.deadline_ms,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "recognise": recognise.report(args.duration),
+    }
+    if enroll.scheduled:
+        report["refresh_db"] = enroll.report(args.duration)
+    return report
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--url", default=os.environ.get("MODEL_SERVICE_URL", "http://localhost:8080"))
+    p.add_argument("--api-key", default=os.environ.get("MODEL_SERVICE_API_KEY"))
+    p.add_argument("--username", default=os.environ.get("MODEL_SERVICE_USER"), help="registered if needed (default: random)")
+    p.add_argument("--password", default=os.environ.get("MODEL_SERVICE_PASS", "loadgen"))
+    p.add_argument("--cameras", type=int, default=4)
+    p.add_argument("--fps", type=float, default=1.0, help="frames per second per camera")
+    p.add_argument("--enrollers", type=int, default=0)
+    p.add_argument("--enroll-rate", type=float, default=0.1, help="/refresh-db calls per second per enroller")
+    p.add_argument("--photos-per-enroll", type=int, default=3)
+    p.add_argument("--enroll-first", action="store_true", help="enroll every pool image (identity load_<i>) before the run")
+    p.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    p.add_argument("--images", help="directory of photos (required unless the service runs the fake backend)")
+    p.add_argument("--pool", type=int, default=0, help="max images to load / synthesise (0: all, or 50 synthetic)")
+    p.add_argument("--max-in-flight", type=int, default=256, help="cap on concurrent requests from this client")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--deadline-ms", type=float, default=0, help="send X-Request-Deadline-Ms with every request (0: none)")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--out", help="write the JSON report here instead of stdout")
+    return p
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    report = asyncio.run(run_load(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Gallery search micro-benchmark.
+
+Usage:
+  python -m model_service.benchmarks.search_bench
+  python -m model_service.benchmarks.search_bench --sizes 1000,100000,1000000 --missing 0,0.05 --out search.json
+
+Builds synthetic galleries of L2-normalised 512-d embeddings (several rows per
+identity, a fraction of rows with no embedding, as the PKL holds for photos
+where no face was found) and times every registered search kernel on the
+same probes. Each probe batch is one frame's worth of faces.
+
+Per (size, missing fraction, kernel) it reports build time, p50/p99/mean
+search latency per frame, memory held by the kernel's index, and recall@1
+against the identity each probe was drawn from. Output is JSON (one object
+per run under ``results``).
+
+Kernels:
+  legacy_find_batched  search half of the DeepFace ``find_batched`` patch: the
+                       (N, D) matrix and metadata arrays are rebuilt from the
+                       records on every call, then filtered and sorted per face
+  gallery_index        services.gallery.GalleryIndex (resident, row-normalised)
+  gallery_index_fp16   GalleryIndex with the matrix stored as float16
+
+Add a kernel by registering a ``build(records) -> (search_fn, index_bytes)``
+factory in ``KERNELS``; ``search_fn(probes)`` returns the best identity per probe.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+from ..services.gallery import GalleryIndex
+
+SearchFn = Callable[[np.ndarray], List[str]]
+EMBEDDING_DIM = 512
+
+
+def make_gallery(size: int, missing: float = 0.0, rows_per_identity: int = 3, noise: float = 0.35, seed: int = 0):
+    """Synthetic records shaped like the PKL rows, plus the identity centres used to draw probes."""
+    rng = np.random.default_rng(seed)
+    n_ids = max(1, size // rows_per_identity)
+    centres = rng.standard_normal((n_ids, EMBEDDING_DIM)).astype(np.float32)
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+
+    owner = np.arange(size) % n_ids
+    rows = centres[owner] + (noise / np.sqrt(EMBEDDING_DIM)) * rng.standard_normal((size, EMBEDDING_DIM)).astype(np.float32)
+    rows = (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+    empty = rng.random(size) < missing
+
+    records = [
+        {
+            "identity": f"id{owner[i]:07d}",
+            "hash": f"id{owner[i]:07d}_{i}",
+            "embedding": None if empty[i] else rows[i],
+            "target_x": 0,
+            "target_y": 0,
+            "target_w": 0,
+            "target_h": 0,
+        }
+        for i in range(size)
+    ]
+    return records, centres, owner, empty
+
+
+def make_probes(centres: np.ndarray, owner: np.ndarray, empty: np.ndarray, count: int, noise: float = 0.35, seed: int = 1):
+    """Noisy views of identities that still have at least one embedding; returns (probes, true identities)."""
+    rng = np.random.default_rng(seed)
+    enrolled = np.unique(owner[~empty])
+    picks = rng.choice(enrolled, size=count)
+    probes = centres[picks] + (noise / np.sqrt(EMBEDDING_DIM)) * rng.standard_normal((count, EMBEDDING_DIM)).astype(np.float32)
+    return probes.astype(np.float32), [f"id{p:07d}" for p in picks]
+
+
+def _legacy_find_batched(records, threshold: float) -> Tuple[SearchFn, int]:
+    def search(probes: np.ndarray) -> List[str]:
+        embeddings_list, valid_mask, metadata = [], [], set()
+        for item in records:
+            emb = item.get("embedding")
+            if emb is not None:
+                embeddings_list.append(emb)
+                valid_mask.append(True)
+            else:
+                embeddings_list.append(np.zeros_like(embeddings_list[0]) if embeddings_list else np.zeros(EMBEDDING_DIM, np.float32))
+                valid_mask.append(False)
+            metadata.update(item.keys())
+        metadata.discard("embedding")
+        embeddings = np.array(embeddings_list)
+        valid = np.array(valid_mask)
+        data = {key: np.array([item.get(key, None) for item in records]) for key in metadata}
+
+        # verification.find_cosine_distance on batches: normalise both sides, 1 - dot
+        a = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        b = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+        distances = 1.0 - b @ a.T
+        distances[:, ~valid] = np.inf
+
+        best = []
+        for i in range(probes.shape[0]):
+            mask = distances[i] <= threshold
+            if not mask.any():
+                best.append(None)
+                continue
+            filtered = {key: value[mask] for key, value in data.items()}
+            order = np.argsort(distances[i][mask])
+            best.append(str(filtered["identity"][order][0]))
+        return best
+
+    # the records themselves are the legacy index
+    held = sum(r["embedding"].nbytes for r in records if r["embedding"] is not None)
+    return search, held
+
+
+def _gallery_index(records, threshold: float, dtype=np.float32) -> Tuple[SearchFn, int]:
+    index = GalleryIndex.from_records(records)
+    if dtype != np.float32:
+        index.matrix = index.matrix.astype(dtype)
+
+    def search(probes: np.ndarray) -> List[str]:
+        best, dist = index.search(probes, metric="cosine")
+        ids = index.identities
+        return [str(ids[b]) if d <= threshold else None for b, d in zip(best.tolist(), dist.tolist())]
+
+    return search, int(index.matrix.nbytes + index.norms.nbytes)
+
+
+KERNELS: Dict[str, Callable[..., Tuple[SearchFn, int]]] = {
+    "legacy_find_batched": _legacy_find_batched,
+    "gallery_index": _gallery_index,
+    "gallery_index_fp16": lambda records, threshold: _gallery_index(records, threshold, np.float16),
+}
+
+
+def run_kernel(name: str, records, probes: np.ndarray, truth: Sequence[str], faces_per_frame: int, repeats: int, threshold: float) -> dict:
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    search, index_bytes = KERNELS[name](records, threshold)
+    build_s = time.perf_counter() - t0
+    _, build_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies, hits, total = [], 0, 0
+    for r in range(repeats):
+        start = (r * faces_per_frame) % len(probes)
+        batch = probes[start:start + faces_per_frame]
+        expected = truth[start:start + faces_per_frame]
+        t0 = time.perf_counter()
+        found = search(batch)
+        latencies.append(time.perf_counter() - t0)
+        hits += sum(1 for f, e in zip(found, expected) if f == e)
+        total += len(expected)
+
+    lat_ms = np.asarray(latencies) * 1000.0
+    return {
+        "kernel": name,
+        "build_s": round(build_s, 4),
+        "build_peak_bytes": int(build_peak),
+        "index_bytes": int(index_bytes),
+        "p50_ms": round(float(np.percentile(lat_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(lat_ms, 99)), 4),
+        "mean_ms": round(float(lat_ms.mean()), 4),
+        "recall_at_1": round(hits / total, 4) if total else None,
+        "repeats": repeats,
+    }
+
+
+def run(sizes: Sequence[int], missing: Sequence[float], kernels: Sequence[str], faces_per_frame: int = 4, repeats: int = 50, threshold: float = None) -> dict:
+    threshold = float(threshold if threshold is not None else (config.THRESHOLD or 0.68))
+    results = []
+    for size in sizes:
+        for frac in missing:
+            records, centres, owner, empty = make_gallery(size, frac)
+            probes, truth = make_probes(centres, owner, empty, count=max(faces_per_frame * repeats, 64))
+            for name in kernels:
+                res = run_kernel(name, records, probes, truth, faces_per_frame, repeats, threshold)
+                res.update({"gallery_size": size, "missing_fraction": frac, "faces_per_frame": faces_per_frame})
+                results.append(res)
+                print(
+                    f"[search_bench] n={size} missing={frac} {name}: p50={res['p50_ms']}ms p99={res['p99_ms']}ms "
+                    f"recall@1={res['recall_at_1']} index={res['index_bytes'] / 1e6:.1f}MB",
+                    file=sys.stderr,
+                )
+    return {"dim": EMBEDDING_DIM, "threshold": threshold, "metric": "cosine", "results": results}
+
+
+def _csv(cast):
+    return lambda s: [cast(x) for x in s.split(",") if x]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=_csv(int), default=[1000, 10000, 100000], help="gallery rows, comma separated")
+    parser.add_argument("--missing", type=_csv(float), default=[0.0, 0.05], help="fractions of rows without an embedding")
+    parser.add_argument("--kernels", type=_csv(str), default=list(KERNELS), help="kernels to run")
+    parser.add_argument("--faces-per-frame", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=50, help="timed frames per run")
+    parser.add_argument("--threshold", type=float, default=None, help="cosine distance threshold (default config.THRESHOLD)")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    unknown = [k for k in args.kernels if k not in KERNELS]
+    if unknown:
+        parser.error(f"unknown kernels: {', '.join(unknown)}")
+
+    report = run(args.sizes, args.missing, args.kernels, args.faces_per_frame, args.repeats, args.threshold)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
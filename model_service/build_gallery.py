@@ -0,0 +1,298 @@
+"""Build the gallery offline from a directory tree or CSV manifest of photos.
+
+Usage:
+  python -m model_service.build_gallery --images /data/id_photos --shard CSE/sem5
+  python -m model_service.build_gallery --manifest photos.csv --workers 8 --batch-size 64
+
+``--images`` uses DeepFace's db layout: one sub-directory per identity holding
+that person's photos. ``--manifest`` is a CSV with ``path`` and ``identity``
+columns and an optional ``shard`` column; relative paths are resolved against
+the CSV's directory. Rows without a shard go to ``--shard`` (the default
+gallery when omitted).
+
+Photos are cut into batches of ``--batch-size``. Each of the ``--workers``
+processes decodes and detects a batch with ENROLL_DETECTOR_CASCADE, keeps
+the largest face of every photo (ID photos show one person) and embeds the
+whole batch in one recognizer call. Records (and, with
+KEEP_ENROLLMENT_CROPS, crops) are written straight into the shards' PKL
+files and crop stores in the same format /refresh-db writes, without going
+through the service. Stop the service while building, or build into a fresh
+ARC_DB_DIR, and restart it afterwards.
+
+Progress is checkpointed every ``--checkpoint`` photos to a state file in
+ARC_DB_DIR. Run the same command again after an interruption and it carries
+on from the last checkpoint; ``--fresh`` starts over. Photos that fail (no
+face, unreadable) are listed under ``failed`` in the state file and are not
+retried. Throughput is printed at every checkpoint.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class Photo(NamedTuple):
+    path: str
+    identity: str
+    shard: Optional[str] = None
+
+
+def scan_directory(root: str, shard: Optional[str] = None) -> List[Photo]:
+    """Every image under `root`, labelled with the name of the directory holding it."""
+    photos = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(_IMAGE_EXTENSIONS):
+                photos.append(Photo(os.path.abspath(os.path.join(dirpath, name)), os.path.basename(dirpath), shard))
+    return sorted(photos)
+
+
+def read_manifest(path: str, shard: Optional[str] = None) -> List[Photo]:
+    """Photos listed in a CSV manifest with path, identity and optional shard columns."""
+    base = os.path.dirname(os.path.abspath(path))
+    photos = []
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        missing = {"path", "identity"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Manifest {path} lacks column(s): {', '.join(sorted(missing))}")
+        for row in reader:
+            if not row["path"] or not row["identity"]:
+                continue
+            photos.append(Photo(os.path.abspath(os.path.join(base, row["path"])), row["identity"].strip(), (row.get("shard") or "").strip() or shard))
+    return photos
+
+
+def _init_worker() -> None:
+    from .services import recognizer
+
+    recognizer.get_active()
+
+
+def process_batch(job: Tuple[List[Photo], int]) -> List[Tuple[Photo, Optional[dict], Optional[np.ndarray], Optional[str]]]:
+    """Detect and embed a batch of photos: (photo, record, crop, error) for each, in order."""
+    from .services import arcface_refresh, crop_store, face_detection, image_prep, pipeline, recognizer
+
+    photos, batch_size = job
+    _, detection, modeling = pipeline._deepface()
+    results: List[Any] = [None] * len(photos)
+    found = []
+    for i, photo in enumerate(photos):
+        try:
+            img, scale = pipeline.load_scaled(photo.path, config.PREP_MAX_SIDE_ENROLL)
+            faces = face_detection.detect(detection, img, "enroll", modeling)
+        except Exception as exc:
+            results[i] = (photo, None, None, str(exc))
+            continue
+        if not faces:
+            results[i] = (photo, None, None, "no face detected")
+            continue
+        found.append((i, max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"]), arcface_refresh.content_hash(img), scale))
+
+    embeddings = recognizer.embed_faces([face["face"] for _, face, _, _ in found], batch_size)
+    for (i, face, digest, scale), emb in zip(found, embeddings):
+        photo, area, emb = photos[i], image_prep.to_original(face["facial_area"], scale), emb.tolist()
+        record = {
+            "identity": photo.identity,
+            # same layout as add_face_arcface writes
+            "embedding": emb,
+            "rep": emb,
+            "representations": emb,
+            "model": config.MODEL_NAME,
+            "target_x": int(area["x"]),
+            "target_y": int(area["y"]),
+            "target_w": int(area["w"]),
+            "target_h": int(area["h"]),
+            "hash": digest,
+        }
+        crop = crop_store.to_crop(face["face"]) if config.KEEP_ENROLLMENT_CROPS else None
+        results[i] = (photo, record, crop, None)
+    return results
+
+
+class Build:
+    """The galleries being built plus the resumable state: rows and crops per shard, photos done."""
+
+    def __init__(self, state_path: str, source: str, shards: List[Optional[str]], fresh: bool):
+        from .services import arcface_refresh, crop_store
+
+        self.state_path = state_path
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        state = None
+        if not fresh and os.path.exists(state_path):
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            if state["source"] != source:
+                raise ValueError(f"{state_path} belongs to a build of {state['source']}; pass --fresh to start over")
+        self.state = state or {"source": source, "shards": {}, "done": [], "failed": {}}
+        self.done = set(self.state["done"]) | set(self.state["failed"])
+        self.records: Dict[Optional[str], list] = {}
+        self.enrolled: Dict[Optional[str], set] = {}
+        self.duplicates = 0
+        self.pending: Dict[Optional[str], Tuple[list, list]] = {}
+        for shard in shards:
+            records = arcface_refresh.load_db(shard)
+            mark = self.state["shards"].get(shard or "")
+            if mark is None:
+                mark = self.state["shards"][shard or ""] = {"rows": len(records), "crops": len(crop_store.store(shard))}
+            # rows or crops written after the last checkpoint belong to photos that will be processed again
+            del records[mark["rows"]:]
+            crop_store.store(shard).truncate(mark["crops"])
+            self.records[shard] = records
+            self.enrolled[shard] = {(r.get("identity"), r.get("hash")) for r in records}
+        self._save_state()
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+
+    def add(self, photo: Photo, record: Optional[dict], crop: Optional[np.ndarray], error: Optional[str]) -> None:
+        if error is not None:
+            self.state["failed"][photo.path] = error
+            return
+        self.state["done"].append(photo.path)
+        key = (record["identity"], record["hash"])
+        if key in self.enrolled[photo.shard]:
+            # the same image is already in the gallery (e.g. a copy elsewhere in the tree)
+            self.duplicates += 1
+            return
+        self.enrolled[photo.shard].add(key)
+        self.records[photo.shard].append(record)
+        records, crops = self.pending.setdefault(photo.shard, ([], []))
+        records.append(record)
+        crops.append(crop)
+
+    def checkpoint(self) -> None:
+        """Write every shard that changed, then record the progress."""
+        from .services import arcface_refresh, crop_store
+
+        for shard, (records, crops) in self.pending.items():
+            arcface_refresh.save_db(self.records[shard], shard)
+            store = crop_store.store(shard)
+            if config.KEEP_ENROLLMENT_CROPS:
+                store.append(records, crops)
+            self.state["shards"][shard or ""] = {"rows": len(self.records[shard]), "crops": len(store)}
+        self.pending = {}
+        self._save_state()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="directory of photos, one sub-directory per identity")
+    source.add_argument("--manifest", help="CSV with path, identity and optional shard columns")
+    parser.add_argument("--shard", default=None, help="gallery shard for photos without one (default: the default gallery)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="detection/embedding processes (0: run in this process)")
+    parser.add_argument("--batch-size", type=int, default=config.EMBED_BATCH_SIZE, help="photos per batch, embedded in one call")
+    parser.add_argument("--checkpoint", type=int, default=1000, help="photos between writes of the gallery and the resume state")
+    parser.add_argument("--state", default=None, help="resume state file (default: ARC_DB_DIR/build_gallery.state.json)")
+    parser.add_argument("--fresh", action="store_true", help="ignore any previous state and start over")
+    args = parser.parse_args(argv)
+
+    from .services import gallery, replication
+
+    if replication.is_replica():
+        print("[build] this node is a read-only gallery replica; build on its primary")
+        return 1
+    try:
+        if args.images:
+            photos = scan_directory(args.images, args.shard or None)
+        else:
+            photos = read_manifest(args.manifest, args.shard or None)
+        shards = sorted({p.shard for p in photos}, key=lambda s: s or "")
+        for shard in shards:
+            gallery.shard_path(shard)  # validates
+        build = Build(
+            args.state or os.path.join(config.ARC_DB_DIR, "build_gallery.state.json"),
+            os.path.abspath(args.images or args.manifest),
+            shards,
+            args.fresh,
+        )
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    todo = [p for p in photos if p.path not in build.done]
+    print(f"[build] {len(photos)} photos, {len(photos) - len(todo)} already done, {len(todo)} to go")
+    batches = [(todo[i : i + args.batch_size], args.batch_size) for i in range(0, len(todo), args.batch_size)]
+
+    pool = None
+    if args.workers > 0:
+        # spawn: TensorFlow does not survive fork once it has been initialised
+        pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn"), initializer=_init_worker)
+    start = time.perf_counter()
+    processed = enrolled = since_checkpoint = 0
+
+    def report(prefix: str) -> None:
+        seconds = time.perf_counter() - start
+        rate = processed / max(seconds, 1e-9)
+        eta = (len(todo) - processed) / rate if rate else float("inf")
+        print(f"[build] {prefix}{processed}/{len(todo)} photos, {enrolled - build.duplicates} enrolled, {rate:.1f} photos/s, eta {eta:.0f}s", flush=True)
+
+    try:
+        if pool is None:
+            results = map(process_batch, batches)
+        else:
+            results = _bounded(pool, batches, 2 * args.workers)
+        for batch in results:
+            for photo, record, crop, error in batch:
+                build.add(photo, record, crop, error)
+                processed += 1
+                enrolled += error is None
+                since_checkpoint += 1
+            if since_checkpoint >= args.checkpoint:
+                build.checkpoint()
+                since_checkpoint = 0
+                report("")
+    except KeyboardInterrupt:
+        build.checkpoint()
+        report("interrupted at ")
+        print("[build] run the same command again to resume")
+        return 130
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    build.checkpoint()
+    if enrolled:
+        replication.force_resync()
+    report("done: ")
+    if build.duplicates:
+        print(f"[build] {build.duplicates} photo(s) were already in the gallery and were skipped")
+    failed = build.state["failed"]
+    if failed:
+        print(f"[build] {len(failed)} photo(s) could not be enrolled (listed under 'failed' in {build.state_path})")
+    return 0 if enrolled or not todo else 1
+
+
+def _bounded(pool: ProcessPoolExecutor, batches, in_flight: int):
+    """Yield batch results as they complete, keeping at most `in_flight` batches submitted."""
+    batches = iter(batches)
+    running = set()
+    while True:
+        while len(running) < in_flight:
+            batch = next(batches, None)
+            if batch is None:
+                break
+            running.add(pool.submit(process_batch, batch))
+        if not running:
+            return
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,7 +18,7 @@ os.environ["DEEPFACE_HOME"] = DEEPFACE_HOME
 # ---------------------------------------
 # ARC FACE DATABASE DIRECTORY
 # ---------------------------------------
-ARC_DB_DIR = os.path.join(BASE_DIR, "arcface_db")
+ARC_DB_DIR = os.environ.get("ARC_DB_DIR", os.path.join(BASE_DIR, "arcface_db"))
 os.makedirs(ARC_DB_DIR, exist_ok=True)
 
 
@@ -36,12 +36,41 @@ THRESHOLD = 0.4
 BATCHED = True
 REFRESH_DATABASE = False  # DeepFace will ignore when ArcFace refresh logic is patched
 DISTANCE_METRIC = "cosine"
+# Faces detected below this confidence are dropped before embedding
+MIN_DETECTION_CONFIDENCE = 0.75
+# Detector cascade (services/face_detection.py): comma-separated "backend[@max_side]" stages,
+# cheapest first, e.g. "yolov8n@640,retinaface". A stage runs on the frame downscaled to
+# max_side (full resolution when omitted); the next stage runs only when no face was found,
+# or at least CASCADE_ESCALATE_FRACTION of the faces are smaller than CASCADE_MIN_FACE_PX or
+# less confident than CASCADE_MIN_CONFIDENCE. Faces from all stages run are merged with NMS
+# (boxes overlapping by more than CASCADE_MERGE_IOU are one face).
+DETECTOR_CASCADE = os.environ.get("DETECTOR_CASCADE", DETECTOR_BACKEND)
+ENROLL_DETECTOR_CASCADE = os.environ.get("ENROLL_DETECTOR_CASCADE", DETECTOR_CASCADE)
+CASCADE_MIN_FACE_PX = int(os.environ.get("CASCADE_MIN_FACE_PX", 40))
+CASCADE_MIN_CONFIDENCE = float(os.environ.get("CASCADE_MIN_CONFIDENCE", MIN_DETECTION_CONFIDENCE))
+CASCADE_ESCALATE_FRACTION = float(os.environ.get("CASCADE_ESCALATE_FRACTION", 0.5))
+CASCADE_MERGE_IOU = float(os.environ.get("CASCADE_MERGE_IOU", 0.4))
+# A "backend@tiles" cascade stage cuts frames longer than DETECTOR_TILE_SIZE into tiles sharing
+# DETECTOR_TILE_OVERLAP px, detects them (plus the whole frame) on DETECTOR_TILE_WORKERS threads,
+# and merges boxes overlapping by more than DETECTOR_TILE_NMS_IOU
+DETECTOR_TILE_SIZE = int(os.environ.get("DETECTOR_TILE_SIZE", 320))
+DETECTOR_TILE_OVERLAP = int(os.environ.get("DETECTOR_TILE_OVERLAP", 64))
+DETECTOR_TILE_WORKERS = int(os.environ.get("DETECTOR_TILE_WORKERS", min(4, os.cpu_count() or 1)))
+DETECTOR_TILE_NMS_IOU = float(os.environ.get("DETECTOR_TILE_NMS_IOU", 0.4))
+# Anti-spoofing runs only on faces that matched someone. Verdicts are cached per
+# (identity, face box snapped to this grid) for a short window; 0 disables the cache.
+ANTISPOOF_CACHE_TTL_SECONDS = float(os.environ.get("ANTISPOOF_CACHE_TTL_SECONDS", 2.0))
+ANTISPOOF_CACHE_GRID_PX = int(os.environ.get("ANTISPOOF_CACHE_GRID_PX", 16))
+ANTISPOOF_CACHE_MAX_ENTRIES = int(os.environ.get("ANTISPOOF_CACHE_MAX_ENTRIES", 4096))
 
 
 # ---------------------------------------
 # SERVER SETTINGS
 # ---------------------------------------
-MAX_UPLOAD_SIZE_MB = 10
+# Uploads (common/upload_limits.py): a file over MAX_UPLOAD_SIZE_MB, more than
+# MAX_UPLOAD_FILES files, or a request body larger than they allow is refused with 413
+MAX_UPLOAD_SIZE_MB = float(os.environ.get("MAX_UPLOAD_SIZE_MB", 10))
+MAX_UPLOAD_FILES = int(os.environ.get("MAX_UPLOAD_FILES", 10))
 
 
 # DeepFace PKL convention (MUST MATCH DEEPFACE FORMAT)
@@ -54,6 +83,69 @@ ARC_PKL_NAME = f"ds_model_arcface_detector_{DETECTOR_BACKEND}_{_aligned_part}_no
 
 ARC_PKL_PATH = os.path.join(ARC_DB_DIR, ARC_PKL_NAME)
 
+# Named gallery shards (e.g. "CSE/sem5") live in ARC_DB_DIR/shards/<name>/ARC_PKL_NAME.
+# A shard not searched for this long is dropped from memory (the default shard never is)
+GALLERY_SHARD_IDLE_SECONDS = float(os.environ.get("GALLERY_SHARD_IDLE_SECONDS", 30 * 60))
+# Also search the default (unsharded) gallery when a request names shards, so identities
+# enrolled before sharding keep matching; turn off once everyone is enrolled into a shard
+GALLERY_SEARCH_DEFAULT_SHARD = os.environ.get("GALLERY_SEARCH_DEFAULT_SHARD", "1").lower() in ("1", "true", "yes")
+# /recognise returns at most this many matches per face (its `top_k`, default 1)
+RECOGNISE_MAX_TOP_K = int(os.environ.get("RECOGNISE_MAX_TOP_K", 10))
+
+# ---------------------------------------
+# RECOGNIZER VARIANT (fp32 / int8)
+# ---------------------------------------
+# "fp32" serves the ArcFace Keras graph as loaded by DeepFace. "int8" serves the
+# post-training-quantised TFLite copy built by `python -m model_service.quantize`,
+# but only if that tool activated it (see QUANT_MANIFEST_PATH); otherwise fp32 is used.
+RECOGNIZER_VARIANT = os.environ.get("RECOGNIZER_VARIANT", "fp32").lower()
+QUANT_DIR = os.path.join(BASE_DIR, "quantized")
+QUANT_MODEL_PATH = os.path.join(QUANT_DIR, f"{MODEL_NAME.lower()}_int8.tflite")
+QUANT_MANIFEST_PATH = os.path.join(QUANT_DIR, f"{MODEL_NAME.lower()}_int8.json")
+# Number of calibration crops fed to the converter's representative dataset
+QUANT_CALIBRATION_SAMPLES = int(os.environ.get("QUANT_CALIBRATION_SAMPLES", 200))
+# Activation gate: refuse the int8 model if recall@1 drops by more than this (absolute, 0-1)
+QUANT_MAX_RECALL_DROP = float(os.environ.get("QUANT_MAX_RECALL_DROP", 0.01))
+# ...or if the mean absolute shift of probe->gallery distances exceeds this
+QUANT_MAX_DISTANCE_SHIFT = float(os.environ.get("QUANT_MAX_DISTANCE_SHIFT", 0.03))
+# Max faces per recognizer forward pass; a frame's crops are stacked and embedded in chunks of this size
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+TFLITE_NUM_THREADS = int(os.environ.get("TFLITE_NUM_THREADS", os.cpu_count() or 1))
+
+# ---------------------------------------
+# UPLOAD PREPROCESSING (services/image_prep.py)
+# ---------------------------------------
+# Uploads are decoded upright (EXIF orientation) and shrunk so their longer side is at most
+# this many px before detection (JPEGs while decoding); 0 keeps full resolution.
+PREP_MAX_SIDE_ENROLL = int(os.environ.get("PREP_MAX_SIDE_ENROLL", 1280))
+PREP_MAX_SIDE_DETECT = int(os.environ.get("PREP_MAX_SIDE_DETECT", 1280))
+# /recognise and /verify keep full resolution by default: far faces in wide frames need it
+# (a "backend@max_side" DETECTOR_CASCADE stage detects on a smaller copy instead)
+PREP_MAX_SIDE_RECOGNISE = int(os.environ.get("PREP_MAX_SIDE_RECOGNISE", 0))
+# Images with more pixels than this (read from the header) are rejected up front with 413
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", 50_000_000))
+
+# ---------------------------------------
+# INFERENCE ADMISSION CONTROL
+# ---------------------------------------
+# Inference runs on this many worker threads (DeepFace detectors are shared
+# singletons, so raise it only with thread-safe backends). At most
+# INFERENCE_QUEUE_MAX requests wait for a worker; beyond that they get 503 + Retry-After.
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 1))
+INFERENCE_QUEUE_MAX = int(os.environ.get("INFERENCE_QUEUE_MAX", 16))
+# Waiting requests are served by class, lowest number first: live recognition, then
+# interactive verification, then bulk enrollment (enrollment only gets spare capacity).
+# "search" is a peer's share of a coordinator's /recognise (services/cluster.py)
+INFERENCE_PRIORITIES = {"recognise": 0, "search": 0, "verify": 1, "detect": 1, "enroll": 2}
+# Within a class, API keys share workers fairly, in proportion to their owner's weight
+# (default 1), e.g. INFERENCE_USER_WEIGHTS="1=4,7=0.5" (user id = weight)
+INFERENCE_USER_WEIGHTS = {
+    int(k): float(v)
+    for k, v in (item.split("=", 1) for item in os.environ.get("INFERENCE_USER_WEIGHTS", "").split(",") if "=" in item)
+}
+# How often a request waiting on inference checks whether its client has disconnected
+DISCONNECT_POLL_SECONDS = float(os.environ.get("DISCONNECT_POLL_SECONDS", 0.1))
+
 # ---------------------------------------
 # AUTH / DATABASE
 # ---------------------------------------
@@ -67,4 +159,102 @@ ACCESS_TOKEN_EXPIRES_SECONDS = int(os.environ.get("ACCESS_TOKEN_EXPIRES_SECONDS"
 REFRESH_TOKEN_EXPIRES_SECONDS = int(os.environ.get("REFRESH_TOKEN_EXPIRES_SECONDS", 60 * 60 * 24 * 7))
 
 # API key settings
-API_KEY_BYTES = int(os.environ.get("API_KEY_BYTES", 32))
\ No newline at end of file
+API_KEY_BYTES = int(os.environ.get("API_KEY_BYTES", 32))
+# Validated API keys are cached in-process so model endpoints skip the api_keys query.
+# Entries live at most this long (and never past the key's own expires_at).
+API_KEY_CACHE_TTL_SECONDS = float(os.environ.get("API_KEY_CACHE_TTL_SECONDS", 60))
+API_KEY_CACHE_MAX_ENTRIES = int(os.environ.get("API_KEY_CACHE_MAX_ENTRIES", 1024))
+# Each process checks the api_key_revocations table this often, so a key revoked through
+# another worker stops working here within this many seconds
+API_KEY_REVOCATION_POLL_SECONDS = float(os.environ.get("API_KEY_REVOCATION_POLL_SECONDS", 1))
+
+# ---------------------------------------
+# RATE LIMITS
+# ---------------------------------------
+# Token bucket per caller (API key plus X-Stream-Id when sent, or client IP when no key
+# is) and per route; main_backend shares one key across cameras, so the limits are per stream:
+# route -> (calls, period seconds, burst). A caller may burst up to `burst` requests,
+# then is held to calls/period; excess requests get 429 with Retry-After.
+RATE_LIMITS = {
+    "recognise": (int(os.environ.get("RATE_LIMIT_RECOGNISE_CALLS", 600)), 60, int(os.environ.get("RATE_LIMIT_RECOGNISE_BURST", 30))),
+    "verify": (int(os.environ.get("RATE_LIMIT_VERIFY_CALLS", 600)), 60, int(os.environ.get("RATE_LIMIT_VERIFY_BURST", 30))),
+    "refresh-db": (int(os.environ.get("RATE_LIMIT_REFRESH_CALLS", 60)), 60, int(os.environ.get("RATE_LIMIT_REFRESH_BURST", 10))),
+    "login": (int(os.environ.get("RATE_LIMIT_LOGIN_CALLS", 10)), 60, int(os.environ.get("RATE_LIMIT_LOGIN_BURST", 5))),
+}
+# Buckets untouched for this long are dropped
+RATE_LIMIT_IDLE_SECONDS = float(os.environ.get("RATE_LIMIT_IDLE_SECONDS", 300))
+
+# ---------------------------------------
+# SCATTER-GATHER CLUSTER (services/cluster.py)
+# ---------------------------------------
+# Peer base URLs, one per gallery partition, e.g. "http://10.0.0.5:8080,http://10.0.0.6:8080".
+# When set, this node is a coordinator: it detects and embeds, then searches the peers;
+# its own gallery files are not used.
+CLUSTER_PEERS = [p.strip().rstrip("/") for p in os.environ.get("CLUSTER_PEERS", "").split(",") if p.strip()]
+# "identity": identities are hashed across partitions, and every search fans out to all peers.
+# "shard": each gallery shard lives whole on one peer, and searches go only to the shards' peers.
+CLUSTER_PARTITION_BY = os.environ.get("CLUSTER_PARTITION_BY", "identity").lower()
+# Shared secret for the /cluster/* endpoints (sent as X-Cluster-Secret); they are disabled when empty
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+# Per-call timeout to a peer (further capped by the request's deadline)
+CLUSTER_TIMEOUT_SECONDS = float(os.environ.get("CLUSTER_TIMEOUT_SECONDS", 2.0))
+
+# ---------------------------------------
+# GALLERY REPLICATION (services/replication.py)
+# ---------------------------------------
+# Base URL of the primary to replicate the gallery from; set only on read-only replicas.
+# Replication calls authenticate with CLUSTER_SECRET.
+REPLICATION_PRIMARY = os.environ.get("REPLICATION_PRIMARY", "").strip().rstrip("/")
+REPLICATION_POLL_SECONDS = float(os.environ.get("REPLICATION_POLL_SECONDS", 1.0))
+# Changes fetched per request while catching up
+REPLICATION_BATCH = int(os.environ.get("REPLICATION_BATCH", 500))
+REPLICATION_TIMEOUT_SECONDS = float(os.environ.get("REPLICATION_TIMEOUT_SECONDS", 30.0))
+# Changes kept in the log for replicas to catch up from; a replica further behind re-bootstraps from a snapshot
+REPLICATION_LOG_MAX_ENTRIES = int(os.environ.get("REPLICATION_LOG_MAX_ENTRIES", 10000))
+
+# ---------------------------------------
+# ENROLLMENT CROP STORE (services/crop_store.py)
+# ---------------------------------------
+# Keep each enrolled face's aligned crop so `python -m model_service.rebuild_gallery` can
+# re-embed the gallery after a model or normalization change without re-uploading photos
+KEEP_ENROLLMENT_CROPS = os.environ.get("KEEP_ENROLLMENT_CROPS", "1").lower() in ("1", "true", "yes")
+# Crops are letterboxed to this square size (px) and stored as 8-bit RGB
+CROP_STORE_SIZE = int(os.environ.get("CROP_STORE_SIZE", 112))
+# Crops per chunk file (112 px crops are 37 KB each)
+CROP_STORE_CHUNK_ROWS = int(os.environ.get("CROP_STORE_CHUNK_ROWS", 1024))
+
+# ---------------------------------------
+# LOGGING
+# ---------------------------------------
+# Records are queued and written by a background thread (common/log_setup.py).
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE", os.path.join(DEEPFACE_HOME, "model_service.log"))
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+# Per-frame request lines (/recognise, /verify) are sampled 1 in N; errors are always logged
+LOG_SAMPLE_EVERY = int(os.environ.get("LOG_SAMPLE_EVERY", 20))
+
+# ---------------------------------------
+# METRICS (routes/metrics.py)
+# ---------------------------------------
+# /metrics names the cluster peers, replication state and queue internals, so scrapers
+# send an X-API-KEY or X-Cluster-Secret; set to serve it without credentials instead
+METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "0").lower() in ("1", "true", "yes")
+
+# ---------------------------------------
+# FAKE BACKEND (load tests / benchmarks only)
+# ---------------------------------------
+# Replaces DeepFace with services/fake_backend.py: deterministic embeddings from image bytes, no weights.
+FAKE_BACKEND = os.environ.get("MODEL_SERVICE_FAKE_BACKEND", "0").lower() in ("1", "true", "yes")
+# Simulated cost per stage in ms, "<stage>_per_face" adds ms per face, e.g.
+# "decode=3,detect=25,antispoof=6,represent=4,represent_per_face=2"
+FAKE_STAGE_COSTS_MS = {
+    k.strip(): float(v)
+    for k, v in (
+        item.split("=", 1)
+        for item in os.environ.get("FAKE_STAGE_COSTS_MS", "decode=3,detect=25,antispoof=6,represent=4,represent_per_face=2").split(",")
+        if "=" in item
+    )
+}
+# "sleep" releases the GIL (native/accelerator work); "cpu" spins holding it
+FAKE_COST_MODE = os.environ.get("FAKE_COST_MODE", "sleep").lower()
+FAKE_FACES_PER_FRAME = int(os.environ.get("FAKE_FACES_PER_FRAME", 1))
@@ -19,7 +19,6 @@ import tempfile
 from pathlib import Path
 import logging
 import time
-from logging.handlers import TimedRotatingFileHandler
 
 # Import the shared DeepFace helper implementations from services
 from .services import deepface_service
@@ -34,65 +33,67 @@ app = FastAPI(title="ArcFace Recognition Service")
 # ---------------------------------------------------
 # Logging middleware and configuration
 # ---------------------------------------------------
-logger = logging.getLogger("model_service")
-if not logger.handlers:
-    logger.setLevel(logging.INFO)
-    # console handler
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    fmt = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
-    ch.setFormatter(fmt)
-    logger.addHandler(ch)
-
-    # file handler (rotates daily)
-    try:
-        log_dir = Path(config.DEEPFACE_HOME)
-        log_dir.mkdir(parents=True, exist_ok=True)
-        fh = TimedRotatingFileHandler(log_dir / "model_service.log", when="midnight", backupCount=7, encoding="utf-8")
-        fh.setLevel(logging.INFO)
-        fh.setFormatter(fmt)
-        logger.addHandler(fh)
-    except Exception:
-        # fall back to console-only logging
-        logger.exception("Could not create file handler for logging; continuing with console logging")
+from .services import metrics
+from common.log_setup import configure_logging, fields, sampled
+
+logger = configure_logging(
+    "model_service",
+    level=getattr(logging, config.LOG_LEVEL, logging.INFO),
+    log_file=config.LOG_FILE,
+    queue_size=config.LOG_QUEUE_SIZE,
+)
+
+from common.upload_limits import BodyLimit
+
+# request bodies over the upload limits are refused before they are read
+app.add_middleware(BodyLimit, settings=config)
+
+# Per-frame endpoints; their request lines are sampled
+_SAMPLED_PATHS = {"/recognise", "/verify"}
+# Endpoints that report their stage breakdown in a Server-Timing header
+_SERVER_TIMING_PATHS = {"/recognise", "/verify", "/detect", "/refresh-db"}
 
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """Log each incoming request and its response status, time, and basic meta.
+    """Log one structured line per request: method, path, status, time and basic meta.
+
+    Also records route latency and, for inference routes, adds a Server-Timing
+    header with the stages timed while handling the request.
 
     Sensitive headers are not logged; presence of auth headers is indicated instead.
     """
-    start_time = time.time()
-    client_host = None
-    try:
-        client = request.client
-        if client:
-            client_host = client.host
-    except Exception:
-        client_host = None
-
-    # extract basic info
+    start_time = time.perf_counter()
+    client = request.client
     method = request.method
     path = request.url.path
-    qs = str(request.url.query) if request.url.query else ""
-    ua = request.headers.get("user-agent", "")
-    has_auth = "authorization" in request.headers
-    has_api_key = "x-api-key" in request.headers
-
-    logger.info(f"-> {method} {path}?{qs} from={client_host} ua='{ua}' auth={has_auth} api_key={has_api_key}")
+    meta = {
+        "method": method,
+        "path": path,
+        "client": client.host if client else None,
+        "auth": "authorization" in request.headers,
+        "api_key": "x-api-key" in request.headers,
+    }
 
     try:
-        response = await call_next(request)
+        with metrics.request_timings() as timings:
+            response = await call_next(request)
     except Exception as exc:
-        # log the exception and re-raise
-        elapsed = (time.time() - start_time) * 1000
-        logger.exception(f"!! {method} {path} from={client_host} raised error after={elapsed:.2f}ms: {exc}")
+        elapsed = (time.perf_counter() - start_time) * 1000
+        logger.exception("request failed", extra=fields(**meta, ms=round(elapsed, 2), error=exc))
         raise
 
-    elapsed = (time.time() - start_time) * 1000
-    # response may not have content-length set, so we show status and time
-    logger.info(f"<- {method} {path} status={response.status_code} time={elapsed:.2f}ms")
+    if path in _SERVER_TIMING_PATHS and timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, time.perf_counter() - start_time)
+    elapsed = round((time.perf_counter() - start_time) * 1000, 2)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    metrics.REQUEST_SECONDS.observe(elapsed / 1000.0, route=route, status=response.status_code)
+    if response.status_code >= 500:
+        logger.warning("request", extra=fields(**meta, status=response.status_code, ms=elapsed))
+    elif path in _SAMPLED_PATHS:
+        logger.info("request", extra=sampled(config.LOG_SAMPLE_EVERY, **meta, status=response.status_code, ms=elapsed))
+    else:
+        logger.info("request", extra=fields(**meta, status=response.status_code, ms=elapsed, ua=request.headers.get("user-agent", "")))
     return response
 
 
@@ -102,6 +103,20 @@ async def startup_event():
     # This will load the model into memory so the first request is fast
     deepface_service.ensure_deepface()
     logger.info("Startup: DeepFace models preloaded.")
+    from .services import replication
+
+    # changes logged before a crash but not yet written to the shard files
+    replication.recover()
+    # replicas start pulling the gallery from their primary (no-op on a primary)
+    replication.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    from .services import cluster, replication
+
+    replication.stop()
+    await cluster.aclose()
 
 
 @app.get("/")
@@ -115,18 +130,38 @@ async def root():
         "model_name": config.MODEL_NAME,
         "detector": config.DETECTOR_BACKEND,
         "normalization": config.NORMALIZATION,
+        "recognizer": getattr((deepface_service.DEEPFACE_MODELS or {}).get("recognizer"), "variant", None),
     }
 
-    return {"status": "ok", "pkl": config.ARC_PKL_PATH, "deepface": deepface_info}
+    from .services.auth import api_key_cache
+    from .services import replication
+    from .services.gallery import resident_shards
+
+    return {
+        "status": "ok",
+        "pkl": config.ARC_PKL_PATH,
+        "gallery_shards": {name or "default": size for name, size in resident_shards().items()},
+        "replication": replication.status(),
+        "deepface": deepface_info,
+        "api_key_cache": api_key_cache.stats(),
+    }
 
 
 # Include modular routers
 from .routes import refresh_db as refresh_db_route
 from .routes import detect as detect_route
 from .routes import recognise as recognise_route
+from .routes import verify as verify_route
 from .routes import auth as auth_route
+from .routes import metrics as metrics_route
+from .routes import cluster as cluster_route
+from .routes import replication as replication_route
 
 app.include_router(refresh_db_route.router)
 app.include_router(detect_route.router)
 app.include_router(recognise_route.router)
+app.include_router(verify_route.router)
 app.include_router(auth_route.router)
+app.include_router(metrics_route.router)
+app.include_router(cluster_route.router)
+app.include_router(replication_route.router)
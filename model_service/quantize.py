@@ -0,0 +1,222 @@
+"""Build an int8 post-training-quantised copy of the recognizer and gate its activation.
+
+Usage:
+  python -m model_service.quantize --images path/to/enrolled_photos
+  python -m model_service.quantize --deactivate
+
+The calibration directory uses DeepFace's db layout: one sub-directory per
+enrolled identity holding that person's photos. Faces are detected and aligned
+with the service's detector settings, fed to the TFLite converter as the
+representative dataset, then embedded by both the fp32 and int8 models.
+
+The int8 model is only activated (manifest ``active: true``) when, on that same
+gallery, recall@1 does not drop by more than ``QUANT_MAX_RECALL_DROP`` and the
+mean shift of probe->gallery distances stays under ``QUANT_MAX_DISTANCE_SHIFT``.
+Serve it with ``RECOGNIZER_VARIANT=int8``.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from . import config
+
+
+def collect_calibration_faces(image_dir: str, input_shape, limit: int = None) -> Tuple[np.ndarray, List[str]]:
+    """Detect/align one face per image under `image_dir` and return (batch, identity labels)."""
+    from deepface.commons import image_utils
+    from deepface.modules import detection
+    from .services.recognizer import preprocess_faces
+
+    faces, labels = [], []
+    for path in sorted(image_utils.yield_images(path=image_dir)):
+        try:
+            objs = detection.extract_faces(
+                img_path=path,
+                detector_backend=config.DETECTOR_BACKEND,
+                enforce_detection=True,
+                align=config.ALIGN,
+            )
+        except ValueError as exc:
+            print(f"[quantize] skipping {path}: {exc}")
+            continue
+        # enrollment photos hold one person; keep the largest detection
+        best = max(objs, key=lambda o: o["facial_area"]["w"] * o["facial_area"]["h"])
+        faces.append(best["face"])
+        labels.append(os.path.basename(os.path.dirname(path)))
+        if limit and len(faces) >= limit:
+            break
+
+    if not faces:
+        raise RuntimeError(f"no faces found under {image_dir}")
+    return preprocess_faces(faces, input_shape), labels
+
+
+def build_int8_model(keras_model, calibration: np.ndarray, out_path: str) -> str:
+    """Convert `keras_model` to an int8 TFLite model calibrated on `calibration`."""
+    import tensorflow as tf
+
+    def representative_dataset():
+        for i in range(calibration.shape[0]):
+            yield [calibration[i : i + 1].astype(np.float32)]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    # int8 kernels inside, float32 in/out so callers keep feeding normalised crops
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    tflite_model = converter.convert()
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    tmp = out_path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(tflite_model)
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def _l2_normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def evaluate(fp32_emb: np.ndarray, int8_emb: np.ndarray, labels: List[str]) -> Dict[str, float]:
+    """Compare int8 against fp32 embeddings of the same crops.
+
+    The fp32 embeddings form the gallery. Every crop whose identity has at
+    least one other crop is used as a leave-one-out probe, once with its fp32
+    embedding and once with its int8 embedding, so recall@1 is measured
+    against exactly the gallery the service would search.
+    """
+    labels_arr = np.asarray(labels)
+    gallery = _l2_normalize(np.asarray(fp32_emb, dtype=np.float32))
+    probes_int8 = _l2_normalize(np.asarray(int8_emb, dtype=np.float32))
+
+    n = gallery.shape[0]
+    d32 = 1.0 - gallery @ gallery.T
+    d8 = 1.0 - probes_int8 @ gallery.T
+    off_diag = ~np.eye(n, dtype=bool)
+
+    counts = {lab: int((labels_arr == lab).sum()) for lab in set(labels)}
+    probe_mask = np.array([counts[lab] > 1 for lab in labels], dtype=bool)
+
+    def recall_at_1(dist: np.ndarray) -> float:
+        if not probe_mask.any():
+            return float("nan")
+        masked = np.where(off_diag, dist, np.inf)
+        nearest = np.argmin(masked, axis=1)
+        hits = labels_arr[nearest] == labels_arr
+        return float(hits[probe_mask].mean())
+
+    shift = np.abs(d8 - d32)[off_diag] if n > 1 else np.zeros(1)
+    self_distance = 1.0 - np.sum(gallery * probes_int8, axis=1)
+
+    r32 = recall_at_1(d32)
+    r8 = recall_at_1(d8)
+    return {
+        "samples": int(n),
+        "probes": int(probe_mask.sum()),
+        "identities": len(counts),
+        "recall_at_1_fp32": r32,
+        "recall_at_1_int8": r8,
+        "recall_drop": float(r32 - r8) if probe_mask.any() else 0.0,
+        "distance_shift_mean": float(shift.mean()),
+        "distance_shift_p99": float(np.percentile(shift, 99)),
+        "distance_shift_max": float(shift.max()),
+        "fp32_int8_self_distance_mean": float(self_distance.mean()),
+    }
+
+
+def check_gate(report: Dict[str, float], max_recall_drop: float, max_distance_shift: float) -> List[str]:
+    """Return the reasons the int8 model must not be activated (empty list = pass)."""
+    reasons = []
+    if report["probes"] == 0:
+        reasons.append("no identity has two or more calibration images; recall@1 cannot be measured")
+    elif report["recall_drop"] > max_recall_drop:
+        reasons.append(f"recall@1 dropped by {report['recall_drop']:.4f} (> {max_recall_drop})")
+    if report["distance_shift_mean"] > max_distance_shift:
+        reasons.append(f"mean distance shift {report['distance_shift_mean']:.4f} (> {max_distance_shift})")
+    return reasons
+
+
+def write_manifest(report: Dict[str, float], active: bool, reasons: List[str], path: str = None) -> dict:
+    from .services.recognizer import PREPROCESS_VERSION
+
+    path = path or config.QUANT_MANIFEST_PATH
+    manifest = {
+        "model_name": config.MODEL_NAME,
+        "normalization": config.NORMALIZATION,
+        # calibrated on crops preprocessed this way; older int8 models are not served
+        "preprocess_version": PREPROCESS_VERSION,
+        "model_path": config.QUANT_MODEL_PATH,
+        "created_at": int(time.time()),
+        "active": bool(active),
+        "rejected_because": reasons,
+        "report": report,
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="directory of enrolled photos, one sub-directory per identity")
+    parser.add_argument("--samples", type=int, default=config.QUANT_CALIBRATION_SAMPLES, help="max calibration crops")
+    parser.add_argument("--max-recall-drop", type=float, default=config.QUANT_MAX_RECALL_DROP)
+    parser.add_argument("--max-distance-shift", type=float, default=config.QUANT_MAX_DISTANCE_SHIFT)
+    parser.add_argument("--deactivate", action="store_true", help="mark the current int8 model inactive and exit")
+    args = parser.parse_args(argv)
+
+    from .services import recognizer
+
+    if args.deactivate:
+        manifest = recognizer.read_manifest()
+        if manifest is None:
+            print("[quantize] no manifest found; nothing to deactivate")
+            return 0
+        write_manifest(manifest.get("report", {}), False, ["deactivated manually"])
+        print("[quantize] int8 model deactivated")
+        return 0
+
+    if not args.images:
+        parser.error("--images is required")
+
+    from deepface import DeepFace
+
+    client = DeepFace.build_model(config.MODEL_NAME)
+    fp32 = recognizer.KerasRecognizer(client)
+
+    print(f"[quantize] collecting calibration faces from {args.images}")
+    batch, labels = collect_calibration_faces(args.images, fp32.input_shape, limit=args.samples)
+    print(f"[quantize] {batch.shape[0]} crops across {len(set(labels))} identities")
+
+    print("[quantize] converting to int8")
+    build_int8_model(client.model, batch, config.QUANT_MODEL_PATH)
+    int8 = recognizer.TFLiteRecognizer(config.QUANT_MODEL_PATH, fp32.input_shape, fp32.output_shape)
+
+    fp32_emb = np.concatenate([fp32.embed(batch[i : i + 32]) for i in range(0, batch.shape[0], 32)])
+    int8_emb = np.concatenate([int8.embed(batch[i : i + 32]) for i in range(0, batch.shape[0], 32)])
+
+    report = evaluate(fp32_emb, int8_emb, labels)
+    report["fp32_bytes"] = int(client.model.count_params() * 4)
+    report["int8_bytes"] = int(os.path.getsize(config.QUANT_MODEL_PATH))
+    reasons = check_gate(report, args.max_recall_drop, args.max_distance_shift)
+    manifest = write_manifest(report, not reasons, reasons)
+
+    print(json.dumps(manifest, indent=2))
+    if reasons:
+        print("[quantize] int8 model NOT activated: " + "; ".join(reasons))
+        return 1
+    print("[quantize] int8 model activated; start the service with RECOGNIZER_VARIANT=int8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Re-embed the gallery from the face crops kept at enrollment.
+
+Usage:
+  python -m model_service.rebuild_gallery
+  python -m model_service.rebuild_gallery --shard CSE/sem5 --workers 4 --batch-size 64
+
+Run it after changing MODEL_NAME, DETECTOR_BACKEND or NORMALIZATION (and so
+ARC_PKL_NAME), with the new settings in place, and restart the service
+afterwards. Every shard with stored crops (see services/crop_store.py) is
+re-embedded with the current recognizer and written to its PKL for the
+current ARC_PKL_NAME. Decode and detection are skipped: the crops were
+aligned by the detector that enrolled them, so they are reused as they are.
+
+Chunks of crops are spread over ``--workers`` processes (each loads the
+recognizer once) and embedded ``--batch-size`` crops per forward pass.
+Gallery rows enrolled before crops were kept cannot be rebuilt. Rows are
+counted in the PKL the crops were enrolled into (its ARC_PKL_NAME is kept in
+the crop store's ``meta.json``; ``--from-pkl-name`` names it for stores
+that predate that), and a shard with more rows there, or in its current PKL,
+than it has crops is skipped unless ``--allow-drop`` is given. On a replication primary the rebuild moves the
+change log past its retained entries, so replicas re-bootstrap from a
+snapshot.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import config
+
+
+def _init_worker() -> None:
+    from .services import recognizer
+
+    recognizer.get_active()
+
+
+def embed_chunk(job: Tuple[str, int, List[int], int]) -> np.ndarray:
+    """Embed rows `rows` of chunk `chunk` in the crop store at `directory`."""
+    from .services import crop_store, recognizer
+
+    directory, chunk, rows, batch_size = job
+    crops = crop_store.CropStore(directory, config.CROP_STORE_CHUNK_ROWS).read_chunk(chunk, rows)
+    return recognizer.embed_faces([crop_store.from_crop(c) for c in crops], batch_size)
+
+
+def rebuild_shard(shard: Optional[str], pool: Optional[ProcessPoolExecutor], batch_size: int) -> List[dict]:
+    """`shard`'s gallery records re-embedded from its crops, in enrollment order."""
+    from .services import crop_store
+
+    store = crop_store.store(shard)
+    entries = list(store.entries())
+    jobs: Dict[int, List[int]] = {}
+    for entry in entries:
+        jobs.setdefault(entry["chunk"], []).append(entry["row"])
+    args = [(store.directory, chunk, rows, batch_size) for chunk, rows in sorted(jobs.items())]
+    results = pool.map(embed_chunk, args) if pool is not None else map(embed_chunk, args)
+    embeddings = {chunk: dict(zip(rows, emb)) for (_, chunk, rows, _), emb in zip(args, results)}
+
+    records = []
+    for entry in entries:
+        emb = embeddings[entry["chunk"]][entry["row"]].tolist()
+        # same layout as add_face_arcface writes
+        records.append(dict(entry["record"], embedding=emb, rep=emb, representations=emb, model=config.MODEL_NAME))
+    return records
+
+
+def count_rows(shard: Optional[str], pkl_name: str) -> int:
+    """Rows in `shard`'s gallery PKL called `pkl_name` (0 when there is none)."""
+    import pickle
+
+    from .services import gallery
+
+    path = os.path.join(os.path.dirname(gallery.shard_path(shard)), pkl_name)
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return len(pickle.load(f))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shard", action="append", help="shard to rebuild (repeatable; default: every shard with crops, '' for the default shard)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="embedding processes (0: embed in this process)")
+    parser.add_argument("--batch-size", type=int, default=config.EMBED_BATCH_SIZE, help="crops per forward pass")
+    parser.add_argument("--from-pkl-name", default=None, help="ARC_PKL_NAME the crops were enrolled under (default: the one the crop store recorded)")
+    parser.add_argument("--allow-drop", action="store_true", help="rebuild shards even if rows enrolled without crops would be lost")
+    args = parser.parse_args(argv)
+
+    from .services import arcface_refresh, crop_store, gallery, replication
+
+    shards = [s or None for s in args.shard] if args.shard else crop_store.list_shards()
+    if not shards:
+        print(f"[rebuild] no stored crops under {config.ARC_DB_DIR}; nothing to rebuild")
+        return 1
+
+    pool = None
+    if args.workers > 0:
+        # spawn: TensorFlow does not survive fork once it has been initialised
+        pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn"), initializer=_init_worker)
+    status = 0
+    rebuilt = 0
+    try:
+        for shard in shards:
+            name = shard or "default"
+            store = crop_store.store(shard)
+            # the current PKL does not exist yet right after a model/detector change;
+            # the rows to keep are in the one the crops were enrolled into
+            source = args.from_pkl_name or store.pkl_name or config.ARC_PKL_NAME
+            enrolled = max(count_rows(shard, source), len(arcface_refresh.load_db(shard)))
+            if enrolled > len(store) and not args.allow_drop:
+                print(f"[rebuild] skipping {name}: {source} has {enrolled} rows but only {len(store)} crops (use --allow-drop)")
+                status = 1
+                continue
+            start = time.perf_counter()
+            records = rebuild_shard(shard, pool, args.batch_size)
+            with arcface_refresh.db_lock:
+                arcface_refresh.save_db(records, shard)
+            store.set_pkl_name(config.ARC_PKL_NAME)
+            seconds = time.perf_counter() - start
+            rebuilt += 1
+            print(f"[rebuild] {name}: {len(records)} crops -> {gallery.shard_path(shard)} in {seconds:.1f}s ({len(records) / max(seconds, 1e-9):.1f} crops/s)")
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if rebuilt:
+        replication.force_resync()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,10 +11,12 @@ from ..services.auth import (
     create_access_token,
     create_refresh_token,
     create_api_key,
+    revoke_api_key,
     revoke_token,
     decode_token,
     prune_revoked_tokens,
 )
+from ..services.rate_limiter import require_rate_limit
 from .. import config
 
 Base.metadata.create_all(bind=engine)
@@ -39,7 +41,7 @@ def register(username: str = Form(...), password: str = Form(...), db: Session =
     return {"id": user.id, "username": user.username}
 
 
-@router.post("/login", response_model=TokenResponse)
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(require_rate_limit("login"))])
 def login(username: str = Form(...), password: str = Form(...), db: Session = Depends(get_db)):
     user = authenticate_user(db, username, password)
     if not user:
@@ -121,3 +123,14 @@ def apikey_create(db: Session = Depends(get_db), username: str = Form(...), pass
         raise HTTPException(status_code=401, detail="Invalid credentials")
     ak = create_api_key(db, user)
     return {"api_key": ak.key, "expires_at": ak.expires_at}
+
+
+@router.post("/apikey/revoke")
+def apikey_revoke(db: Session = Depends(get_db), username: str = Form(...), password: str = Form(...), api_key: str = Form(...)):
+    user = authenticate_user(db, username, password)
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    # revoke_api_key drops the key from the in-process cache immediately
+    if not revoke_api_key(db, api_key, user):
+        raise HTTPException(status_code=404, detail="API key not found")
+    return {"revoked": True}
@@ -0,0 +1,81 @@
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Request
+
+from .. import config
+from ..services import cluster, gallery, replication
+from ..services.cluster import require_cluster_secret
+from ..services.inference_queue import run_inference
+
+router = APIRouter(prefix="/cluster")
+
+
+async def _body(request: Request, **required) -> dict:
+    """The JSON body, 400 unless each `required` key is present with that type and shards/k are valid."""
+    try:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError("Body must be a JSON object")
+        for key, kind in required.items():
+            if not isinstance(body.get(key), kind):
+                raise ValueError(f"'{key}' must be a {kind.__name__}")
+        if not isinstance(body.get("shards") or [], list):
+            raise ValueError("'shards' must be a list")
+        for shard in body.get("shards") or []:
+            gallery.shard_path(shard)
+        if body.get("shard"):
+            gallery.shard_path(body["shard"])
+        if "k" in body:
+            body["k"] = int(body["k"])
+    except (TypeError, ValueError) as ve:
+        raise HTTPException(400, str(ve))
+    return body
+
+
+def _vectors(value, ndim: int) -> np.ndarray:
+    """`value` as a non-empty float32 array of `ndim` dimensions; 400 otherwise."""
+    try:
+        arr = np.asarray(value, dtype=np.float32)
+    except (TypeError, ValueError):
+        arr = None
+    if arr is None or arr.ndim != ndim or arr.size == 0:
+        raise HTTPException(400, f"Expected a non-empty {ndim}-d array of numbers")
+    return arr
+
+
+@router.post("/search", dependencies=[Depends(require_cluster_secret)])
+async def search(request: Request):
+    """Peer side of a coordinator's /recognise: top-k identities per probe embedding from this node's shards.
+
+    Body: {"embeddings": [[...], ...], "shards": [name or null, ...], "k": int}.
+    """
+    body = await _body(request, embeddings=list)
+    embeddings = _vectors(body["embeddings"], 2)
+    k = max(1, min(body.get("k", 1), config.RECOGNISE_MAX_TOP_K))
+    return await run_inference("search", cluster.local_search, embeddings, body.get("shards"), k, request=request)
+
+
+@router.post("/verify", dependencies=[Depends(require_cluster_secret)])
+async def verify(request: Request):
+    """Peer side of a coordinator's /verify. Body: {"embedding": [...], "identity": str, "shards": [...]}."""
+    body = await _body(request, embedding=list, identity=str)
+    embedding = _vectors(body["embedding"], 1)
+    return await run_inference("verify", cluster.local_verify, embedding, body["identity"], body.get("shards"), request=request)
+
+
+@router.post("/enroll", dependencies=[Depends(require_cluster_secret)])
+async def enroll(request: Request):
+    """Store gallery records a coordinator embedded.
+
+    Body: {"identity": str, "shard": name or null, "records": [...], "crops": [...] (optional, one per record)}.
+    """
+    from ..services import arcface_refresh, crop_store
+
+    if replication.is_replica():
+        raise HTTPException(409, "This node is a read-only gallery replica; enroll on its primary")
+    body = await _body(request, identity=str, records=list)
+    if not all(isinstance(r, dict) for r in body["records"]):
+        raise HTTPException(400, "'records' must be a list of objects")
+    records = [dict(r, identity=body["identity"]) for r in body["records"]]
+    crops = crop_store.decode_crops(body["crops"]) if body.get("crops") else None
+    added = await run_inference("enroll", arcface_refresh.append_records, records, body.get("shard"), None, crops, request=request)
+    return {"identity": body["identity"], "added": added}
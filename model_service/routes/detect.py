@@ -1,34 +1,54 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
 import os
 
-from ..services import deepface_service
+from ..services import deepface_service, image_prep, metrics, pipeline
 from .. import config
 from ..services.auth import require_auth
+from ..services.inference_queue import run_inference
 
 router = APIRouter()
 
 
+def _verify_pair(p1: str, p2: str):
+    # both images are decoded upright and shrunk to PREP_MAX_SIDE_DETECT first
+    (img1, scale1), (img2, scale2) = (pipeline.load_scaled(p, config.PREP_MAX_SIDE_DETECT) for p in (p1, p2))
+    # DeepFace.verify detects and embeds both images internally; timed as one stage
+    with metrics.stage("verify"):
+        res = deepface_service.DeepFace.verify(
+            img1_path=img1,
+            img2_path=img2,
+            model_name=config.MODEL_NAME,
+            detector_backend=config.DETECTOR_BACKEND,
+            distance_metric=config.DISTANCE_METRIC,
+        )
+    areas = res.get("facial_areas") or {}
+    for key, scale in (("img1", scale1), ("img2", scale2)):
+        if areas.get(key):
+            areas[key] = image_prep.to_original(areas[key], scale)
+    return res
+
+
 @router.post("/detect", dependencies=[Depends(require_auth(require_api_key=True))])
-async def detect(img1: UploadFile = File(...), img2: UploadFile = File(...)):
+async def detect(request: Request, img1: UploadFile = File(...), img2: UploadFile = File(...)):
     deepface_service.ensure_deepface()
     if deepface_service.DeepFace is None:
         raise HTTPException(500, "DeepFace not installed")
 
-    p1 = await deepface_service.write_upload_to_tempfile(img1)
-    p2 = await deepface_service.write_upload_to_tempfile(img2)
-
+    p1 = p2 = None
     try:
-        res = deepface_service.DeepFace.verify(
-            img1_path=p1,
-            img2_path=p2,
-            model_name=config.MODEL_NAME,
-            detector_backend=config.DETECTOR_BACKEND,
-            distance_metric=config.DISTANCE_METRIC,
-        )
-        return JSONResponse(deepface_service._serialize_deepface_result(res))
+        with metrics.stage("upload"):
+            p1 = await deepface_service.write_upload_to_tempfile(img1)
+            p2 = await deepface_service.write_upload_to_tempfile(img2)
+        for p in (p1, p2):
+            deepface_service.check_image(p)
+        res = await run_inference("detect", _verify_pair, p1, p2, request=request)
+        with metrics.stage("serialize"):
+            return JSONResponse(deepface_service._serialize_deepface_result(res))
     finally:
         for p in (p1, p2):
+            if p is None:
+                continue
             try:
                 os.remove(p)
             except:
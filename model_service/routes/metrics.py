@@ -0,0 +1,26 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import PlainTextResponse
+
+from .. import config
+from ..services import cluster, metrics
+from ..services.auth import require_auth
+
+router = APIRouter()
+
+
+def require_metrics_access(request: Request, x_api_key: Optional[str] = Header(None)):
+    """FastAPI dependency: a valid X-API-KEY or X-Cluster-Secret, unless METRICS_PUBLIC is set."""
+    if config.METRICS_PUBLIC:
+        return
+    if request.headers.get(cluster.SECRET_HEADER):
+        cluster.require_cluster_secret(request)
+    else:
+        require_auth(require_api_key=True)(request, None, x_api_key)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_access)])
+async def prometheus_metrics():
+    """Stage latencies, faces per frame, gallery size, inference load, cache and memory stats (Prometheus text format)."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
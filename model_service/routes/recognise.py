@@ -1,23 +1,39 @@
 from fastapi import APIRouter, UploadFile, File, Form, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
 from typing import Optional
-import base64
 import os
 
-from ..services import deepface_service
+from ..services import cluster, deepface_service, gallery, metrics, pipeline, responses
 from .. import config
 from ..services.auth import require_auth
+from ..services.inference_queue import run_inference
+from ..services.rate_limiter import require_rate_limit
 
 router = APIRouter()
 
 
-@router.post("/recognise", dependencies=[Depends(require_auth(require_api_key=True))])
-async def recognise(request: Request, file: UploadFile = File(None), image_b64: Optional[str] = Form(None)):
+@router.post(
+    "/recognise",
+    dependencies=[Depends(require_auth(require_api_key=True)), Depends(require_rate_limit("recognise"))],
+    responses={200: {"model": responses.RecogniseResult, "content": {"application/msgpack": {}}}},
+)
+async def recognise(
+    request: Request,
+    file: UploadFile = File(None),
+    image_b64: Optional[str] = Form(None),
+    shard: Optional[str] = Form(None),
+    top_k: Optional[int] = Form(None),
+):
     """
     Unified endpoint that accepts:
     - multipart/form-data with file field `file`, OR
     - multipart/form-data with form field `image_b64`, OR
     - application/json body: {"image_b64": "..."}
+
+    Optional `shard` (form field or JSON key) limits the search to gallery
+    shards, e.g. "CSE/sem5" or "CSE/sem5,CSE/sem7"; without it the default
+    gallery is searched. Optional `top_k` (default 1, at most
+    RECOGNISE_MAX_TOP_K) returns up to that many distinct identities per face, nearest first.
     """
 
     deepface_service.ensure_deepface()
@@ -27,51 +43,22 @@ async def recognise(request: Request, file: UploadFile = File(None), image_b64:
     temp_path = None
 
     try:
-        # Priority: explicit uploaded file
-        if file is not None:
-            temp_path = await deepface_service.write_upload_to_tempfile(file)
-        else:
-            # If request is JSON, parse it
-            content_type = request.headers.get("content-type", "")
-            image_b64_local = None
-
-            if content_type.startswith("application/json"):
-                try:
-                    body = await request.json()
-                except Exception:
-                    body = {}
-                image_b64_local = body.get("image_b64")
-            else:
-                # Could be multipart/form with image_b64 as Form field
-                image_b64_local = image_b64
-
-            if not image_b64_local:
-                raise HTTPException(400, "No image provided. Send multipart file, form field 'image_b64', or JSON {'image_b64': ...}.")
-
-            if image_b64_local.startswith("data:"):
-                image_b64_local = image_b64_local.split(",", 1)[1]
-
-            try:
-                raw = base64.b64decode(image_b64_local)
-            except Exception as e:
-                raise HTTPException(400, f"Invalid base64 payload: {e}")
-
-            temp_path = deepface_service.write_bytes_to_tempfile(raw)
+        with metrics.stage("upload"):
+            temp_path, body = await deepface_service.request_image_to_tempfile(request, file, image_b64)
+            deepface_service.check_image(temp_path)
+        try:
+            shards = gallery.parse_shards(shard or body.get("shard"))
+            top_k = int(top_k or body.get("top_k") or 1)
+        except ValueError as ve:
+            raise HTTPException(400, str(ve))
+        top_k = max(1, min(top_k, config.RECOGNISE_MAX_TOP_K))
 
-        # Run DeepFace.find with the temp file
+        # Detect, embed and search the resident gallery (or the cluster's peers)
         try:
-            res = deepface_service.DeepFace.find(
-                img_path=temp_path,
-                db_path=config.ARC_DB_DIR,
-                model_name=config.MODEL_NAME,
-                detector_backend=config.DETECTOR_BACKEND,
-                distance_metric=config.DISTANCE_METRIC,
-                normalization=config.NORMALIZATION,
-                anti_spoofing=config.ANTI_SPOOFING,
-                refresh_database=config.REFRESH_DATABASE,
-                threshold=config.THRESHOLD,
-                batched = True,
-            )
+            if cluster.enabled():
+                res = await pipeline.recognise_on_peers(temp_path, shards, top_k, request=request)
+            else:
+                res = await run_inference("recognise", pipeline.recognise, temp_path, shards, top_k, request=request)
 
         except ValueError as ve:
             msg = str(ve).lower()
@@ -109,42 +96,21 @@ async def recognise(request: Request, file: UploadFile = File(None), image_b64:
             )
 
 
-        # # Normal successful response
-        # clean = deepface_service._serialize_deepface_result(res)
-
-        # # DeepFace returns: [ [ {...}, {...}, ... ] ]
-        # if isinstance(clean, list) and len(clean) > 0 and isinstance(clean[0], list):
-        #     # keep ONLY the best match (first one)
-        #     for i in range(len(clean)):
-        #         if len(clean[i]) > 0:
-        #             clean[i] = [clean[i][0]]
-
-        # return JSONResponse(clean)
-
-
-        clean = deepface_service._serialize_deepface_result(res)
-
-        # DeepFace batched output: List[List[dict]]
-        if isinstance(clean, list) and len(clean) > 0 and isinstance(clean[0], list):
-
-            # ---- NO MATCH FOUND (THIS IS YOUR CASE) ----
-            if all(len(face_matches) == 0 for face_matches in clean):
-                return JSONResponse(
-                    status_code=404,
-                    content={
-                        "status": "error",
-                        "reason": "no_match_found",
-                        "message": "Face detected but no identity matched the database threshold",
-                    },
-                )
+        # Batched output: List[List[match]] with at most the best match per face
+        if len(res) > 0 and all(len(face_matches) == 0 for face_matches in res):
+            # ---- NO MATCH FOUND ----
+            return JSONResponse(
+                status_code=404,
+                content={
+                    "status": "error",
+                    "reason": "no_match_found",
+                    "message": "Face detected but no identity matched the database threshold",
+                },
+            )
 
-            # ---- KEEP ONLY BEST MATCH PER FACE ----
-            for i in range(len(clean)):
-                if len(clean[i]) > 0:
-                    clean[i] = [clean[i][0]]
+        with metrics.stage("serialize"):
+            return responses.render(request, res, responses.RecogniseResult)
 
-        return JSONResponse(clean)
-        
     finally:
         if temp_path:
             try:
@@ -1,32 +1,83 @@
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, Form, Request, HTTPException, Depends
 from fastapi.responses import JSONResponse
-from typing import List
+from typing import List, Optional
 
 from .. import config
-from ..services import deepface_service
+from common import upload_limits
+
+from ..services import deepface_service, gallery, image_prep, metrics, replication
 from ..services.auth import require_auth
+from ..services.inference_queue import run_inference
+from ..services.rate_limiter import require_rate_limit
 
 router = APIRouter()
 
 
-@router.post("/refresh-db", dependencies=[Depends(require_auth(require_api_key=True))])
-async def refresh_db(identity: str = Form(...), files: List[UploadFile] = File(...)):
+@router.post("/refresh-db", dependencies=[Depends(require_auth(require_api_key=True)), Depends(require_rate_limit("refresh-db"))])
+async def refresh_db(
+    request: Request,
+    identity: str = Form(...),
+    files: List[UploadFile] = File(...),
+    shard: Optional[str] = Form(None),
+):
     """
     Register multiple images for ONE identity (student ID).
+    Optional `shard` (e.g. "CSE/sem5") adds them to that gallery shard only.
     """
+    if replication.is_replica():
+        raise HTTPException(409, "This node is a read-only gallery replica; enroll on its primary")
+    try:
+        gallery.shard_path(shard)
+    except ValueError as ve:
+        raise HTTPException(400, str(ve))
 
     deepface_service.ensure_deepface()
     if deepface_service.DeepFace is None:
         raise HTTPException(500, "DeepFace not installed")
 
-    # Read all files -> bytes
-    files_bytes = [await f.read() for f in files]
+    # too many or too large files are refused before anything is enrolled
+    upload_limits.check_files(files, config)
 
     # Import arcface_refresh lazily to avoid heavy deepface imports at module import time
     from ..services import arcface_refresh
 
     # Add all to PKL
-    results = arcface_refresh.add_faces_from_uploads(files_bytes, identity)
+    # one queue entry per image, so live recognition can run between them
+    results = []
+    for idx, f in enumerate(files):
+        # one file in memory at a time
+        with metrics.stage("upload"):
+            data = await upload_limits.read_upload(f, config)
+        try:
+            # header-only check: not an image, or too many pixels to decode
+            image_prep.check(data)
+        except image_prep.ImageRejected as exc:
+            results.append({"status": "error", "error": str(exc), "identity": identity})
+            continue
+        try:
+            results += await run_inference(
+                "enroll", arcface_refresh.add_faces_from_uploads, [data], identity, idx, shard or None, request=request
+            )
+        except HTTPException as exc:
+            if exc.status_code != 503:
+                raise
+            unavailable = exc
+            break
+    else:
+        unavailable = None
+    for r in results:
+        metrics.ENROLLED_IMAGES.inc(status=r.get("status", "unknown"))
+    # exact re-uploads of images already enrolled for this identity were skipped
+    duplicates = sum(1 for r in results if r.get("status") == "duplicate")
+
+    if unavailable is not None:
+        # queue full or a peer down part-way: the images before it stay enrolled and are
+        # listed here; retrying the whole upload skips them as duplicates
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "detail": unavailable.detail, "identity": identity, "duplicates": duplicates, "results": results},
+            headers=unavailable.headers,
+        )
     
     # Check for errors in results
     # results is a list of dicts. If any dict has status='error', we consider it a failure (or partial).
@@ -37,7 +88,7 @@ async def refresh_db(identity: str = Form(...), files: List[UploadFile] = File(.
         # Return 400 Bad Request
         return JSONResponse(
             status_code=400, 
-            content={"status": "error", "identity": identity, "results": results}
+            content={"status": "error", "identity": identity, "duplicates": duplicates, "results": results}
         )
 
-    return JSONResponse({"status": "done", "identity": identity, "results": results})
+    return JSONResponse({"status": "done", "identity": identity, "duplicates": duplicates, "results": results})
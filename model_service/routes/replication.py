@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Depends, Query
+
+from .. import config
+from ..services import replication
+from ..services.cluster import require_cluster_secret
+
+router = APIRouter(prefix="/replication", dependencies=[Depends(require_cluster_secret)])
+
+
+@router.get("/changes")
+def changes(since: int = Query(0, ge=0), limit: int = Query(None, ge=1)):
+    """Gallery changes after sequence `since`, oldest first.
+
+    `changes` is null when they are no longer retained (or `since` is ahead of
+    this node); the caller must then bootstrap from /replication/snapshot.
+    """
+    log = replication.change_log()
+    return {
+        "base_seq": log.base_seq,
+        "head_seq": log.head_seq,
+        "changes": log.since(since, limit or config.REPLICATION_BATCH),
+    }
+
+
+@router.get("/snapshot")
+def snapshot():
+    """Every gallery shard's records and the change sequence they reflect."""
+    return replication.snapshot()
@@ -0,0 +1,85 @@
+from fastapi import APIRouter, UploadFile, File, Form, Request, HTTPException, Depends
+from fastapi.responses import JSONResponse
+from typing import Optional
+import os
+
+from ..services import cluster, deepface_service, gallery, metrics, pipeline, responses
+from ..services.auth import require_auth
+from ..services.inference_queue import run_inference
+from ..services.rate_limiter import require_rate_limit
+
+router = APIRouter()
+
+
+@router.post(
+    "/verify",
+    dependencies=[Depends(require_auth(require_api_key=True)), Depends(require_rate_limit("verify"))],
+    responses={200: {"model": responses.VerifyResult, "content": {"application/msgpack": {}}}},
+)
+async def verify(
+    request: Request,
+    identity: Optional[str] = Form(None),
+    file: UploadFile = File(None),
+    image_b64: Optional[str] = Form(None),
+    shard: Optional[str] = Form(None),
+):
+    """
+    1:1 verification of a probe image against a claimed, already enrolled identity
+    (reg_no or `guest_{id}`). Only that identity's stored embeddings are compared,
+    so a single face is detected and embedded per call.
+
+    Accepts multipart (`identity` + `file` or `image_b64`) or a JSON body
+    {"identity": "...", "image_b64": "..."}. Optional `shard` names the
+    gallery shard(s) the identity is enrolled in, as for /recognise.
+    """
+
+    deepface_service.ensure_deepface()
+    if deepface_service.DeepFace is None:
+        raise HTTPException(500, "DeepFace not installed")
+
+    temp_path = None
+
+    try:
+        with metrics.stage("upload"):
+            temp_path, body = await deepface_service.request_image_to_tempfile(request, file, image_b64)
+            deepface_service.check_image(temp_path)
+        identity = identity or body.get("identity")
+        if not identity:
+            raise HTTPException(400, "No identity provided. Send form field 'identity' or JSON {'identity': ...}.")
+        try:
+            shards = gallery.parse_shards(shard or body.get("shard"))
+        except ValueError as ve:
+            raise HTTPException(400, str(ve))
+
+        try:
+            if cluster.enabled():
+                res = await pipeline.verify_on_peers(temp_path, identity, shards, request=request)
+            else:
+                res = await run_inference("verify", pipeline.verify, temp_path, identity, shards, request=request)
+        except LookupError as le:
+            return JSONResponse(
+                status_code=404,
+                content={"status": "error", "reason": "identity_not_enrolled", "message": str(le)},
+            )
+        except ValueError as ve:
+            msg = str(ve).lower()
+            if "confidence too low" in msg:
+                reason = "low_detection_confidence"
+            elif "spoof" in msg:
+                reason = "spoof_detected"
+            else:
+                reason = "validation_error"
+            return JSONResponse(
+                status_code=422,
+                content={"status": "error", "reason": reason, "message": str(ve)},
+            )
+
+        with metrics.stage("serialize"):
+            return responses.render(request, res, responses.VerifyResult)
+
+    finally:
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except:
+                pass
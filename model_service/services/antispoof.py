@@ -0,0 +1,117 @@
+"""Anti-spoofing for matched faces: batched Fasnet scoring plus a short-lived verdict cache.
+
+The pipeline only asks for verdicts on faces whose best gallery match passed
+the threshold. All of a frame's faces are cropped and pushed through both
+Fasnet backbones in one forward pass each, instead of one ``analyze`` call
+per face. A verdict is cached for ``ANTISPOOF_CACHE_TTL_SECONDS`` under
+(matched identity, face box snapped to a ``ANTISPOOF_CACHE_GRID_PX`` grid),
+so a person standing still in front of a camera is scored about once per
+window rather than once per frame.
+"""
+import importlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+
+Verdict = Tuple[bool, float]
+
+
+class VerdictCache:
+    def __init__(self, ttl_seconds: float, max_entries: int, grid_px: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.grid_px = max(1, int(grid_px))
+        self._entries: "OrderedDict[tuple, Tuple[float, Verdict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, identity: str, area: Dict[str, int]) -> tuple:
+        g = self.grid_px
+        return (identity, int(area["x"]) // g, int(area["y"]) // g, int(area["w"]) // g, int(area["h"]) // g)
+
+    def get(self, key: tuple) -> Optional[Verdict]:
+        if self.ttl_seconds <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, verdict: Verdict) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+verdict_cache = VerdictCache(config.ANTISPOOF_CACHE_TTL_SECONDS, config.ANTISPOOF_CACHE_MAX_ENTRIES, config.ANTISPOOF_CACHE_GRID_PX)
+
+
+def _boxes(areas: Sequence[Dict[str, int]]) -> List[Tuple[int, int, int, int]]:
+    return [(int(a["x"]), int(a["y"]), int(a["w"]), int(a["h"])) for a in areas]
+
+
+def score_faces(model, img: np.ndarray, areas: Sequence[Dict[str, int]]) -> List[Verdict]:
+    """(is_real, score) per face box, identical to Fasnet.analyze but batched.
+
+    Falls back to one ``analyze`` call per face for spoof models that don't
+    expose DeepFace's two Fasnet backbones (or when torch is unavailable).
+    """
+    boxes = _boxes(areas)
+    if not boxes:
+        return []
+    crop = getattr(importlib.import_module(type(model).__module__), "crop", None)
+    if crop is None or not hasattr(model, "first_model") or not hasattr(model, "second_model"):
+        return [tuple(model.analyze(img=img, facial_area=box)) for box in boxes]
+
+    import torch
+    import torch.nn.functional as F
+
+    def batch(scale: float):
+        crops = [crop(img, box, scale, 80, 80) for box in boxes]
+        return torch.from_numpy(np.stack(crops).transpose((0, 3, 1, 2))).float().to(model.device)
+
+    with torch.no_grad():
+        prediction = F.softmax(model.first_model.forward(batch(2.7)), dim=1)
+        prediction += F.softmax(model.second_model.forward(batch(4)), dim=1)
+    prediction = prediction.cpu().numpy()
+    labels = prediction.argmax(axis=1)
+    scores = prediction[np.arange(len(boxes)), labels] / 2
+    return [(bool(label == 1), float(score)) for label, score in zip(labels, scores)]
+
+
+def verdicts(model, img: np.ndarray, areas: Sequence[Dict[str, int]], identities: Sequence[str]) -> List[Verdict]:
+    """Verdict per face, from the cache where fresh, scoring the rest in one batch."""
+    from . import metrics
+
+    keys = [verdict_cache.key(identity, area) for identity, area in zip(identities, areas)]
+    out: List[Optional[Verdict]] = [verdict_cache.get(k) for k in keys]
+    todo = [i for i, v in enumerate(out) if v is None]
+    metrics.ANTISPOOF_FACES.inc(len(keys) - len(todo), result="cached")
+    if todo:
+        scored = score_faces(model, img, [areas[i] for i in todo])
+        metrics.ANTISPOOF_FACES.inc(len(todo), result="scored")
+        for i, verdict in zip(todo, scored):
+            out[i] = verdict
+            verdict_cache.put(keys[i], verdict)
+    return out
@@ -1,49 +1,166 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import hashlib
 import tempfile
 import os
 import pickle
+import threading
 from pathlib import Path
 
-from deepface.modules import recognition
-from deepface.commons import image_utils
-
 from .. import config
+from . import cluster, crop_store, deadline, face_detection, image_prep, metrics, pipeline
+
+
+def content_hash(img) -> str:
+    """Hash of a decoded image's pixels: the same photo re-uploaded (even re-encoded losslessly) hashes the same."""
+    digest = hashlib.sha256(repr(img.shape).encode("ascii"))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def _embed_file(path: str, identity: str, img=None, scale: float = 1.0) -> list:
+    """One record per face in the image at `path` (already decoded as `img`, at `scale`), found by the ENROLL_DETECTOR_CASCADE.
+
+    Detection and embedding run through the same pipeline stages as /recognise
+    (with the enrollment cascade), so gallery and probe embeddings come from
+    identical preprocessing. With KEEP_ENROLLMENT_CROPS each record also
+    carries its aligned face as "crop" (see services/crop_store.py).
+    """
+    _, detection, modeling = pipeline._deepface()
+    if img is None:
+        img, scale = pipeline.load_scaled(path, config.PREP_MAX_SIDE_ENROLL)
+    deadline.check("detect")
+    with metrics.stage("detect"):
+        faces = face_detection.detect(detection, img, "enroll", modeling)
+    if not faces:
+        raise ValueError(f"Face could not be detected in the enrollment image for {identity}")
+    deadline.check("represent")
+    embeddings = pipeline.embed_faces(faces)
+    reps = []
+    for face, emb in zip(faces, embeddings):
+        # boxes are stored in the uploaded photo's pixels
+        area = image_prep.to_original(face["facial_area"], scale)
+        rep = {
+            "identity": path,
+            "embedding": emb.tolist(),
+            "target_x": area["x"],
+            "target_y": area["y"],
+            "target_w": area["w"],
+            "target_h": area["h"],
+        }
+        if config.KEEP_ENROLLMENT_CROPS:
+            rep["crop"] = crop_store.to_crop(face["face"])
+        reps.append(rep)
+    return reps
+
+
+def load_db(shard: Optional[str] = None) -> list:
+    """Load the ArcFace PKL database of `shard` (the default gallery when None)."""
+    from .gallery import shard_path
+
+    path = shard_path(shard)
+    if not os.path.exists(path):
+        return []
+    return pickle.load(open(path, "rb"))
+
+
+def _write_db(data: list, shard: Optional[str]) -> None:
+    from .gallery import shard_path
+
+    path = shard_path(shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # readers (and a crash mid-write) only ever see a complete file
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
 
 
-# Access private DeepFace helper (name-mangled)
-find_bulk = getattr(recognition, "_recognition__find_bulk_embeddings", None)
-if find_bulk is None:
-    find_bulk = getattr(recognition, "__find_bulk_embeddings", None)
+def save_db(data: list, shard: Optional[str] = None):
+    """Write `shard`'s updated ArcFace PKL database; other shards are left untouched."""
+    from . import gallery
 
+    _write_db(data, shard)
+    # make the resident gallery pick the new rows up on the next search
+    gallery.invalidate(shard)
 
-PKL_PATH = config.ARC_PKL_PATH
 
+# serialises gallery writes, so change-log order matches the order rows reach the files
+# reentrant: append_records holds it around its dedupe check and write_changes
+db_lock = threading.RLock()
 
-def load_db() -> list:
-    """Load entire ArcFace PKL database."""
-    if not os.path.exists(PKL_PATH):
+
+def write_shards(changes: List[Tuple[Optional[str], List[dict], int]]) -> None:
+    """Append logged (shard, records, seq) changes to the shard PKLs, writing each shard once.
+
+    Every row is stamped with its change's "seq" (see replication.recover).
+    Callers hold db_lock.
+    """
+    from . import gallery
+
+    by_shard: Dict[Optional[str], List[dict]] = {}
+    for shard, records, seq in changes:
+        by_shard.setdefault(shard, []).extend(dict(r, seq=seq) for r in records)
+    for shard, records in by_shard.items():
+        path = gallery.shard_path(shard)
+        before = gallery.file_stamp(path)
+        db = load_db(shard)
+        db.extend(records)
+        _write_db(db, shard)
+        gallery.extend(shard, records, before, gallery.file_stamp(path))
+
+
+def write_changes(changes: List[Tuple[Optional[str], List[dict], Optional[int]]]) -> List[int]:
+    """Log (shard, records, seq or None) changes, then write them to the shards; returns their sequence numbers."""
+    from . import replication
+
+    if not changes:
         return []
-    return pickle.load(open(PKL_PATH, "rb"))
+    with db_lock:
+        log = replication.change_log()
+        # logged (and fsync'd) first: a crash before the PKL writes is repaired by replication.recover()
+        seqs = log.append_many(changes)
+        write_shards([(shard, records, seq) for (shard, records, _), seq in zip(changes, seqs)])
+        log.mark_applied(seqs[-1])
+    return seqs
 
 
-def save_db(data: list):
-    """Write updated ArcFace PKL database."""
-    os.makedirs(os.path.dirname(PKL_PATH), exist_ok=True)
-    pickle.dump(data, open(PKL_PATH, "wb"), pickle.HIGHEST_PROTOCOL)
+def append_records(records: List[dict], shard: Optional[str] = None, seq: Optional[int] = None, crops: Optional[list] = None) -> int:
+    """Append gallery records to `shard`'s PKL and the replication change log; returns how many.
 
+    The resident index is extended in place instead of reloading the shard.
+    `seq` is the primary's sequence number when a replica replays a change.
+    `crops` (one per record) go to the shard's crop store.
 
-def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
+    Records of an image already enrolled for the same identity (same
+    identity and "hash") are dropped; a replayed change is applied as is.
+    """
+    from . import gallery
+
+    with db_lock:
+        if seq is None:
+            # checked against the resident index (reloaded only if the PKL changed), not a fresh unpickle
+            index = gallery.get_gallery(shard).refresh()
+            keep = [i for i, r in enumerate(records) if not index.rows_for_image(r.get("identity"), r.get("hash"))]
+            records = [records[i] for i in keep]
+            crops = [crops[i] for i in keep] if crops else crops
+            if not records:
+                return 0
+        seq = write_changes([(shard, records, seq)])[0]
+        if crops:
+            crop_store.store(shard).append([dict(r, seq=seq) for r in records], crops)
+    return len(records)
+
+
+def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0, shard: Optional[str] = None) -> dict:
     """
     Add a single face embedding to the ArcFace PKL DB.
     Supports multiple images per SAME identity.
     
     identity → the student ID or person ID (constant)
     index → gives each temporary file a unique name to avoid detector confusion
+    shard → gallery shard to add to (e.g. "CSE/sem5"); None is the default gallery
     """
 
-    if find_bulk is None:
-        raise RuntimeError("DeepFace internal find_bulk helper not available in this DeepFace version")
-
     # ---- UNIQUE TEMP FILENAME FOR MULTIPLE IMAGES ----
     safe_id = identity.replace("/", "_").replace("\\", "_")
     temp_dir = tempfile.gettempdir()
@@ -53,18 +170,17 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
         f.write(image_bytes)
 
     try:
-        employees = {tmp_path}
-
-        reps = find_bulk(
-            employees=employees,
-            model_name=config.MODEL_NAME,
-            detector_backend=config.DETECTOR_BACKEND,
-            enforce_detection=True,
-            align=config.ALIGN,
-            expand_percentage=0,
-            normalization=config.NORMALIZATION,
-            silent=False,
-        )
+        img, scale = pipeline.load_scaled(tmp_path, config.PREP_MAX_SIDE_ENROLL)
+        digest = content_hash(img)
+        duplicate = {"status": "duplicate", "identity": identity, "added": 0, "hash": digest}
+        if not cluster.enabled():
+            from . import gallery
+
+            # exact re-upload: answered from the resident index, before any inference
+            if gallery.get_gallery(shard).refresh().rows_for_image(identity, digest):
+                return duplicate
+
+        reps = _embed_file(tmp_path, identity, img, scale)
 
         # ---- OVERRIDE IDENTITY (CRITICAL) ----
         # DeepFace normally stores the filename and other metadata; we will
@@ -126,6 +242,7 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
 
 
         cleaned = []
+        crops = []
         for idx_r, r in enumerate(reps):
             emb = _extract_embedding(r)
             if emb is None:
@@ -141,10 +258,11 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
                 pass
 
             # DeepFace expects certain keys in DB records (target_x/y/w/h and hash)
-            # We provide neutral defaults (0) for bounding box and a stable hash.
-            record_hash = f"{identity}_{index}_{idx_r}"
+            # We provide neutral defaults (0) for bounding box; the hash is the
+            # image's content hash, shared by all faces found in it.
+            record_hash = digest
 
-                        # CHANGED: extract bounding-box info from the representation returned by find_bulk (if present)
+                        # CHANGED: extract bounding-box info from the representation returned by _embed_file (if present)
             # This prevents always writing zeros into PKL when actual detection produced bbox coords.
             def _to_int_safe(v, default=0):
                 try:
@@ -161,7 +279,7 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
                 except Exception:
                     return default
 
-            # try to find bbox fields on the `r` record which find_bulk returned
+            # try to find bbox fields on the `r` record which _embed_file returned
             tx = _to_int_safe(r.get("target_x") if isinstance(r, dict) else None, 0)
             ty = _to_int_safe(r.get("target_y") if isinstance(r, dict) else None, 0)
             tw = _to_int_safe(r.get("target_w") if isinstance(r, dict) else None, 0)
@@ -174,7 +292,7 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
                 "rep": list(emb),
                 "representations": list(emb),
                 "model": config.MODEL_NAME,
-                # bounding box: prefer values returned by find_bulk, fallback to 0
+                # bounding box: prefer values returned by _embed_file, fallback to 0
                 "target_x": tx,
                 "target_y": ty,
                 "target_w": tw,
@@ -182,6 +300,7 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
                 # some deepface versions expect a hash key
                 "hash": record_hash,
             })
+            crops.append(r.get("crop"))
 # END CHANGED: now storing bbox values from rep when available
 
 
@@ -189,11 +308,18 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
         if not cleaned:
              return {"status": "error", "error": "No face detected in the image", "identity": identity, "added": 0}
 
-        db = load_db()
-        db.extend(cleaned)
-        save_db(db)
+        if not config.KEEP_ENROLLMENT_CROPS:
+            crops = None
+        if cluster.enabled():
+            # coordinator: the records live on the peer owning this identity's partition
+            added = cluster.store(identity, shard, cleaned, crops)
+        else:
+            added = append_records(cleaned, shard, crops=crops)
+        if not added:
+            # the same image was enrolled concurrently (or, through a coordinator, earlier)
+            return duplicate
 
-        return {"status": "success", "identity": identity, "added": len(cleaned)}
+        return {"status": "success", "identity": identity, "added": added}
 
     finally:
         # Delete temp file
@@ -203,16 +329,21 @@ def add_face_arcface(image_bytes: bytes, identity: str, index: int = 0) -> dict:
             pass
 
 
-def add_faces_from_uploads(files: List[bytes], identity: str) -> List[dict]:
+def add_faces_from_uploads(files: List[bytes], identity: str, first_index: int = 0, shard: Optional[str] = None) -> List[dict]:
     """
     Add multiple faces for the SAME identity.
     identity → student ID (e.g., "202200248")
+    first_index → index of files[0] within the upload (keeps temp names unique)
+    shard → gallery shard to add to; None is the default gallery
     """
     results = []
-    for idx, file_bytes in enumerate(files):
+    for idx, file_bytes in enumerate(files, start=first_index):
         try:
-            res = add_face_arcface(file_bytes, identity, index=idx)
+            res = add_face_arcface(file_bytes, identity, index=idx, shard=shard)
             results.append(res)
+        except (deadline.DeadlineExceeded, cluster.PeerUnavailable):
+            # the caller is gone, or should retry later; images already added stay enrolled
+            raise
         except Exception as e:
             results.append({"status": "error", "error": str(e), "identity": identity})
     return results
@@ -1,15 +1,17 @@
 import uuid
 import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import NamedTuple, Optional
 
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, func
 from sqlalchemy.orm import relationship, Session
 
 from passlib.context import CryptContext
 import jwt
 
-from .db import Base, get_db
+from .db import Base, SessionLocal, get_db
 from .. import config
 
 pwd_ctx = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -35,14 +37,20 @@ class ApiKey(Base):
     user = relationship("User")
 
 
+class ApiKeyRevocation(Base):
+    """One row per revoked API key, polled by every process to drop it from its cache."""
+
+    __tablename__ = "api_key_revocations"
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)
+    revoked_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
 class RevokedToken(Base):
     __tablename__ = "revoked_tokens"
     id = Column(Integer, primary_key=True)
     jti = Column(String, unique=True, index=True, nullable=False)
-    expires_at = Column(DateTime, index=True)
-
-
-Index("ix_revoked_tokens_expires_at", RevokedToken.expires_at)
+    expires_at = Column(DateTime, index=True)  # creates ix_revoked_tokens_expires_at
 
 
 def create_user(db: Session, username: str, password: str) -> User:
@@ -147,8 +155,167 @@ def get_api_key(db: Session, key: str) -> Optional[ApiKey]:
     return ak
 
 
+def revoke_api_key(db: Session, key: str, user: Optional[User] = None) -> bool:
+    q = db.query(ApiKey).filter(ApiKey.key == key)
+    if user is not None:
+        q = q.filter(ApiKey.user_id == user.id)
+    ak = q.first()
+    if not ak:
+        return False
+    ak.revoked = True
+    db.add(ApiKeyRevocation(key=key))
+    # older rows can only match cache entries that have expired anyway
+    horizon = datetime.utcnow() - timedelta(seconds=config.API_KEY_CACHE_TTL_SECONDS + config.API_KEY_REVOCATION_POLL_SECONDS)
+    db.query(ApiKeyRevocation).filter(ApiKeyRevocation.revoked_at < horizon).delete()
+    db.commit()
+    api_key_cache.invalidate(key)
+    return True
+
+
+class ApiKeyPrincipal(NamedTuple):
+    """What model endpoints need to know about a validated API key."""
+
+    key: str
+    user_id: int
+    expires_at: Optional[float]  # unix seconds, None = never
+
+
+class ApiKeyCache:
+    """Bounded, TTL-limited cache of validated API keys (LRU eviction).
+
+    An entry is served until the earlier of its TTL and the key's own expiry.
+    Only positive lookups are cached, so a newly created key is usable at once;
+    revocation goes through `invalidate` (see `sync_revocations` for other processes).
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[ApiKeyPrincipal]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, valid_until = entry
+            if now >= valid_until:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return principal
+
+    def put(self, principal: ApiKeyPrincipal) -> None:
+        valid_until = time.time() + self.ttl_seconds
+        if principal.expires_at is not None:
+            valid_until = min(valid_until, principal.expires_at)
+        with self._lock:
+            self._entries[principal.key] = (principal, valid_until)
+            self._entries.move_to_end(principal.key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+            }
+
+
+api_key_cache = ApiKeyCache(config.API_KEY_CACHE_MAX_ENTRIES, config.API_KEY_CACHE_TTL_SECONDS)
+
+_revocations_lock = threading.Lock()
+_revocations_seen: Optional[int] = None  # highest api_key_revocations.id applied to the cache
+_revocations_next_poll = 0.0
+
+
+def sync_revocations(db: Optional[Session] = None) -> None:
+    """Drop keys revoked by any process from this process's cache.
+
+    Polls `api_key_revocations` at most every API_KEY_REVOCATION_POLL_SECONDS;
+    a thread that finds another one polling doesn't wait for it.
+    """
+    global _revocations_seen, _revocations_next_poll
+    if time.time() < _revocations_next_poll or not _revocations_lock.acquire(blocking=False):
+        return
+    own_session = db is None
+    try:
+        _revocations_next_poll = time.time() + config.API_KEY_REVOCATION_POLL_SECONDS
+        if own_session:
+            db = SessionLocal()
+        if _revocations_seen is None:
+            # nothing is cached yet, so earlier revocations don't matter
+            _revocations_seen = db.query(func.max(ApiKeyRevocation.id)).scalar() or 0
+            return
+        rows = (
+            db.query(ApiKeyRevocation.id, ApiKeyRevocation.key)
+            .filter(ApiKeyRevocation.id > _revocations_seen)
+            .order_by(ApiKeyRevocation.id)
+            .all()
+        )
+        for row_id, key in rows:
+            api_key_cache.invalidate(key)
+            _revocations_seen = row_id
+    finally:
+        if own_session and db is not None:
+            db.close()
+        _revocations_lock.release()
+
+
+def resolve_api_key(key: str, db: Optional[Session] = None) -> Optional[ApiKeyPrincipal]:
+    """Validate `key`, answering from the cache and only querying the DB on a miss."""
+    sync_revocations()
+    principal = api_key_cache.get(key)
+    if principal is not None:
+        return principal
+
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        ak = get_api_key(db, key)
+        if not ak:
+            return None
+        expires_at = None
+        if ak.expires_at:
+            expires_at = ak.expires_at.replace(tzinfo=timezone.utc).timestamp()
+        principal = ApiKeyPrincipal(key=ak.key, user_id=ak.user_id, expires_at=expires_at)
+    finally:
+        if own_session:
+            db.close()
+
+    api_key_cache.put(principal)
+    return principal
+
+
 # FastAPI dependency factory for combined auth
-from fastapi import HTTPException, Header
+from fastapi import HTTPException, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Security, Depends
 
@@ -156,14 +323,18 @@ security = HTTPBearer(auto_error=False)
 
 
 def require_auth(require_api_key: bool = False, require_jwt: bool = False):
-    def _dep(authorization: HTTPAuthorizationCredentials = Security(security), x_api_key: str | None = Header(None), db: Session = Depends(get_db)):
+    # No per-request DB session: API keys are answered from api_key_cache and a
+    # session is only opened on a cache miss or for the JWT revocation check.
+    def _dep(request: Request, authorization: HTTPAuthorizationCredentials = Security(security), x_api_key: str | None = Header(None)):
         # API key check
         if require_api_key:
             if not x_api_key:
                 raise HTTPException(status_code=401, detail="API key required")
-            ak = get_api_key(db, x_api_key)
+            ak = resolve_api_key(x_api_key)
             if not ak:
                 raise HTTPException(status_code=401, detail="Invalid API key")
+            # the inference scheduler weights callers by key owner
+            request.state.api_key_principal = ak
 
         # JWT check
         if require_jwt:
@@ -175,7 +346,12 @@ def require_auth(require_api_key: bool = False, require_jwt: bool = False):
             except Exception:
                 raise HTTPException(status_code=401, detail="Invalid token")
             jti = payload.get("jti")
-            if is_token_revoked(db, jti):
+            db = SessionLocal()
+            try:
+                revoked = is_token_revoked(db, jti)
+            finally:
+                db.close()
+            if revoked:
                 raise HTTPException(status_code=401, detail="Token revoked")
 
         return True
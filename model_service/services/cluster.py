@@ -0,0 +1,234 @@
+"""Scatter-gather gallery search across peer model_service nodes.
+
+With ``CLUSTER_PEERS`` set, this node is a coordinator. It still decodes,
+detects and embeds every /recognise frame itself, once, but the gallery lives
+on the peers: one partition per peer, each an ordinary model_service with
+its own gallery files. Once an inference worker has returned the probe
+embeddings, they are posted from the event loop to every peer holding a
+relevant partition concurrently (``POST /cluster/search``), so no worker
+waits on the network; each peer returns its k nearest identities per face
+and the coordinator merges them into the overall top k.
+
+Identities are assigned to partitions by ``CLUSTER_PARTITION_BY``:
+``identity`` hashes each identity across all peers (searches fan out to
+every peer), ``shard`` keeps a whole gallery shard on one peer (searches go
+only to the peers of the requested shards). Enrollment through the
+coordinator embeds locally and stores the records on the owning peer
+(``POST /cluster/enroll``). Changing the peer list moves partitions, so
+galleries must then be re-enrolled.
+
+Peers accept /cluster/* calls only with the shared ``CLUSTER_SECRET``. The
+request's remaining deadline is forwarded, and a peer that fails or times
+out fails the request with 503 rather than silently returning matches from
+part of the gallery. Per-peer latency and errors are exported as
+``model_service_cluster_peer_seconds{peer}`` and
+``model_service_cluster_peer_errors_total{peer}``.
+"""
+import asyncio
+import hashlib
+import hmac
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+from fastapi import HTTPException, Request
+
+from .. import config
+from . import deadline, gallery, metrics
+
+SECRET_HEADER = "x-cluster-secret"
+
+
+class PeerUnavailable(Exception):
+    """A peer holding part of the gallery did not answer in time."""
+
+    def __init__(self, peer: str, cause: Exception):
+        super().__init__(f"Gallery peer {peer} unavailable: {cause}")
+        self.peer = peer
+
+
+def require_cluster_secret(request: Request):
+    """FastAPI dependency: only nodes holding CLUSTER_SECRET may call /cluster/* and /replication/*."""
+    sent = request.headers.get(SECRET_HEADER, "")
+    if not config.CLUSTER_SECRET or not hmac.compare_digest(sent.encode(), config.CLUSTER_SECRET.encode()):
+        raise HTTPException(403, "Node-to-node endpoints require X-Cluster-Secret")
+
+
+def enabled() -> bool:
+    return bool(config.CLUSTER_PEERS)
+
+
+def partition_of(identity: str, shard: Optional[str] = None) -> int:
+    """Partition (index into CLUSTER_PEERS) that stores `identity` enrolled into `shard`."""
+    key = (shard or "") if config.CLUSTER_PARTITION_BY == "shard" else identity
+    return int.from_bytes(hashlib.sha1(key.encode("utf-8")).digest()[:8], "big") % len(config.CLUSTER_PEERS)
+
+
+def _peers_for(shards: Sequence[Optional[str]]) -> List[str]:
+    if config.CLUSTER_PARTITION_BY == "shard":
+        return [config.CLUSTER_PEERS[p] for p in sorted({partition_of("", s) for s in shards})]
+    return list(config.CLUSTER_PEERS)
+
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_init_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    n = max(1, len(config.CLUSTER_PEERS))
+    return httpx.Limits(max_connections=4 * n, max_keepalive_connections=4 * n)
+
+
+def _http() -> httpx.Client:
+    """Blocking client, for store() (which runs on an inference worker)."""
+    global _client
+    with _init_lock:
+        if _client is None:
+            _client = httpx.Client(limits=_limits())
+        return _client
+
+
+def _async_http() -> httpx.AsyncClient:
+    """Client for searches; one per event loop, as its connections belong to the loop that opened them."""
+    global _async_client, _async_loop
+    loop = asyncio.get_running_loop()
+    if _async_loop is not loop:
+        if _async_client is not None and not _async_loop.is_closed():
+            # its connections can only be closed on the loop that opened them
+            asyncio.run_coroutine_threadsafe(_async_client.aclose(), _async_loop)
+        _async_client, _async_loop = httpx.AsyncClient(limits=_limits()), loop
+    return _async_client
+
+
+async def aclose() -> None:
+    """Close the peer clients; called on app shutdown, from the loop that served the searches."""
+    global _client, _async_client, _async_loop
+    if _async_client is not None and _async_loop is asyncio.get_running_loop():
+        await _async_client.aclose()
+    _async_client = _async_loop = None
+    with _init_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def _timeout() -> float:
+    """Per-peer timeout: CLUSTER_TIMEOUT_SECONDS, capped by what is left of the request's deadline."""
+    current = deadline.current()
+    remaining = None if current is None else current.remaining()
+    if remaining is None:
+        return config.CLUSTER_TIMEOUT_SECONDS
+    return max(0.001, min(config.CLUSTER_TIMEOUT_SECONDS, remaining))
+
+
+def _headers(timeout: float) -> Dict[str, str]:
+    return {SECRET_HEADER: config.CLUSTER_SECRET, deadline.HEADER: str(int(timeout * 1000))}
+
+
+def _post(peer: str, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        resp = _http().post(peer + path, json=payload, headers=_headers(timeout), timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.HTTPError as exc:
+        metrics.CLUSTER_PEER_ERRORS.inc(peer=peer)
+        raise PeerUnavailable(peer, exc)
+    finally:
+        metrics.CLUSTER_PEER_SECONDS.observe(time.perf_counter() - start, peer=peer)
+
+
+async def _post_async(peer: str, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        resp = await _async_http().post(peer + path, json=payload, headers=_headers(timeout), timeout=timeout)
+        resp.raise_for_status()
+        return resp.json()
+    except httpx.HTTPError as exc:
+        metrics.CLUSTER_PEER_ERRORS.inc(peer=peer)
+        raise PeerUnavailable(peer, exc)
+    finally:
+        metrics.CLUSTER_PEER_SECONDS.observe(time.perf_counter() - start, peer=peer)
+
+
+async def _scatter(peers: List[str], path: str, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """POST `payload` to every peer concurrently; raises PeerUnavailable if any of them fails."""
+    timeout = _timeout()
+    return list(await asyncio.gather(*(_post_async(peer, path, payload, timeout) for peer in peers)))
+
+
+def _ranked(reply: Dict[str, Any], probes: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """A peer's ragged candidate lists as (M, k) arrays padded with None / inf."""
+    identities = np.full((probes, k), None, dtype=object)
+    distances = np.full((probes, k), np.inf)
+    for i, (ids, dist) in enumerate(zip(reply["identities"], reply["distances"])):
+        n = min(k, len(ids))
+        identities[i, :n] = ids[:n]
+        distances[i, :n] = dist[:n]
+    return identities, distances
+
+
+async def search(embeddings: np.ndarray, shards: Sequence[Optional[str]], k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k (identities, distances), both (M, k), over the partitions holding `shards`."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    shards = list(shards or [None])
+    payload = {"embeddings": embeddings.tolist(), "shards": shards, "k": k}
+    replies = await _scatter(_peers_for(shards), "/cluster/search", payload)
+    ranked = [_ranked(reply, embeddings.shape[0], k) for reply in replies]
+    return gallery.merge_top_k([r[0] for r in ranked], [r[1] for r in ranked], k, embeddings.shape[0])
+
+
+async def verify(embedding: np.ndarray, identity: str, shards: Sequence[Optional[str]]) -> Tuple[Optional[float], int]:
+    """(distance, enrolled rows) of `identity` on the peers that may hold it."""
+    shards = list(shards or [None])
+    if config.CLUSTER_PARTITION_BY == "shard":
+        peers = _peers_for(shards)
+    else:
+        peers = [config.CLUSTER_PEERS[partition_of(identity)]]
+    payload = {"embedding": np.asarray(embedding, dtype=np.float32).reshape(-1).tolist(), "identity": identity, "shards": shards}
+    best, count = None, 0
+    for reply in await _scatter(peers, "/cluster/verify", payload):
+        if reply["distance"] is not None:
+            best = reply["distance"] if best is None else min(best, reply["distance"])
+        count += reply["enrolled"]
+    return best, count
+
+
+def store(identity: str, shard: Optional[str], records: List[Dict[str, Any]], crops: Optional[List[np.ndarray]] = None) -> int:
+    """Append `identity`'s gallery records (and their face crops) to `shard` on the peer that owns them; returns the rows stored."""
+    from . import crop_store
+
+    peer = config.CLUSTER_PEERS[partition_of(identity, shard)]
+    payload = {"identity": identity, "shard": shard, "records": records}
+    if crops:
+        payload["crops"] = crop_store.encode_crops(crops)
+    reply = _post(peer, "/cluster/enroll", payload, _timeout())
+    return int(reply["added"])
+
+
+# ---- peer side ----
+
+
+def local_search(embeddings: np.ndarray, shards: Sequence[Optional[str]], k: int) -> Dict[str, List[list]]:
+    """This node's top-k candidates per probe, without padding, for a coordinator."""
+    deadline.check("search")
+    with metrics.stage("search"):
+        _, indexes = gallery.resident_indexes(shards)
+        identities, distances = gallery.top_k_many(indexes, embeddings, k)
+    found = np.isfinite(distances)
+    return {
+        "identities": [ids[ok].tolist() for ids, ok in zip(identities, found)],
+        "distances": [dist[ok].tolist() for dist, ok in zip(distances, found)],
+    }
+
+
+def local_verify(embedding: np.ndarray, identity: str, shards: Sequence[Optional[str]]) -> Dict[str, Any]:
+    deadline.check("search")
+    with metrics.stage("search"):
+        _, indexes = gallery.resident_indexes(shards)
+        distance, count = gallery.identity_distance(indexes, embedding, identity)
+    return {"distance": distance, "enrolled": count}
@@ -0,0 +1,225 @@
+"""Aligned face crops kept from enrollment, so the gallery can be re-embedded without re-uploads.
+
+Every face enrolled into a shard also has its detected, aligned crop saved,
+resized to ``CROP_STORE_SIZE`` square and stored as 8-bit RGB, in
+``crops/`` next to the shard's PKL (``ARC_DB_DIR/crops`` for the default
+shard). The store is independent of ``ARC_PKL_NAME``, so it outlives a
+change of model, detector or normalization. Crops are appended to raw chunk
+files of ``CROP_STORE_CHUNK_ROWS`` rows each (a chunk loads with one read),
+and ``index.jsonl`` maps every gallery record (without its embedding) to its
+chunk and row.
+
+``python -m model_service.rebuild_gallery`` reads the store back and
+re-embeds every crop with the current recognizer, skipping decode and
+detection entirely.
+"""
+import base64
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+
+# record keys holding the embedding; everything else is kept in the index
+_EMBEDDING_KEYS = ("embedding", "rep", "representations")
+
+
+def to_crop(face: np.ndarray) -> np.ndarray:
+    """An extract_faces crop (RGB float in [0, 1]) as a CROP_STORE_SIZE square uint8 image.
+
+    The crop is letterboxed exactly as the recognizer's own preprocessing
+    does, so re-embedding it only loses the 8-bit rounding.
+    """
+    face = np.asarray(face)
+    if face.dtype == np.uint8:
+        # already 8-bit (the fake backend's seeds); kept as they are
+        return face
+    from deepface.modules import preprocessing
+
+    img = preprocessing.resize_image(img=face, target_size=(config.CROP_STORE_SIZE, config.CROP_STORE_SIZE))[0]
+    return np.clip(np.rint(img * 255.0), 0, 255).astype(np.uint8)
+
+
+def from_crop(crop: np.ndarray) -> np.ndarray:
+    """A stored crop back in the form recognizer.embed_faces takes."""
+    if crop.ndim == 3:
+        return crop.astype(np.float32) / 255.0
+    return crop
+
+
+def encode_crops(crops: Sequence[np.ndarray]) -> List[Dict[str, Any]]:
+    """JSON-safe crops (shape + base64 bytes), e.g. for /cluster/enroll."""
+    return [{"shape": list(c.shape), "data": base64.b64encode(np.ascontiguousarray(c, dtype=np.uint8).tobytes()).decode("ascii")} for c in crops]
+
+
+def decode_crops(crops: Sequence[Dict[str, Any]]) -> List[np.ndarray]:
+    return [np.frombuffer(base64.b64decode(c["data"]), dtype=np.uint8).reshape(c["shape"]) for c in crops]
+
+
+class CropStore:
+    """Append-only chunked store of one shard's enrollment crops.
+
+    All crops in a store share one shape, recorded in ``meta.json`` on the
+    first append together with ``pkl_name``: the ARC_PKL_NAME of the gallery
+    the crops were enrolled into, which rebuild_gallery moves to the new name
+    once it has re-embedded them. Chunk bytes are written before the index line that points
+    at them, so a crash leaves at most unreferenced bytes at the end of the
+    last chunk, which the next append overwrites.
+    """
+
+    def __init__(self, directory: str, chunk_rows: int):
+        self.directory = directory
+        self.chunk_rows = max(1, int(chunk_rows))
+        self._index_path = os.path.join(directory, "index.jsonl")
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.Lock()
+        self.shape: Optional[Tuple[int, ...]] = None
+        self.pkl_name: Optional[str] = None
+        self._count = 0
+        self._tail: Tuple[int, int] = (0, 0)  # (chunk, rows) of the last chunk
+        self._load()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _chunk_path(self, chunk: int) -> str:
+        return os.path.join(self.directory, f"chunk-{chunk:06d}.u8")
+
+    def _load(self) -> None:
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            self.shape = tuple(meta["shape"])
+            # stores written before pkl_name was recorded have none
+            self.pkl_name = meta.get("pkl_name")
+        if not os.path.exists(self._index_path):
+            return
+        end = 0
+        last = None
+        with open(self._index_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                last = line
+                self._count += 1
+        if os.path.getsize(self._index_path) != end:
+            # torn last write from a crash; that enrollment was never acknowledged
+            with open(self._index_path, "r+b") as f:
+                f.truncate(end)
+        if last is not None:
+            entry = json.loads(last)
+            self._tail = (entry["chunk"], entry["row"] + 1)
+
+    def append(self, records: Sequence[Dict[str, Any]], crops: Sequence[np.ndarray]) -> None:
+        """Store `crops[i]` as the crop of gallery record `records[i]`."""
+        if len(records) != len(crops):
+            raise ValueError("Every record needs exactly one crop")
+        if not crops:
+            return
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if self.shape is None:
+                self.shape = tuple(crops[0].shape)
+                self.pkl_name = config.ARC_PKL_NAME
+                self._write_meta()
+            lines = []
+            chunk, rows = self._tail
+            for rec, crop in zip(records, crops):
+                if tuple(crop.shape) != self.shape or crop.dtype != np.uint8:
+                    raise ValueError(f"Crop {crop.dtype}{tuple(crop.shape)} does not match the store's uint8{self.shape}")
+                if rows >= self.chunk_rows:
+                    chunk, rows = chunk + 1, 0
+                self._write_row(chunk, rows, crop)
+                meta = {k: v for k, v in rec.items() if k not in _EMBEDDING_KEYS}
+                lines.append(json.dumps({"chunk": chunk, "row": rows, "record": meta}, separators=(",", ":")))
+                rows += 1
+            with open(self._index_path, "ab") as f:
+                f.write("".join(line + "\n" for line in lines).encode("utf-8"))
+            self._tail = (chunk, rows)
+            self._count += len(lines)
+
+    def _write_meta(self) -> None:
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"shape": list(self.shape), "pkl_name": self.pkl_name}, f)
+        os.replace(tmp, self._meta_path)
+
+    def set_pkl_name(self, name: str) -> None:
+        """Record that the crops' gallery rows now live in the PKL called `name`."""
+        with self._lock:
+            if self.shape is not None and name != self.pkl_name:
+                self.pkl_name = name
+                self._write_meta()
+
+    def truncate(self, count: int) -> None:
+        """Forget every crop after the first `count` (e.g. ones whose gallery rows were discarded)."""
+        with self._lock:
+            if count >= self._count:
+                return
+            end, last = 0, None
+            with open(self._index_path, "rb") as f:
+                for _ in range(count):
+                    last = f.readline()
+                    end += len(last)
+            with open(self._index_path, "r+b") as f:
+                f.truncate(end)
+            self._count = count
+            if last is None:
+                self._tail = (0, 0)
+            else:
+                entry = json.loads(last)
+                self._tail = (entry["chunk"], entry["row"] + 1)
+
+    def _write_row(self, chunk: int, row: int, crop: np.ndarray) -> None:
+        path = self._chunk_path(chunk)
+        with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+            f.seek(row * crop.nbytes)
+            f.write(crop.tobytes())
+            f.truncate()
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Index entries ({"chunk", "row", "record"}) in enrollment order."""
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+
+    def read_chunk(self, chunk: int, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Crops of `chunk` as one (n, *shape) uint8 array (only `rows`, when given)."""
+        data = np.fromfile(self._chunk_path(chunk), dtype=np.uint8)
+        crops = data[: data.size - data.size % int(np.prod(self.shape))].reshape((-1,) + self.shape)
+        return crops if rows is None else crops[np.asarray(rows, dtype=np.int64)]
+
+
+def crop_dir(shard: Optional[str] = None) -> str:
+    from .gallery import shard_path
+
+    return os.path.join(os.path.dirname(shard_path(shard)), "crops")
+
+
+_stores: Dict[str, CropStore] = {}
+_stores_lock = threading.Lock()
+
+
+def store(shard: Optional[str] = None) -> CropStore:
+    directory = crop_dir(shard)
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = CropStore(directory, config.CROP_STORE_CHUNK_ROWS)
+        return _stores[directory]
+
+
+def list_shards() -> List[Optional[str]]:
+    """Shards with stored crops: None for the default gallery, then the named ones."""
+    shards: List[Optional[str]] = [None] if os.path.exists(os.path.join(crop_dir(None), "index.jsonl")) else []
+    root = os.path.join(config.ARC_DB_DIR, "shards")
+    for dirpath, _, files in os.walk(root):
+        if os.path.basename(dirpath) == "crops" and "index.jsonl" in files:
+            shards.append(os.path.relpath(os.path.dirname(dirpath), root).replace(os.sep, "/"))
+    return sorted(shards, key=lambda s: s or "")
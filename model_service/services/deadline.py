@@ -0,0 +1,90 @@
+"""Request deadlines and cancellation for inference work.
+
+Callers send ``X-Request-Deadline-Ms``: how many more milliseconds they will
+wait for the answer (a relative budget, so client and server clocks need not
+agree). The deadline rides along in a context variable into the inference
+worker, where ``check(stage)`` runs before each expensive stage (the queue
+hand-off, detect, represent, search). Work whose deadline has passed is
+dropped with ``DeadlineExceeded``. When the client disconnects, the request
+is marked cancelled and is dropped at the next check.
+
+Drops are counted in ``model_service_inference_skipped_total{stage}``
+(deadline passed) and ``model_service_inference_cancelled_total{stage}``
+(client went away).
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from . import metrics
+
+HEADER = "x-request-deadline-ms"
+
+
+class DeadlineExceeded(Exception):
+    """Raised at a checkpoint when the request's deadline passed or its client disconnected."""
+
+    def __init__(self, stage: str, cancelled: bool = False):
+        what = "client disconnected" if cancelled else "deadline exceeded"
+        super().__init__(f"Request dropped before {stage}: {what}")
+        self.stage = stage
+        self.cancelled = cancelled
+
+
+class Deadline:
+    __slots__ = ("expires_at", "cancelled")
+
+    def __init__(self, budget_seconds: Optional[float] = None):
+        self.expires_at = None if budget_seconds is None else time.monotonic() + budget_seconds
+        # set from the event loop, read by the worker thread
+        self.cancelled = False
+
+    def remaining(self) -> Optional[float]:
+        return None if self.expires_at is None else self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def from_headers(headers) -> Deadline:
+    """Deadline from the request's X-Request-Deadline-Ms (no expiry when absent or malformed)."""
+    raw = headers.get(HEADER)
+    try:
+        budget_ms = float(raw) if raw else None
+    except ValueError:
+        budget_ms = None
+    return Deadline(None if budget_ms is None else max(0.0, budget_ms) / 1000.0)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+@contextmanager
+def bound(deadline: Optional[Deadline]):
+    """Make `deadline` the current one for this block (and tasks / contexts copied from it)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+
+def check(stage: str) -> None:
+    """Raise DeadlineExceeded if the current request was cancelled or is past its deadline."""
+    deadline = _current.get()
+    if deadline is None:
+        return
+    if deadline.cancelled:
+        metrics.INFERENCE_CANCELLED.inc(stage=stage)
+        raise DeadlineExceeded(stage, cancelled=True)
+    if deadline.expired():
+        metrics.INFERENCE_SKIPPED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
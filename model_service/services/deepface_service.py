@@ -26,6 +26,13 @@ def ensure_deepface():
     if DeepFace is not None:
         return
 
+    if config.FAKE_BACKEND:
+        from . import fake_backend
+
+        DeepFace, DEEPFACE_MODELS = fake_backend.install()
+        print("[DeepFace] Using the fake backend (MODEL_SERVICE_FAKE_BACKEND=1); no models loaded.")
+        return
+
     try:
         from importlib import import_module
 
@@ -64,8 +71,11 @@ def ensure_deepface():
         try:
             print("[DeepFace] Preloading ArcFace...")
             model = DeepFace.build_model(config.MODEL_NAME)
-            DEEPFACE_MODELS = {"model": model, "detector": config.DETECTOR_BACKEND}
-            print("[DeepFace] Loaded.")
+            from . import recognizer
+
+            rec = recognizer.install(model)
+            DEEPFACE_MODELS = {"model": model, "detector": config.DETECTOR_BACKEND, "recognizer": rec}
+            print(f"[DeepFace] Loaded ({rec.variant} recognizer).")
         except Exception as e:
             print(f"[DeepFace] Preload failed: {e}")
             DEEPFACE_MODELS = None
@@ -77,14 +87,70 @@ def ensure_image_libs():
 
 
 async def write_upload_to_tempfile(upload, suffix: str = ".jpg"):
-    data = await upload.read()
+    from common import upload_limits
+
+    # copied in chunks; 413 past MAX_UPLOAD_SIZE_MB
     tf = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tf.write(data)
-    tf.flush()
+    try:
+        async for chunk in upload_limits.iter_upload(upload, config):
+            tf.write(chunk)
+    except BaseException:
+        tf.close()
+        os.unlink(tf.name)
+        raise
     tf.close()
     return tf.name
 
 
+async def request_image_to_tempfile(request, file=None, image_b64: Optional[str] = None):
+    """Write the request's image to a temp file and return (path, parsed JSON body or {}).
+
+    Accepts, in priority order: a multipart file, a form field ``image_b64``, or a
+    JSON body ``{"image_b64": ...}`` (``data:`` URL prefixes are stripped).
+    """
+    from fastapi import HTTPException
+
+    if file is not None:
+        return await write_upload_to_tempfile(file), {}
+
+    body = {}
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            body = await request.json()
+        except HTTPException:
+            # body over the upload limit
+            raise
+        except Exception:
+            body = {}
+        image_b64 = body.get("image_b64")
+
+    if not image_b64:
+        raise HTTPException(400, "No image provided. Send multipart file, form field 'image_b64', or JSON {'image_b64': ...}.")
+
+    if image_b64.startswith("data:"):
+        image_b64 = image_b64.split(",", 1)[1]
+
+    try:
+        raw = base64.b64decode(image_b64)
+    except Exception as e:
+        raise HTTPException(400, f"Invalid base64 payload: {e}")
+
+    return write_bytes_to_tempfile(raw), body
+
+
+def check_image(path: str) -> None:
+    """Reject a non-image (400) or an oversized image (413) from its header, before it is queued for inference."""
+    from fastapi import HTTPException
+
+    from . import image_prep
+
+    try:
+        image_prep.check(path)
+    except image_prep.ImageRejected as exc:
+        raise HTTPException(413 if exc.too_large else 400, str(exc))
+
+
 def write_bytes_to_tempfile(data: bytes, suffix: str = ".jpg"):
     tf = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     tf.write(data)
@@ -0,0 +1,291 @@
+"""Face detection through a configurable detector cascade.
+
+A cascade is a comma-separated list of ``backend[@max_side]`` stages, cheapest
+first, e.g. ``"yolov8n@640,retinaface"``. Each stage runs on the frame
+downscaled so its longer side is at most ``max_side`` (full resolution when
+omitted). The next stage runs only when the current one finds no face, or
+when at least ``CASCADE_ESCALATE_FRACTION`` of its faces are smaller than
+``CASCADE_MIN_FACE_PX`` (full-resolution pixels) or less confident than
+``CASCADE_MIN_CONFIDENCE``; a few small back-row faces do not escalate a
+frame. The faces of every stage run are merged with NMS, so a later stage
+adds the faces it found to the earlier ones and replaces only the boxes it
+overlaps. Boxes from a downscaled pass are mapped back and the faces are
+re-cropped (and aligned) from the full-resolution frame, so embeddings do not
+lose detail to the cheap pass.
+
+A ``backend@tiles`` stage is for wide frames whose far faces are only a few
+pixels tall once the detector shrinks the frame to its input size: frames
+whose longer side exceeds ``DETECTOR_TILE_SIZE`` are cut into overlapping
+tiles that are detected in parallel on ``DETECTOR_TILE_WORKERS`` threads,
+together with one pass over the whole frame for faces larger than the
+overlap. Overlapping boxes are merged with NMS before cropping.
+
+/recognise and /verify use ``DETECTOR_CASCADE``; enrollment uses
+``ENROLL_DETECTOR_CASCADE``. Every stage run is counted in
+``model_service_detector_cascade_runs_total{cascade,stage,result}`` with
+result ``hit`` (accepted), ``below_floor`` or ``miss``, which gives the
+per-stage hit rate.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from .. import config
+from . import metrics
+
+
+class Stage(NamedTuple):
+    backend: str
+    max_side: int = 0  # 0: full resolution
+    tiled: bool = False
+
+    @property
+    def name(self) -> str:
+        if self.tiled:
+            return f"{self.backend}@tiles"
+        return f"{self.backend}@{self.max_side}" if self.max_side else self.backend
+
+
+def parse_cascade(spec: str) -> Tuple[Stage, ...]:
+    """``"yolov8n@640,yolov8m@tiles"`` -> (Stage("yolov8n", 640), Stage("yolov8m", 0, tiled=True))."""
+    stages = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        backend, _, side = item.partition("@")
+        if side.strip() == "tiles":
+            stages.append(Stage(backend.strip(), 0, True))
+            continue
+        try:
+            max_side = int(side) if side else 0
+        except ValueError:
+            raise ValueError(f"Invalid detector cascade stage {item!r}: expected backend[@max_side|@tiles]")
+        stages.append(Stage(backend.strip(), max(0, max_side)))
+    if not stages:
+        raise ValueError(f"Detector cascade {spec!r} has no stages")
+    return tuple(stages)
+
+
+CASCADES = {
+    "recognise": parse_cascade(config.DETECTOR_CASCADE),
+    "enroll": parse_cascade(config.ENROLL_DETECTOR_CASCADE),
+}
+
+
+def _scale_for(img: np.ndarray, max_side: int) -> float:
+    if not max_side or img.ndim != 3:
+        return 1.0
+    longest = max(img.shape[0], img.shape[1])
+    return max_side / longest if longest > max_side else 1.0
+
+
+def _resize(img: np.ndarray, scale: float) -> np.ndarray:
+    import cv2
+
+    h, w = img.shape[:2]
+    return cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _scale_point(p, factor: float):
+    return None if p is None else (int(round(p[0] * factor)), int(round(p[1] * factor)))
+
+
+def _scale_area(area: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    out = dict(area)
+    for k in ("x", "y", "w", "h"):
+        out[k] = int(round(area[k] * factor))
+    for k in ("left_eye", "right_eye", "nose", "mouth_left", "mouth_right"):
+        if k in area:
+            out[k] = _scale_point(area[k], factor)
+    return out
+
+
+def _crop_faces(detection, img: np.ndarray, objs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Re-crop (and align) full-resolution faces for boxes found on a smaller copy or on tiles.
+
+    Mirrors the post-processing of DeepFace's ``extract_faces``: RGB, scaled to
+    [0, 1], box clamped to the frame.
+    """
+    from deepface.models.Detector import FacialAreaRegion
+
+    height, width = img.shape[:2]
+    out = []
+    for obj in objs:
+        area = obj["facial_area"]
+        region = FacialAreaRegion(
+            x=area["x"], y=area["y"], w=area["w"], h=area["h"],
+            left_eye=area.get("left_eye"), right_eye=area.get("right_eye"), confidence=obj.get("confidence"),
+        )
+        # extract_sub_image pads out-of-frame pixels itself, so no border is needed
+        face = detection.extract_face(
+            facial_area=region, img=img, align=config.ALIGN, expand_percentage=0, width_border=0, height_border=0
+        )
+        if face.img.shape[0] == 0 or face.img.shape[1] == 0:
+            continue
+        x, y = max(0, area["x"]), max(0, area["y"])
+        out.append(
+            {
+                "face": face.img[:, :, ::-1] / 255,
+                "facial_area": dict(area, x=x, y=y, w=min(width - x - 1, area["w"]), h=min(height - y - 1, area["h"])),
+                "confidence": obj.get("confidence", 0),
+            }
+        )
+    return out
+
+
+def tile_grid(height: int, width: int, size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) windows of at most `size` px covering the frame, adjacent ones sharing `overlap` px."""
+    step = max(1, size - overlap)
+
+    def starts(extent: int) -> List[int]:
+        if extent <= size:
+            return [0]
+        out = list(range(0, extent - size, step))
+        return out + [extent - size]
+
+    return [(x, y, min(x + size, width), min(y + size, height)) for y in starts(height) for x in starts(width)]
+
+
+def _box_overlaps(box: np.ndarray, others: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """IoU and intersection-over-smaller-box of `box` against each row of `others` (x, y, w, h)."""
+    x1 = np.maximum(box[0], others[:, 0])
+    y1 = np.maximum(box[1], others[:, 1])
+    x2 = np.minimum(box[0] + box[2], others[:, 0] + others[:, 2])
+    y2 = np.minimum(box[1] + box[3], others[:, 1] + others[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area, areas = box[2] * box[3], others[:, 2] * others[:, 3]
+    return inter / np.maximum(area + areas - inter, 1e-9), inter / np.maximum(np.minimum(area, areas), 1e-9)
+
+
+def nms(objs: List[Dict[str, Any]], iou_threshold: float, containment: float = 0.7) -> List[Dict[str, Any]]:
+    """Greedy NMS by confidence.
+
+    Besides the usual IoU test, a box mostly inside a more confident one is
+    dropped: a face cut by a tile edge yields a partial box whose IoU with
+    the full detection from the neighbouring tile can be low.
+    """
+    if len(objs) < 2:
+        return list(objs)
+    boxes = np.array([[o["facial_area"][k] for k in ("x", "y", "w", "h")] for o in objs], dtype=np.float64)
+    order = np.argsort([-(o.get("confidence") or 0) for o in objs], kind="stable")
+    keep: List[int] = []
+    for i in order:
+        if keep:
+            iou, inside = _box_overlaps(boxes[i], boxes[keep])
+            if (iou > iou_threshold).any() or (inside > containment).any():
+                continue
+        keep.append(int(i))
+    return [objs[i] for i in keep]
+
+
+_tile_pool = None
+_tile_pool_lock = threading.Lock()
+_thread_detectors = threading.local()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _tile_pool
+    with _tile_pool_lock:
+        if _tile_pool is None:
+            _tile_pool = ThreadPoolExecutor(max_workers=config.DETECTOR_TILE_WORKERS, thread_name_prefix="detect-tile")
+        return _tile_pool
+
+
+def _thread_detector(modeling, backend: str):
+    """This worker thread's own instance of `backend`.
+
+    DeepFace caches one detector per backend, and detectors such as YOLO keep
+    per-call state, so concurrent tiles must not share it.
+    """
+    detectors = getattr(_thread_detectors, "by_backend", None)
+    if detectors is None:
+        detectors = _thread_detectors.by_backend = {}
+    detector = detectors.get(backend)
+    if detector is None:
+        detector = detectors[backend] = type(modeling.build_model(task="face_detector", model_name=backend))()
+    return detector
+
+
+def _detect_window(modeling, img: np.ndarray, backend: str, window: Tuple[int, int, int, int]) -> List[Dict[str, Any]]:
+    x0, y0, x1, y1 = window
+    detector = _thread_detector(modeling, backend)
+    regions = detector.detect_faces(np.ascontiguousarray(img[y0:y1, x0:x1]))
+    objs = []
+    for r in regions:
+        area = {"x": int(r.x) + x0, "y": int(r.y) + y0, "w": int(r.w), "h": int(r.h)}
+        for k in ("left_eye", "right_eye"):
+            p = getattr(r, k, None)
+            area[k] = None if p is None else (int(p[0]) + x0, int(p[1]) + y0)
+        objs.append({"facial_area": area, "confidence": round(float(r.confidence or 0), 2)})
+    return objs
+
+
+def run_tiled(detection, modeling, img: np.ndarray, backend: str) -> List[Dict[str, Any]]:
+    """Detect on overlapping tiles plus the whole frame in parallel, merge with NMS, crop at full resolution."""
+    height, width = img.shape[:2]
+    windows = [(0, 0, width, height)]
+    if max(height, width) > config.DETECTOR_TILE_SIZE:
+        windows += tile_grid(height, width, config.DETECTOR_TILE_SIZE, config.DETECTOR_TILE_OVERLAP)
+    found = _pool().map(lambda w: _detect_window(modeling, img, backend, w), windows)
+    objs = [o for objs in found for o in objs if o["facial_area"]["w"] > 0 and o["facial_area"]["h"] > 0]
+    return _crop_faces(detection, img, nms(objs, config.DETECTOR_TILE_NMS_IOU))
+
+
+def run_stage(detection, img: np.ndarray, stage: Stage, modeling=None) -> List[Dict[str, Any]]:
+    """Faces found by one cascade stage, in full-resolution coordinates."""
+    if stage.tiled and modeling is not None and img.ndim == 3:
+        return run_tiled(detection, modeling, img, stage.backend)
+    scale = _scale_for(img, stage.max_side)
+    probe = img if scale == 1.0 else _resize(img, scale)
+    try:
+        objs = detection.extract_faces(
+            img_path=probe,
+            detector_backend=stage.backend,
+            enforce_detection=True,
+            # a downscaled pass only locates faces; they are aligned when re-cropped below
+            align=config.ALIGN if scale == 1.0 else False,
+            expand_percentage=0,
+            anti_spoofing=False,
+        )
+    except ValueError:
+        # DeepFace signals "no face" by raising when enforce_detection is set
+        return []
+    if scale == 1.0:
+        return objs
+    factor = 1.0 / scale
+    return _crop_faces(detection, img, [dict(o, facial_area=_scale_area(o["facial_area"], factor)) for o in objs])
+
+
+def _below_floor(obj: Dict[str, Any]) -> bool:
+    area = obj["facial_area"]
+    conf = obj.get("confidence")
+    return min(area["w"], area["h"]) < config.CASCADE_MIN_FACE_PX or (conf is not None and conf < config.CASCADE_MIN_CONFIDENCE)
+
+
+def _verdict(objs: List[Dict[str, Any]]) -> str:
+    if not objs:
+        return "miss"
+    weak = sum(_below_floor(obj) for obj in objs)
+    return "below_floor" if weak >= config.CASCADE_ESCALATE_FRACTION * len(objs) else "hit"
+
+
+def detect(detection, img: np.ndarray, cascade: str = "recognise", modeling=None) -> List[Dict[str, Any]]:
+    """Run `cascade` (a key of CASCADES) over a decoded BGR frame; [] when every stage misses.
+
+    `modeling` (DeepFace's model factory) is needed by tiled stages; without
+    it they fall back to one full-frame pass.
+    """
+    stages = CASCADES[cascade]
+    found: List[Dict[str, Any]] = []
+    for stage in stages:
+        objs = run_stage(detection, img, stage, modeling)
+        result = _verdict(objs)
+        metrics.DETECTOR_CASCADE_RUNS.inc(cascade=cascade, stage=stage.name, result=result)
+        # the later (heavier) stage's box wins a tie for the same face
+        found = nms(objs + found, config.CASCADE_MERGE_IOU)
+        if result == "hit":
+            break
+    return found
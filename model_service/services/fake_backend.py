@@ -0,0 +1,158 @@
+"""Deterministic stand-in for DeepFace, for load tests and pipeline benchmarks.
+
+Enabled with ``MODEL_SERVICE_FAKE_BACKEND=1``. No model weights are loaded:
+every image is "detected" as ``FAKE_FACES_PER_FRAME`` faces whose embeddings
+are derived from a hash of the image bytes, so enrolling a file and then
+sending the same file to /recognise always matches. Each stage burns the
+time configured in ``FAKE_STAGE_COSTS_MS`` either sleeping (an accelerator
+or native code that releases the GIL) or spinning (pure-Python CPU work), so
+queueing and batching changes can be measured without a GPU.
+
+The objects below mirror the slices of DeepFace the service calls:
+``image_utils.load_image``, ``detection.extract_faces``,
+``modeling.build_model(task="spoofing")`` and ``DeepFace.verify``.
+"""
+import hashlib
+import threading
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from .. import config
+
+EMBEDDING_DIM = 512
+_FACE_BOX = 96
+
+
+def burn(stage: str, units: int = 1) -> None:
+    """Spend the configured cost of `stage` (ms, plus `<stage>_per_face` ms per unit)."""
+    costs = config.FAKE_STAGE_COSTS_MS
+    ms = costs.get(stage, 0.0) + costs.get(f"{stage}_per_face", 0.0) * units
+    if ms <= 0:
+        return
+    if config.FAKE_COST_MODE == "cpu":
+        end = time.perf_counter() + ms / 1000.0
+        while time.perf_counter() < end:
+            pass
+    else:
+        time.sleep(ms / 1000.0)
+
+
+def _digest(img: np.ndarray) -> bytes:
+    return hashlib.sha1(img.tobytes()).digest()
+
+
+def embedding_for(seed: bytes) -> np.ndarray:
+    """Unit-norm 512-d vector fully determined by `seed`."""
+    rng = np.random.default_rng(int.from_bytes(hashlib.sha1(seed).digest()[:8], "little"))
+    v = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class _ImageUtils:
+    @staticmethod
+    def load_image(img):
+        """Raw file bytes as a uint8 array; decoding is simulated by the `decode` cost."""
+        if isinstance(img, np.ndarray):
+            return img, "numpy array"
+        with open(img, "rb") as f:
+            data = f.read()
+        burn("decode")
+        return np.frombuffer(data, dtype=np.uint8), img
+
+
+class _Detection:
+    @staticmethod
+    def extract_faces(img_path, **kwargs) -> List[Dict[str, Any]]:
+        img, _ = image_utils.load_image(img_path)
+        burn("detect")
+        digest = _digest(img)
+        faces = []
+        for i in range(config.FAKE_FACES_PER_FRAME):
+            # the "crop" is just the seed the fake recognizer embeds
+            seed = np.frombuffer(digest + i.to_bytes(4, "little"), dtype=np.uint8).copy()
+            faces.append(
+                {
+                    "face": seed,
+                    "facial_area": {"x": i * _FACE_BOX, "y": 0, "w": _FACE_BOX, "h": _FACE_BOX, "left_eye": None, "right_eye": None},
+                    "confidence": 0.99,
+                }
+            )
+        return faces
+
+
+class _Fasnet:
+    def analyze(self, img, facial_area):
+        burn("antispoof")
+        return True, 0.99
+
+
+class _Modeling:
+    _fasnet = _Fasnet()
+
+    def build_model(self, task: str, model_name: str):
+        if task == "spoofing":
+            return self._fasnet
+        raise ValueError(f"fake backend has no {task} model")
+
+
+image_utils = _ImageUtils()
+detection = _Detection()
+modeling = _Modeling()
+
+
+class FakeRecognizer:
+    """Recognizer-compatible object embedding the seeds produced by the fake detector."""
+
+    variant = "fake"
+    input_shape = (112, 112)
+    output_shape = EMBEDDING_DIM
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def preprocess(self, faces) -> np.ndarray:
+        return np.stack([np.asarray(f, dtype=np.uint8) for f in faces])
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        # one "device", like the TFLite interpreter
+        with self._lock:
+            burn("represent", units=batch.shape[0])
+        return np.stack([embedding_for(row.tobytes()) for row in batch])
+
+
+class DeepFace:
+    """The module-level DeepFace API surface used by /detect."""
+
+    @staticmethod
+    def verify(img1_path, img2_path, model_name=None, detector_backend=None, distance_metric="cosine", **kwargs):
+        start = time.time()
+        rec = FakeRecognizer()
+        faces = [detection.extract_faces(img_path=p)[0] for p in (img1_path, img2_path)]
+        a, b = rec.embed(rec.preprocess([f["face"] for f in faces]))
+        distance = float(round(1.0 - float(a @ b), 6))
+        threshold = float(config.THRESHOLD or 0.68)
+        return {
+            "verified": distance <= threshold,
+            "distance": distance,
+            "threshold": threshold,
+            "model": model_name or config.MODEL_NAME,
+            "detector_backend": "fake",
+            "similarity_metric": distance_metric,
+            "facial_areas": {"img1": faces[0]["facial_area"], "img2": faces[1]["facial_area"]},
+            "time": round(time.time() - start, 2),
+        }
+
+    @staticmethod
+    def build_model(model_name, task="facial_recognition"):
+        return FakeRecognizer()
+
+
+def install():
+    """Make the fake recognizer the active one; returns the DeepFace stand-in and models dict."""
+    from . import recognizer
+
+    rec = FakeRecognizer()
+    recognizer.set_active(rec)
+    return DeepFace, {"model": None, "detector": "fake", "recognizer": rec}
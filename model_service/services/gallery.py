@@ -0,0 +1,435 @@
+"""Resident ArcFace gallery and vectorised search.
+
+The PKL written by ``arcface_refresh`` is loaded once into a row-normalised
+float32 matrix and kept in memory; it is reloaded when the file changes on
+disk or when a writer calls ``invalidate()``. Search computes all distances
+with one matrix product and picks the best row per probe, so no per-row
+Python work happens on the request path.
+
+The gallery can be split into named shards such as ``CSE/sem5`` or
+``conference/IC2025``, each stored in its own PKL under
+``ARC_DB_DIR/shards/<name>/`` with its own resident index. A shard is loaded
+on first use and dropped again after ``GALLERY_SHARD_IDLE_SECONDS`` without a
+search; the unnamed default shard (``ARC_PKL_PATH``) always stays resident.
+"""
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .. import config
+
+
+# Logistic distance->confidence parameters, copied from
+# deepface.modules.verification.find_confidence so confidences can be computed
+# for whole arrays at once. Other models fall back to DeepFace per item.
+_CONFIDENCE_PARAMS = {
+    ("ArcFace", "cosine"): (-6.586150423868342, 2.2617127737265186, 1.22267, 82.32544721731948, 28.687745855666044, 17.210359124614925, 1.306796127659645),
+    ("ArcFace", "euclidean"): (-5.370594347027345, 0.6896763568574544, 10.401334, 43.042326442916284, 19.048164749978937, 18.682892152590245, 0.9185346995033978),
+    ("ArcFace", "euclidean_l2"): (-6.541948874098929, 3.2628963901283585, 1.563758, 74.93505228104696, 21.800168694491585, 15.091078907730523, 3.6296845343803894),
+    ("ArcFace", "angular"): (-5.63344888288512, 0.5682159222314143, 0.571477, 40.81365081792457, 18.409621072962818, 15.13985487535995, 6.59169002231532),
+}
+
+
+def find_confidences(distances: np.ndarray, verified: np.ndarray, model_name: str = None, distance_metric: str = None) -> np.ndarray:
+    """Vectorised equivalent of DeepFace's find_confidence (0-49 rejected, 51-100 verified)."""
+    model_name = model_name or config.MODEL_NAME
+    distance_metric = distance_metric or config.DISTANCE_METRIC
+    distances = np.asarray(distances, dtype=np.float64)
+    verified = np.asarray(verified, dtype=bool)
+
+    params = _CONFIDENCE_PARAMS.get((model_name, distance_metric))
+    if params is None:
+        from deepface.modules import verification
+
+        return np.array(
+            [
+                verification.find_confidence(distance=float(d), model_name=model_name, distance_metric=distance_metric, verified=bool(v))
+                for d, v in zip(distances, verified)
+            ],
+            dtype=np.float64,
+        )
+
+    w, b, normalizer, max_true, min_true, max_false, min_false = params
+    d = distances / normalizer if normalizer > 1 else distances
+    with np.errstate(over="ignore"):
+        confidence = 100.0 / (1.0 + np.exp(-(w * d + b)))
+
+    min_original = np.where(verified, min_true, min_false)
+    max_original = np.where(verified, max_true, max_false)
+    min_target = np.where(verified, max(51.0, min_true), 0.0)
+    max_target = np.where(verified, 100.0, min(49.0, max_false))
+    out = (confidence - min_original) / (max_original - min_original) * (max_target - min_target) + min_target
+    out = np.where(verified, np.maximum(out, 51.0), np.minimum(out, 49.0))
+    return np.round(np.clip(out, 0.0, 100.0), 2)
+
+
+def search_threshold() -> float:
+    """Distance threshold used for matches: config.THRESHOLD or DeepFace's pre-tuned value."""
+    if config.THRESHOLD:
+        return float(config.THRESHOLD)
+    from deepface.modules import verification
+
+    return float(verification.find_threshold(config.MODEL_NAME, config.DISTANCE_METRIC))
+
+
+def _l2_normalize(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    norms = np.linalg.norm(x, axis=1)
+    safe = np.where(norms == 0, 1.0, norms)
+    return (x / safe[:, None]).astype(np.float32), norms.astype(np.float32)
+
+
+def distances_from_similarity(sims: np.ndarray, probe_norms: np.ndarray, row_norms: np.ndarray, metric: str) -> np.ndarray:
+    """Turn cosine similarities (M, N) into DeepFace distances for `metric`."""
+    if metric == "cosine":
+        d = 1.0 - sims
+    elif metric == "euclidean_l2":
+        d = np.sqrt(np.maximum(2.0 - 2.0 * sims, 0.0))
+    elif metric == "euclidean":
+        sq = probe_norms[:, None] ** 2 + row_norms[None, :] ** 2 - 2.0 * probe_norms[:, None] * row_norms[None, :] * sims
+        d = np.sqrt(np.maximum(sq, 0.0))
+    elif metric == "angular":
+        d = np.arccos(np.clip(sims, -1.0, 1.0)) / math.pi
+    else:
+        raise ValueError(f"Invalid distance_metric passed - {metric}")
+    # DeepFace rounds distances to 6 decimals
+    return np.round(d, 6)
+
+
+class GalleryIndex:
+    """Immutable snapshot of a gallery: identities plus their row-normalised embeddings.
+
+    Reloads build a new index and swap it in with one assignment, so a search
+    never sees identities and rows from different versions.
+    """
+
+    def __init__(self, identities, matrix: np.ndarray, norms: np.ndarray, hashes=None):
+        self.identities = np.asarray(identities, dtype=object)
+        self.matrix = matrix
+        self.norms = norms
+        # each row's record "hash" (the enrolled image's content hash)
+        self.hashes = np.asarray(hashes if hashes is not None else [None] * len(self.identities), dtype=object)
+        rows_by_identity = {}
+        rows_by_content = {}
+        for row, (identity, content) in enumerate(zip(self.identities.tolist(), self.hashes.tolist())):
+            rows_by_identity.setdefault(identity, []).append(row)
+            if content is not None:
+                rows_by_content.setdefault((identity, content), []).append(row)
+        self._rows_by_identity = {k: np.asarray(v, dtype=np.int64) for k, v in rows_by_identity.items()}
+        self._rows_by_content = rows_by_content
+        # rows grouped by identity, for reducing per-row distances to per-identity ones
+        self._distinct = np.asarray(list(rows_by_identity), dtype=object)
+        groups = list(self._rows_by_identity.values())
+        self._grouped_rows = np.concatenate(groups) if groups else np.empty(0, dtype=np.int64)
+        self._group_starts = np.cumsum([0] + [len(g) for g in groups[:-1]]).astype(np.int64)
+
+    @classmethod
+    def from_records(cls, records) -> "GalleryIndex":
+        identities, vectors, hashes = [], [], []
+        for rec in records:
+            emb = rec.get("embedding")
+            if emb is None or len(emb) == 0:
+                # images without a detected face carry no embedding; they can never match
+                continue
+            identities.append(rec.get("identity"))
+            vectors.append(np.asarray(emb, dtype=np.float32))
+            hashes.append(rec.get("hash"))
+        if not vectors:
+            return cls([], np.empty((0, 0), dtype=np.float32), np.empty(0, dtype=np.float32))
+        matrix, norms = _l2_normalize(np.stack(vectors))
+        return cls(identities, matrix, norms, hashes)
+
+    @property
+    def size(self) -> int:
+        return int(self.identities.shape[0])
+
+    def extended(self, records) -> "GalleryIndex":
+        """A new index holding this one's rows followed by `records`."""
+        added = GalleryIndex.from_records(records)
+        if added.size == 0:
+            return self
+        if self.size == 0:
+            return added
+        return GalleryIndex(
+            np.concatenate([self.identities, added.identities]),
+            np.concatenate([self.matrix, added.matrix]),
+            np.concatenate([self.norms, added.norms]),
+            np.concatenate([self.hashes, added.hashes]),
+        )
+
+    def rows_for(self, identity: str) -> np.ndarray:
+        """Row indices holding `identity`'s embeddings (empty if not enrolled)."""
+        return self._rows_by_identity.get(identity, np.empty(0, dtype=np.int64))
+
+    def rows_for_image(self, identity: str, content_hash: str) -> List[int]:
+        """Rows embedded from the image with `content_hash` enrolled for `identity` (empty if none)."""
+        return self._rows_by_content.get((identity, content_hash), [])
+
+    def distances(self, embeddings: np.ndarray, rows: np.ndarray = None, metric: str = None) -> np.ndarray:
+        """Distances (M, N) from every probe to every gallery row, or only to `rows`."""
+        metric = metric or config.DISTANCE_METRIC
+        probes = np.asarray(embeddings, dtype=np.float32)
+        if probes.ndim == 1:
+            probes = probes[None, :]
+        matrix, norms = self.matrix, self.norms
+        if rows is not None:
+            matrix, norms = matrix[rows], norms[rows]
+        if probes.shape[0] == 0 or matrix.shape[0] == 0:
+            return np.full((probes.shape[0], matrix.shape[0]), np.inf)
+        if probes.shape[1] != matrix.shape[1]:
+            raise ValueError(
+                "Source and target embeddings must have same dimensions but "
+                f"{probes.shape[1]}:{matrix.shape[1]}. Model structure may change"
+                " after pickle created. Delete the gallery PKL and re-run."
+            )
+        probe_unit, probe_norms = _l2_normalize(probes)
+        return distances_from_similarity(probe_unit @ matrix.T, probe_norms, norms, metric)
+
+    def search(self, embeddings: np.ndarray, metric: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (best row index, best distance) for every probe embedding.
+
+        Rows are indices into ``identities``; callers compare the distance to
+        the threshold themselves.
+        """
+        distances = self.distances(embeddings, metric=metric)
+        if distances.shape[1] == 0:
+            return np.full(distances.shape[0], -1), np.full(distances.shape[0], np.inf)
+        best = np.argmin(distances, axis=1)
+        return best, distances[np.arange(distances.shape[0]), best]
+
+    def top_k(self, embeddings: np.ndarray, k: int, metric: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, distances) of the min(k, size) nearest rows per probe, nearest first; both (M, k')."""
+        return _nearest(self.distances(embeddings, metric=metric), k)
+
+    def top_k_identities(self, embeddings: np.ndarray, k: int, metric: str = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(identities, distances) of the k nearest distinct identities per probe, nearest first.
+
+        An identity's distance is that of its nearest row, so a student
+        enrolled from several photos takes one slot.
+        """
+        distances = self.distances(embeddings, metric=metric)
+        if distances.shape[1] == 0:
+            return np.empty((distances.shape[0], 0), dtype=object), np.empty((distances.shape[0], 0))
+        per_identity = np.minimum.reduceat(distances[:, self._grouped_rows], self._group_starts, axis=1)
+        cols, dist = _nearest(per_identity, k)
+        return self._distinct[cols], dist
+
+
+def _nearest(distances: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(columns, distances) of the min(k, N) smallest of each row of `distances` (M, N), smallest first."""
+    k = min(k, distances.shape[1])
+    if k == 0:
+        return np.empty((distances.shape[0], 0), dtype=np.int64), np.empty((distances.shape[0], 0))
+    cols = np.argpartition(distances, k - 1, axis=1)[:, :k] if k < distances.shape[1] else np.tile(np.arange(k), (distances.shape[0], 1))
+    part = np.take_along_axis(distances, cols, axis=1)
+    order = np.argsort(part, axis=1, kind="stable")
+    return np.take_along_axis(cols, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+def top_k_many(indexes: Sequence[GalleryIndex], embeddings: np.ndarray, k: int = 1, metric: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    """The `k` nearest identities per probe across several indexes (e.g. shards), nearest first.
+
+    Returns (identities, distances), both (M, k); slots beyond the number
+    of distinct identities hold None / inf. Each identity appears at most
+    once, at the distance of its nearest row in any index.
+    """
+    probes = np.asarray(embeddings, dtype=np.float32)
+    if probes.ndim == 1:
+        probes = probes[None, :]
+    identities, distances = [], []
+    for index in indexes:
+        ids, dist = index.top_k_identities(probes, k, metric=metric)
+        identities.append(ids)
+        distances.append(dist)
+    return merge_top_k(identities, distances, k, probes.shape[0])
+
+
+def merge_top_k(identities: Sequence[np.ndarray], distances: Sequence[np.ndarray], k: int, probes: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Merge per-source (M, k_i) candidate lists into the overall (M, k) nearest identities, nearest first.
+
+    An identity listed by several sources (shards, peers) keeps its nearest
+    distance; empty slots are None / inf. `probes` gives M when there are no sources.
+    """
+    m = identities[0].shape[0] if identities else (probes or 0)
+    ids = np.concatenate(identities, axis=1) if identities else np.empty((m, 0), dtype=object)
+    dist = np.concatenate(distances, axis=1) if distances else np.empty((m, 0))
+    out_ids = np.full((m, k), None, dtype=object)
+    out_dist = np.full((m, k), np.inf)
+    for i, order in enumerate(np.argsort(dist, axis=1, kind="stable")):
+        seen = set()
+        for col in order:
+            identity = ids[i, col]
+            if identity is None or identity in seen:
+                continue
+            seen.add(identity)
+            out_ids[i, len(seen) - 1] = identity
+            out_dist[i, len(seen) - 1] = dist[i, col]
+            if len(seen) == k:
+                break
+    return out_ids, out_dist
+
+
+def file_stamp(path: str):
+    """(mtime_ns, size) of `path`, or None when it does not exist; changes whenever the file is rewritten."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class Gallery:
+    """In-memory view of one gallery PKL file."""
+
+    def __init__(self, path: str, shard: Optional[str] = None):
+        self.path = path
+        self.shard = shard
+        self._lock = threading.Lock()
+        self._stamp = None
+        self.last_used = time.monotonic()
+        self.index = GalleryIndex.from_records([])
+
+    @property
+    def size(self) -> int:
+        return self.index.size
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stamp = None
+
+    def extend(self, records, before, after) -> None:
+        """Add rows just appended to the PKL without reloading it.
+
+        `before` / `after` are the file's stamps around the write; when the
+        index was not current as of `before` it is left for refresh() to reload.
+        """
+        with self._lock:
+            if self._stamp == before:
+                self.index = self.index.extended(records)
+                self._stamp = after
+
+    def refresh(self) -> GalleryIndex:
+        """Reload the PKL if it changed since the last load and return the current index."""
+        stamp = file_stamp(self.path)
+        self.last_used = time.monotonic()
+        with self._lock:
+            if stamp is not None and stamp == self._stamp:
+                return self.index
+            records = []
+            if stamp is not None:
+                with open(self.path, "rb") as f:
+                    records = pickle.load(f)
+            self.index = GalleryIndex.from_records(records)
+            self._stamp = stamp
+            return self.index
+
+
+# "CSE/sem5", "conference/IC2025": path-like names of letters, digits, "_", "-" and "."
+_SHARD_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*(/[A-Za-z0-9_-][A-Za-z0-9_.-]*)*$")
+
+
+def shard_path(shard: Optional[str] = None) -> str:
+    """PKL file of `shard`; ARC_PKL_PATH for the default (None or "") shard."""
+    if not shard:
+        return config.ARC_PKL_PATH
+    if len(shard) > 128 or not _SHARD_NAME.match(shard):
+        raise ValueError(f"Invalid gallery shard {shard!r}: use names like 'CSE/sem5' or 'conference/IC2025'")
+    return os.path.join(config.ARC_DB_DIR, "shards", *shard.split("/"), config.ARC_PKL_NAME)
+
+
+def parse_shards(spec: Union[None, str, Iterable[str]]) -> List[Optional[str]]:
+    """Shards to search for a request's selector ("CSE/sem5,CSE/sem7" or a list).
+
+    No selector means the default shard only. With a selector, the default
+    shard is searched as well while GALLERY_SEARCH_DEFAULT_SHARD is set, so
+    identities enrolled before sharding keep matching.
+    """
+    if isinstance(spec, str):
+        spec = spec.split(",")
+    names = [s.strip() for s in (spec or []) if s and s.strip()]
+    if not names:
+        return [None]
+    shards: List[Optional[str]] = []
+    for name in names:
+        shard_path(name)  # validates
+        if name not in shards:
+            shards.append(name)
+    if config.GALLERY_SEARCH_DEFAULT_SHARD:
+        shards.append(None)
+    return shards
+
+
+_galleries: Dict[str, Gallery] = {}
+_gallery_lock = threading.Lock()
+
+
+def _evict_idle(now: float) -> None:
+    for name, gallery in list(_galleries.items()):
+        if name and now - gallery.last_used > config.GALLERY_SHARD_IDLE_SECONDS:
+            # searches already holding the Gallery finish on it; the next one reloads
+            del _galleries[name]
+
+
+def get_gallery(shard: Optional[str] = None) -> Gallery:
+    """Resident gallery of `shard` (default: ARC_PKL_PATH), loading it on first use."""
+    shard = shard or ""
+    with _gallery_lock:
+        _evict_idle(time.monotonic())
+        gallery = _galleries.get(shard)
+        if gallery is None:
+            gallery = _galleries[shard] = Gallery(shard_path(shard), shard or None)
+        return gallery
+
+
+def resident_indexes(shards: Optional[Sequence[Optional[str]]] = None) -> Tuple[List[Gallery], List[GalleryIndex]]:
+    """Galleries of `shards` (default shard when None) and their current non-empty indexes."""
+    galleries = [get_gallery(shard) for shard in (shards or [None])]
+    return galleries, [index for index in (g.refresh() for g in galleries) if index.size]
+
+
+def identity_distance(indexes: Sequence[GalleryIndex], embedding: np.ndarray, identity: str) -> Tuple[Optional[float], int]:
+    """(smallest distance from `embedding` to `identity`'s rows, number of rows) across indexes; (None, 0) if not enrolled."""
+    best, count = None, 0
+    for index in indexes:
+        rows = index.rows_for(identity)
+        if rows.size == 0:
+            continue
+        distance = float(index.distances(embedding, rows)[0].min())
+        best = distance if best is None else min(best, distance)
+        count += int(rows.size)
+    return best, count
+
+
+def list_shards() -> List[Optional[str]]:
+    """Shards with a PKL on disk: None for the default gallery, then the named ones."""
+    shards: List[Optional[str]] = [None] if os.path.exists(config.ARC_PKL_PATH) else []
+    root = os.path.join(config.ARC_DB_DIR, "shards")
+    for dirpath, _, files in os.walk(root):
+        if config.ARC_PKL_NAME in files:
+            shards.append(os.path.relpath(dirpath, root).replace(os.sep, "/"))
+    return sorted(shards, key=lambda s: s or "")
+
+
+def extend(shard: Optional[str], records, before, after) -> None:
+    """Apply rows appended to `shard`'s PKL to its resident index, if it is loaded."""
+    gallery = _galleries.get(shard or "")
+    if gallery is not None:
+        gallery.extend(records, before, after)
+
+
+def invalidate(shard: Optional[str] = None) -> None:
+    """Make `shard`'s resident index reload on its next search (no-op when it is not loaded)."""
+    gallery = _galleries.get(shard or "")
+    if gallery is not None:
+        gallery.invalidate()
+
+
+def resident_shards() -> Dict[str, int]:
+    """{shard name ("" for the default): embeddings} for the shards currently in memory."""
+    with _gallery_lock:
+        return {name: gallery.size for name, gallery in _galleries.items()}
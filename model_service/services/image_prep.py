@@ -0,0 +1,94 @@
+"""Decoding of uploaded images before detection.
+
+Every uploaded image (/refresh-db, /detect, /recognise, /verify) is decoded
+here, once:
+
+- ``check()`` reads only the image header and rejects files that are not an
+  image or have more than ``IMAGE_MAX_PIXELS`` pixels, before the request
+  takes a place in the inference queue.
+- ``decode()`` applies the EXIF orientation, so photos taken with a rotated
+  phone are upright for the detector, and shrinks the image so its longer
+  side is at most the route's ``PREP_MAX_SIDE_*``. JPEGs are shrunk while
+  decoding (DCT scaling by 1/2, 1/4 or 1/8 via Pillow's draft mode), so a
+  12 MP photo is never fully decoded; the rest is resized after decoding.
+
+Face boxes found on a shrunk image are mapped back to the uploaded image's
+coordinates with ``to_original()``.
+"""
+import io
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+
+from .. import config
+
+
+class ImageRejected(ValueError):
+    """The upload is not a decodable image, or is larger than the service accepts."""
+
+    def __init__(self, message: str, too_large: bool = False):
+        super().__init__(message)
+        self.too_large = too_large
+
+
+def check(source: Union[str, bytes]) -> Tuple[int, int]:
+    """(width, height) from the header of the image at `source` (a path, or the file's bytes).
+
+    Raises ImageRejected for non-images and oversized images. Skipped with
+    the fake backend, which "decodes" any bytes.
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    if config.FAKE_BACKEND:
+        return 0, 0
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as im:
+            width, height = im.size
+    except Image.DecompressionBombError as exc:
+        raise ImageRejected(str(exc), too_large=True)
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ImageRejected(f"Not a supported image: {exc}")
+    if width * height > config.IMAGE_MAX_PIXELS:
+        raise ImageRejected(
+            f"Image is {width}x{height} ({width * height / 1e6:.1f} MP); at most {config.IMAGE_MAX_PIXELS / 1e6:.0f} MP is accepted",
+            too_large=True,
+        )
+    return width, height
+
+
+def decode(path: str, max_side: int = 0) -> Tuple[np.ndarray, float]:
+    """(BGR uint8 image, scale): upright, with its longer side at most `max_side` (0: full resolution).
+
+    `scale` is the decoded size over the upright upload's size (1.0 when not shrunk).
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as im:
+            width, height = im.size
+            if width * height > config.IMAGE_MAX_PIXELS:
+                raise ImageRejected(f"Image is {width}x{height}; at most {config.IMAGE_MAX_PIXELS / 1e6:.0f} MP is accepted", too_large=True)
+            longest = max(width, height)
+            if max_side and longest > max_side and im.format == "JPEG":
+                ratio = max_side / longest
+                # the decoder picks the smallest DCT scale still at least this size
+                im.draft("RGB", (max(1, int(width * ratio)), max(1, int(height * ratio))))
+            im = ImageOps.exif_transpose(im).convert("RGB")
+            if max_side and max(im.size) > max_side:
+                ratio = max_side / max(im.size)
+                im = im.resize((max(1, round(im.width * ratio)), max(1, round(im.height * ratio))), Image.BILINEAR)
+            img = np.ascontiguousarray(np.asarray(im)[:, :, ::-1])
+    except Image.DecompressionBombError as exc:
+        raise ImageRejected(str(exc), too_large=True)
+    except (UnidentifiedImageError, OSError) as exc:
+        raise ImageRejected(f"Exception while loading {path}: {exc}")
+    return img, max(img.shape[:2]) / longest
+
+
+def to_original(area: Dict[str, Any], scale: float) -> Dict[str, Any]:
+    """A facial_area found on a decoded image of `scale`, in the uploaded image's pixels."""
+    if scale == 1.0:
+        return area
+    from .face_detection import _scale_area
+
+    return _scale_area(area, 1.0 / scale)
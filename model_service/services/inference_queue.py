@@ -0,0 +1,323 @@
+"""Admission control for inference work.
+
+Recognition, verification, /detect and enrollment run on a fixed pool of
+``INFERENCE_WORKERS`` threads instead of on the event loop. Requests that
+find every worker busy wait in a queue of at most ``INFERENCE_QUEUE_MAX``
+entries; once it is full, new requests are rejected straight away with 503
+and a ``Retry-After`` estimated from the queue length and the recent service
+time, so callers shed frames instead of stacking up timeouts. Requests also
+carry their caller's deadline into the worker (see ``services/deadline.py``).
+
+The queue is ordered by priority class (live recognition, then verification,
+then enrollment) and, within a class, shared fairly between API keys.
+
+Queue depth is exported as ``model_service_inference_queue_depth{kind}``, time
+spent waiting as ``model_service_inference_queue_wait_seconds{kind}`` (and as
+the ``queue`` stage in Server-Timing), and rejections as
+``model_service_inference_rejected_total{kind}``.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+from .. import config
+from . import cluster, deadline, metrics
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"inference queue full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("priority", "start", "seq", "kind", "future", "removed")
+
+    def __init__(self, priority: int, start: float, seq: int, kind: str, future: asyncio.Future):
+        self.priority = priority
+        self.start = start
+        self.seq = seq
+        self.kind = kind
+        self.future = future
+        self.removed = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.start, self.seq) < (other.start, other.seq)
+
+
+class _PriorityClass:
+    """Start-time fair queue: each flow's next job starts at max(vtime, its last finish tag)."""
+
+    def __init__(self):
+        self.heap: List[_Waiter] = []
+        self.vtime = 0.0
+        self.finish: Dict[str, float] = {}
+        self.live = 0
+
+
+class InferenceQueue:
+    """Runs blocking inference calls on `workers` threads, with at most `max_queue` callers waiting.
+
+    Waiters are served by priority class first (lower number first, see
+    ``INFERENCE_PRIORITIES``). Within a class, flows (one per API key) share
+    the workers in proportion to their weight, via start-time fair queuing,
+    so a key that queued a hundred enrollment images does not starve another
+    key's single request. When the queue is full, a newcomer displaces the
+    most recently queued waiter of a lower class, and is rejected only when
+    there is none.
+
+    Admission is decided on the event loop, so no locking is needed; only the
+    calls themselves run on the pool.
+    """
+
+    # weight of the newest sample in the service-time moving average
+    _EWMA_ALPHA = 0.2
+
+    def __init__(self, workers: int, max_queue: int, priorities: Optional[Dict[str, int]] = None):
+        self.workers = max(1, int(workers))
+        self.max_queue = max(0, int(max_queue))
+        self.priorities = dict(priorities or {})
+        self._busy = 0
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._classes: Dict[int, _PriorityClass] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._service_seconds: Optional[float] = None
+
+    @property
+    def depth(self) -> int:
+        return self._waiting
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    def depth_by_kind(self) -> Dict[str, int]:
+        out: Dict[str, int] = {}
+        for cls in self._classes.values():
+            for w in cls.heap:
+                if not w.removed:
+                    out[w.kind] = out.get(w.kind, 0) + 1
+        return out
+
+    def _priority(self, kind: str) -> int:
+        return self.priorities.get(kind, max(self.priorities.values(), default=0))
+
+    def retry_after(self, priority: Optional[int] = None) -> int:
+        """Seconds until a new request of `priority` would likely get a worker (at least 1)."""
+        ahead = self._waiting
+        if priority is not None:
+            ahead = sum(c.live for p, c in self._classes.items() if p <= priority)
+        per_job = self._service_seconds or 1.0
+        return max(1, math.ceil((ahead + 1) * per_job / self.workers))
+
+    def _push(self, priority: int, kind: str, flow: str, weight: float) -> _Waiter:
+        cls = self._classes.get(priority)
+        if cls is None:
+            cls = self._classes[priority] = _PriorityClass()
+        start = max(cls.vtime, cls.finish.get(flow, 0.0))
+        cls.finish[flow] = start + 1.0 / max(weight, 1e-6)
+        waiter = _Waiter(priority, start, next(self._seq), kind, asyncio.get_running_loop().create_future())
+        heapq.heappush(cls.heap, waiter)
+        cls.live += 1
+        self._waiting += 1
+        return waiter
+
+    def _drop(self, waiter: _Waiter) -> None:
+        waiter.removed = True
+        self._classes[waiter.priority].live -= 1
+        self._waiting -= 1
+
+    def _pop(self) -> Optional[_Waiter]:
+        for priority in sorted(self._classes):
+            cls = self._classes[priority]
+            while cls.heap:
+                waiter = heapq.heappop(cls.heap)
+                if waiter.removed:
+                    continue
+                self._drop(waiter)
+                cls.vtime = waiter.start
+                if not cls.live:
+                    # idle class: forget finish tags so returning flows start fresh
+                    cls.finish.clear()
+                return waiter
+        return None
+
+    def _displace(self, priority: int) -> bool:
+        """Reject the newest waiter of the lowest class below `priority`; False if there is none."""
+        for p in sorted(self._classes, reverse=True):
+            if p <= priority:
+                break
+            live = [w for w in self._classes[p].heap if not w.removed]
+            if live:
+                victim = max(live)
+                self._drop(victim)
+                victim.future.set_exception(QueueFull(self.retry_after(p)))
+                return True
+        return False
+
+    async def _acquire(self, kind: str, flow: str, weight: float) -> None:
+        if self._busy < self.workers and not self._waiting:
+            self._busy += 1
+            return
+        priority = self._priority(kind)
+        if self._waiting >= self.max_queue and not self._displace(priority):
+            raise QueueFull(self.retry_after(priority))
+        waiter = self._push(priority, kind, flow, weight)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if not waiter.removed:
+                self._drop(waiter)
+                current = deadline.current()
+                if current is not None and current.cancelled:
+                    metrics.INFERENCE_CANCELLED.inc(stage="queue")
+            elif waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # a worker slot was handed to us just as we were cancelled; pass it on
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        waiter = self._pop()
+        while waiter is not None and waiter.future.done():
+            waiter = self._pop()
+        if waiter is not None:
+            # hand the slot straight to the next waiter; _busy is unchanged
+            waiter.future.set_result(None)
+            return
+        self._busy -= 1
+
+    def _observe_service(self, seconds: float) -> None:
+        if self._service_seconds is None:
+            self._service_seconds = seconds
+        else:
+            self._service_seconds += self._EWMA_ALPHA * (seconds - self._service_seconds)
+
+    async def run(self, kind: str, fn: Callable[..., Any], *args: Any, flow: str = "", weight: float = 1.0) -> Any:
+        """Run fn(*args) on the pool once admitted; raises QueueFull when the queue is full.
+
+        `flow` identifies the caller for fair sharing within the kind's priority
+        class and `weight` is its share.
+
+        The call runs in a copy of the caller's context, so stage timings still
+        reach the request's Server-Timing header.
+        """
+        waited_from = time.perf_counter()
+        try:
+            with metrics.stage("queue"):
+                await self._acquire(kind, flow, weight)
+        except QueueFull:
+            metrics.INFERENCE_REJECTED.inc(kind=kind)
+            raise
+        metrics.INFERENCE_QUEUE_WAIT.observe(time.perf_counter() - waited_from, kind=kind)
+
+        def call():
+            # frames that waited past their deadline are dropped before any work
+            deadline.check("queue")
+            start = time.perf_counter()
+            try:
+                with metrics.inference(kind):
+                    return fn(*args)
+            finally:
+                self._observe_service(time.perf_counter() - start)
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        ctx = contextvars.copy_context()
+        job = asyncio.get_running_loop().run_in_executor(self._executor, ctx.run, call)
+        # the worker is only free once the call returns, even if the request is cancelled meanwhile
+        job.add_done_callback(self._job_done)
+        return await asyncio.shield(job)
+
+    def _job_done(self, job: asyncio.Future) -> None:
+        self._release()
+        if not job.cancelled():
+            # retrieved here so jobs abandoned by a cancelled request don't log "never retrieved"
+            job.exception()
+
+
+inference_queue = InferenceQueue(config.INFERENCE_WORKERS, config.INFERENCE_QUEUE_MAX, config.INFERENCE_PRIORITIES)
+
+
+def _flow(request: Request) -> Tuple[str, float]:
+    """(fair-share flow, weight) for a request: its API key, weighted by the key owner's configured share."""
+    # set by require_auth once the key is validated
+    principal = getattr(request.state, "api_key_principal", None)
+    if principal is None:
+        return "anonymous", 1.0
+    return "key:" + principal.key, config.INFERENCE_USER_WEIGHTS.get(principal.user_id, 1.0)
+
+
+def request_deadline(request: Request) -> deadline.Deadline:
+    """The request's deadline, shared by every queue entry the request makes.
+
+    Started from X-Request-Deadline-Ms on first use and kept on request.state,
+    so a route that queues one entry per image (/refresh-db) gets one budget
+    for all of them rather than a fresh one per image.
+    """
+    current = getattr(request.state, "deadline", None)
+    if current is None:
+        current = request.state.deadline = deadline.from_headers(request.headers)
+    return current
+
+
+@contextmanager
+def _http_errors():
+    """A full queue, a passed deadline or an unreachable gallery peer as the HTTP error the route returns."""
+    try:
+        yield
+    except QueueFull as exc:
+        raise HTTPException(
+            status_code=503,
+            detail="Inference queue is full; retry later",
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    except deadline.DeadlineExceeded as exc:
+        raise HTTPException(status_code=499 if exc.cancelled else 504, detail=str(exc))
+    except cluster.PeerUnavailable as exc:
+        raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
+
+@contextmanager
+def on_event_loop(request: Optional[Request] = None):
+    """For a route's own awaits between queue entries (a coordinator's peer search).
+
+    Binds the request's deadline, as run_inference does for the worker, and
+    maps its failures to the same HTTP errors.
+    """
+    with _http_errors(), deadline.bound(request_deadline(request) if request is not None else None):
+        yield
+
+
+async def run_inference(kind: str, fn: Callable[..., Any], *args: Any, request: Optional[Request] = None) -> Any:
+    """Route helper around inference_queue.run.
+
+    A full queue becomes 503 with Retry-After. With `request`, the caller's
+    API key is its fair-share flow, its X-Request-Deadline-Ms is enforced
+    (504 once passed) and the work is cancelled if the client disconnects (499).
+    An unreachable gallery peer (coordinator mode) is also 503.
+    """
+    current = request_deadline(request) if request is not None else None
+    flow, weight = _flow(request) if request is not None else ("", 1.0)
+    with deadline.bound(current):
+        # the task (and the worker call it makes) inherit the deadline from this context
+        task = asyncio.ensure_future(inference_queue.run(kind, fn, *args, flow=flow, weight=weight))
+    with _http_errors():
+        if request is None:
+            return await task
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=config.DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                current.cancel()
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
@@ -0,0 +1,344 @@
+"""In-process metrics rendered in the Prometheus text format at ``GET /metrics``.
+
+Counters, gauges and fixed-bucket histograms are plain Python objects guarded
+by a lock each, cheap enough to update on every frame. Values that already
+live elsewhere (gallery size, cache counters, RSS) are read through callbacks
+at scrape time instead of being mirrored on the request path.
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[Dict[str, str], float]
+
+# Seconds; covers ~1 ms search up to multi-second cold detections
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _fmt_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    v = float(v)
+    if v == float("inf"):
+        return "+Inf"
+    if v.is_integer() and abs(v) < 1e15:
+        return str(int(v))
+    return repr(v)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Labels, object] = {}
+
+    def _key(self, kv: Dict[str, str]) -> Labels:
+        return tuple((n, str(kv[n])) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._children.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._children.items())
+        return self.header() + [f"{self.name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = float(value)
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, n: int):
+        self.counts = [0] * n
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = _HistogramChild(len(self.buckets) + 1)
+            child.counts[i] += 1
+            child.sum += value
+            child.count += 1
+
+    def snapshot(self, **labels) -> Optional[Tuple[List[int], float, int]]:
+        child = self._children.get(self._key(labels))
+        if child is None:
+            return None
+        with self._lock:
+            return list(child.counts), child.sum, child.count
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c.counts), c.sum, c.count) for k, c in self._children.items()]
+        lines = self.header()
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(round(total, 9))}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Gauge/counter whose samples are produced by `fn` at scrape time."""
+
+    def __init__(self, name: str, documentation: str, fn: Callable[[], Union[float, Iterable[Sample]]], kind: str = "gauge"):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        samples = [({}, value)] if isinstance(value, (int, float)) else list(value)
+        return self.header() + [
+            f"{self.name}{_fmt_labels(tuple(sorted(lbl.items())))} {_fmt_value(v)}" for lbl, v in samples
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(
+    Histogram("model_service_stage_seconds", "Time spent per pipeline stage.", ["stage"])
+)
+REQUEST_SECONDS = registry.register(
+    Histogram("model_service_request_seconds", "End-to-end request latency per route.", ["route", "status"])
+)
+FACES_PER_FRAME = registry.register(
+    Histogram("model_service_faces_per_frame", "Faces kept after detection per /recognise frame.", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34))
+)
+INFERENCE_IN_FLIGHT = registry.register(Gauge("model_service_inference_in_flight", "Inference calls currently running."))
+INFERENCE_BUSY_SECONDS = registry.register(
+    Counter("model_service_inference_busy_seconds_total", "Wall time spent inside inference calls; rate() gives executor utilisation.", ["kind"])
+)
+INFERENCE_QUEUE_WAIT = registry.register(
+    Histogram("model_service_inference_queue_wait_seconds", "Time requests waited for an inference worker.", ["kind"])
+)
+INFERENCE_REJECTED = registry.register(
+    Counter("model_service_inference_rejected_total", "Requests rejected with 503 because the inference queue was full.", ["kind"])
+)
+INFERENCE_SKIPPED = registry.register(
+    Counter("model_service_inference_skipped_total", "Requests dropped at a stage because their deadline had passed.", ["stage"])
+)
+INFERENCE_CANCELLED = registry.register(
+    Counter("model_service_inference_cancelled_total", "Requests dropped at a stage because the client disconnected.", ["stage"])
+)
+ANTISPOOF_FACES = registry.register(
+    Counter("model_service_antispoof_faces_total", "Matched faces given a spoof verdict, by cached or scored.", ["result"])
+)
+DETECTOR_CASCADE_RUNS = registry.register(
+    Counter(
+        "model_service_detector_cascade_runs_total",
+        "Detector cascade stage runs by outcome (hit, below_floor, miss); hit / all runs is the stage hit rate.",
+        ["cascade", "stage", "result"],
+    )
+)
+CLUSTER_PEER_SECONDS = registry.register(
+    Histogram("model_service_cluster_peer_seconds", "Coordinator calls to gallery peers, by peer.", ["peer"])
+)
+CLUSTER_PEER_ERRORS = registry.register(
+    Counter("model_service_cluster_peer_errors_total", "Coordinator calls to gallery peers that failed or timed out.", ["peer"])
+)
+REPLICATION_APPLIED = registry.register(
+    Counter("model_service_replication_applied_total", "Gallery changes this replica applied from its primary.")
+)
+REPLICATION_SNAPSHOTS = registry.register(
+    Counter("model_service_replication_snapshots_total", "Snapshot bootstraps this replica made from its primary.")
+)
+REPLICATION_ERRORS = registry.register(
+    Counter("model_service_replication_errors_total", "Failed replication polls against the primary.")
+)
+ENROLLED_IMAGES = registry.register(Counter("model_service_enrolled_images_total", "Enrollment images processed by /refresh-db.", ["status"]))
+
+
+# Per-request stage durations (seconds) for the Server-Timing header; None outside a request
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a pipeline stage into model_service_stage_seconds{stage=name} and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def request_timings():
+    """Collect the stages timed within this block (and tasks spawned from it) into a dict."""
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """Render stage durations as a Server-Timing header value (durations in ms)."""
+    parts = [f"{name};dur={secs * 1000:.2f}" for name, secs in timings.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+@contextmanager
+def inference(kind: str):
+    """Mark a block as occupying the inference path (in-flight gauge + busy seconds)."""
+    INFERENCE_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        INFERENCE_IN_FLIGHT.dec()
+        INFERENCE_BUSY_SECONDS.inc(time.perf_counter() - start, kind=kind)
+
+
+def process_rss_bytes() -> Optional[float]:
+    """Resident set size of this process from /proc (None where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return float(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE"))
+    except Exception:
+        return None
+
+
+def _gallery_size() -> List[Sample]:
+    from .gallery import get_gallery, resident_shards
+
+    get_gallery()  # the default shard is always reported
+    return [({"shard": name or "default"}, size) for name, size in sorted(resident_shards().items())]
+
+
+def _api_key_cache_samples() -> List[Sample]:
+    from .auth import api_key_cache
+
+    s = api_key_cache.stats()
+    return [({"result": "hit"}, s["hits"]), ({"result": "miss"}, s["misses"])]
+
+
+def _inference_queue_depth() -> List[Sample]:
+    from .. import config
+    from .inference_queue import inference_queue
+
+    depth = inference_queue.depth_by_kind()
+    return [({"kind": kind}, depth.get(kind, 0)) for kind in config.INFERENCE_PRIORITIES]
+
+
+def _replication_samples(field: str) -> Callable[[], Optional[float]]:
+    def read() -> Optional[float]:
+        from . import replication
+
+        status = replication.status()
+        return None if field not in status else float(status[field])
+
+    return read
+
+
+def _log_queue_depth() -> float:
+    from common.log_setup import queue_depth
+
+    return float(queue_depth("model_service"))
+
+
+registry.register(CallbackMetric("model_service_gallery_size", "Embeddings in each resident gallery shard.", _gallery_size))
+registry.register(
+    CallbackMetric("model_service_api_key_cache_requests_total", "API-key cache lookups by result.", _api_key_cache_samples, kind="counter")
+)
+registry.register(
+    CallbackMetric("model_service_inference_queue_depth", "Requests waiting for an inference worker, by kind.", _inference_queue_depth)
+)
+registry.register(
+    CallbackMetric("model_service_replication_head_seq", "Last gallery change sequence number on this primary.", _replication_samples("head_seq"))
+)
+registry.register(
+    CallbackMetric("model_service_replication_applied_seq", "Last primary change sequence number applied by this replica.", _replication_samples("applied_seq"))
+)
+registry.register(
+    CallbackMetric("model_service_replication_lag_changes", "Changes on the primary not yet applied by this replica.", _replication_samples("lag_changes"))
+)
+registry.register(
+    CallbackMetric("model_service_replication_lag_seconds", "Seconds since this replica was last caught up with its primary.", _replication_samples("lag_seconds"))
+)
+registry.register(CallbackMetric("model_service_log_queue_depth", "Log records waiting for the writer thread.", _log_queue_depth))
+registry.register(CallbackMetric("process_resident_memory_bytes", "Resident memory size in bytes.", process_rss_bytes))
@@ -0,0 +1,304 @@
+"""Recognition pipeline behind /recognise: detect -> embed -> search -> materialise -> anti-spoof.
+
+This replaces the ``DeepFace.find`` call. Detection and embedding still use
+DeepFace's building blocks, but the gallery is the resident matrix from
+``services.gallery`` and results are materialised from arrays, emitting only
+the fields callers use (identity, distance, confidence and the source box).
+Each stage is timed into ``services.metrics``, and the request's deadline is
+checked before detect, represent and search (``services.deadline``). Callers
+may restrict the search to some gallery shards (see ``services.gallery``).
+On a coordinator node the search itself runs on the peers (``services.cluster``):
+``recognise_on_peers`` / ``verify_on_peers`` queue only the decode, detect and
+embed (and the spoof check), and await the peers on the event loop.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .. import config
+from . import cluster, deadline, face_detection, image_prep, metrics, recognizer
+from .gallery import find_confidences, identity_distance, resident_indexes, search_threshold, top_k_many
+from .inference_queue import on_event_loop, run_inference
+
+
+def _deepface():
+    """(image_utils, detection, modeling) from DeepFace, or the fake backend's stand-ins."""
+    if config.FAKE_BACKEND:
+        from .fake_backend import detection, image_utils, modeling
+    else:
+        from deepface.commons import image_utils
+        from deepface.modules import detection, modeling
+    return image_utils, detection, modeling
+
+
+def load_scaled(img_path, max_side: int = 0) -> Tuple[np.ndarray, float]:
+    """Decode the image once (BGR, upright, see services/image_prep.py) so detection and anti-spoofing share it.
+
+    Returns (image, scale); with `max_side` the image is shrunk to at most
+    that longer side and `scale` maps its pixels to the upload's.
+    """
+    if config.FAKE_BACKEND:
+        image_utils, _, _ = _deepface()
+        with metrics.stage("decode"):
+            img, img_name = image_utils.load_image(img_path)
+        if img is None:
+            raise ValueError(f"Exception while loading {img_name}")
+        return img, 1.0
+    with metrics.stage("decode"):
+        return image_prep.decode(img_path, max_side)
+
+
+def load_image(img_path, max_side: int = 0) -> np.ndarray:
+    return load_scaled(img_path, max_side)[0]
+
+
+def _to_original(results, scale: float):
+    """Map the source_* boxes of results found on a shrunk image back to the upload's pixels."""
+    if scale == 1.0:
+        return results
+    for match in results:
+        area = image_prep.to_original(
+            {"x": match["source_x"], "y": match["source_y"], "w": match["source_w"], "h": match["source_h"]}, scale
+        )
+        match.update(source_x=area["x"], source_y=area["y"], source_w=area["w"], source_h=area["h"])
+    return results
+
+
+def check_spoof(img: np.ndarray, source_objs: List[Dict[str, Any]], identities: List[str]) -> None:
+    """Spoof-check matched faces (batched, cached per identity + region); raises ValueError on a spoof."""
+    from . import antispoof
+
+    if not source_objs:
+        return
+    _, _, modeling = _deepface()
+    with metrics.stage("antispoof"):
+        antispoof_model = modeling.build_model(task="spoofing", model_name="Fasnet")
+        verdicts = antispoof.verdicts(antispoof_model, img, [obj["facial_area"] for obj in source_objs], identities)
+    for obj, (is_real, score) in zip(source_objs, verdicts):
+        obj["is_real"], obj["antispoof_score"] = is_real, score
+    if any(is_real is False for is_real, _ in verdicts):
+        raise ValueError("Spoof detected in the given image.")
+
+
+def detect_faces(img_path, img: np.ndarray = None) -> List[Dict[str, Any]]:
+    """Detect and align faces through the DETECTOR_CASCADE, dropping low-confidence detections.
+
+    Anti-spoofing is not run here; callers check only the faces that matched.
+    """
+    _, detection, modeling = _deepface()
+
+    if img is None:
+        img = load_image(img_path)
+    with metrics.stage("detect"):
+        source_objs = face_detection.detect(detection, img, "recognise", modeling)
+    if not source_objs:
+        raise ValueError("Face could not be detected. Please confirm that the picture is a face photo.")
+
+    kept = []
+    for obj in source_objs:
+        det_conf = obj.get("facial_area", {}).get("confidence", obj.get("confidence"))
+        if det_conf is not None and det_conf < config.MIN_DETECTION_CONFIDENCE:
+            continue
+        kept.append(obj)
+
+    if source_objs and not kept:
+        raise ValueError(
+            f"Face detection confidence too low (< {config.MIN_DETECTION_CONFIDENCE}) for all detected faces."
+        )
+    return kept
+
+
+def embed_faces(source_objs: List[Dict[str, Any]]) -> np.ndarray:
+    """Embed every detected face in one batched forward pass; returns an (M, D) float32 array."""
+    with metrics.stage("represent"):
+        return recognizer.embed_faces([obj["face"] for obj in source_objs])
+
+
+def materialise(source_objs, best: np.ndarray, distances: np.ndarray, identities: np.ndarray) -> List[List[Dict[str, Any]]]:
+    """Build the response: one list per face holding its best match, or [] when none passes."""
+    threshold = search_threshold()
+    verified = distances <= threshold
+    confidences = find_confidences(np.where(np.isfinite(distances), distances, 0.0), verified)
+
+    matched_ids = identities[best[verified]].tolist() if verified.any() else []
+    dist_list = distances.tolist()
+    conf_list = confidences.tolist()
+    ids = iter(matched_ids)
+
+    out = []
+    for i, ok in enumerate(verified.tolist()):
+        if not ok:
+            out.append([])
+            continue
+        area = source_objs[i]["facial_area"]
+        out.append(
+            [
+                {
+                    "identity": next(ids),
+                    "distance": dist_list[i],
+                    "confidence": conf_list[i],
+                    "source_x": int(area["x"]),
+                    "source_y": int(area["y"]),
+                    "source_w": int(area["w"]),
+                    "source_h": int(area["h"]),
+                }
+            ]
+        )
+    return out
+
+
+def materialise_ranked(source_objs, identities: np.ndarray, distances: np.ndarray) -> List[List[Dict[str, Any]]]:
+    """Like materialise, for (M, k) candidate lists: each face gets its candidates that pass, nearest first."""
+    threshold = search_threshold()
+    verified = distances <= threshold
+    conf = iter(find_confidences(distances[verified], np.ones(int(verified.sum()), dtype=bool)).tolist())
+    out = []
+    for i, row in enumerate(verified.tolist()):
+        area = source_objs[i]["facial_area"]
+        out.append(
+            [
+                {
+                    "identity": identities[i, j],
+                    "distance": float(distances[i, j]),
+                    "confidence": next(conf),
+                    "source_x": int(area["x"]),
+                    "source_y": int(area["y"]),
+                    "source_w": int(area["w"]),
+                    "source_h": int(area["h"]),
+                }
+                for j, ok in enumerate(row)
+                if ok
+            ]
+        )
+    return out
+
+
+def probe_faces(img_path) -> Tuple[np.ndarray, float, List[Dict[str, Any]], Optional[np.ndarray]]:
+    """Decode, detect and embed: (image, scale, faces, (M, D) embeddings); embeddings is None when no face passes."""
+    img, scale = load_scaled(img_path, config.PREP_MAX_SIDE_RECOGNISE)
+    deadline.check("detect")
+    source_objs = detect_faces(img_path, img)
+    metrics.FACES_PER_FRAME.observe(len(source_objs))
+    if not source_objs:
+        return img, scale, source_objs, None
+    deadline.check("represent")
+    return img, scale, source_objs, embed_faces(source_objs)
+
+
+def finish_recognise(img: np.ndarray, scale: float, source_objs, results: List[List[Dict[str, Any]]]) -> List[List[Dict[str, Any]]]:
+    """Spoof-check the faces that matched and map their boxes back to the upload's pixels."""
+    if config.ANTI_SPOOFING:
+        # only faces that matched someone can mark attendance, so only they are spoof-checked
+        matched = [i for i, matches in enumerate(results) if matches]
+        check_spoof(img, [source_objs[i] for i in matched], [results[i][0]["identity"] for i in matched])
+    for matches in results:
+        _to_original(matches, scale)
+    return results
+
+
+def recognise(img_path, shards: Optional[Sequence[Optional[str]]] = None, top_k: int = 1) -> List[List[Dict[str, Any]]]:
+    """Up to `top_k` matches per face in `img_path`, searching `shards` (see gallery.parse_shards) or the default gallery.
+
+    Searches this node's resident gallery; a coordinator uses recognise_on_peers.
+    """
+    galleries, indexes = resident_indexes(shards)
+    if not indexes:
+        raise ValueError(f"Nothing is found in {', '.join(g.path for g in galleries)}")
+
+    img, scale, source_objs, embeddings = probe_faces(img_path)
+    if not source_objs:
+        return []
+    deadline.check("search")
+    with metrics.stage("search"):
+        if len(indexes) == 1 and top_k == 1:
+            best, distances = indexes[0].search(embeddings)
+            results = materialise(source_objs, best, distances, indexes[0].identities)
+        else:
+            results = materialise_ranked(source_objs, *top_k_many(indexes, embeddings, top_k))
+    return finish_recognise(img, scale, source_objs, results)
+
+
+async def recognise_on_peers(img_path, shards: Optional[Sequence[Optional[str]]] = None, top_k: int = 1, request=None):
+    """recognise() for a coordinator.
+
+    An inference worker decodes, detects and embeds; the peers are then
+    searched from the event loop, so waiting on them holds no worker. Only the
+    spoof check of matched faces goes back onto the queue.
+    """
+    img, scale, source_objs, embeddings = await run_inference("recognise", probe_faces, img_path, request=request)
+    if not source_objs:
+        return []
+    with on_event_loop(request):
+        deadline.check("search")
+        with metrics.stage("search"):
+            results = materialise_ranked(source_objs, *await cluster.search(embeddings, shards, top_k))
+    if config.ANTI_SPOOFING and any(results):
+        return await run_inference("recognise", finish_recognise, img, scale, source_objs, results, request=request)
+    return finish_recognise(img, scale, source_objs, results)
+
+
+def probe_face(img_path) -> Tuple[np.ndarray, float, Dict[str, Any], np.ndarray]:
+    """Decode, detect and embed the largest face: (image, scale, face, (1, D) embedding)."""
+    img, scale = load_scaled(img_path, config.PREP_MAX_SIDE_RECOGNISE)
+    deadline.check("detect")
+    source_objs = detect_faces(img_path, img)
+    if not source_objs:
+        raise ValueError("Face could not be detected in the probe image.")
+    # kiosk probes hold one person; the largest face is the one presenting
+    probe = max(source_objs, key=lambda o: o["facial_area"]["w"] * o["facial_area"]["h"])
+
+    deadline.check("represent")
+    return img, scale, probe, embed_faces([probe])
+
+
+def finish_verify(img: np.ndarray, scale: float, probe: Dict[str, Any], identity: str, distance: Optional[float], enrolled: int) -> Dict[str, Any]:
+    """The /verify result for `probe`'s distance to `identity`, spoof-checking a match."""
+    if distance is None:
+        raise LookupError(f"Identity {identity} is not enrolled")
+    threshold = search_threshold()
+    verified = distance <= threshold
+    confidence = float(find_confidences(np.array([distance]), np.array([verified]))[0])
+    if verified and config.ANTI_SPOOFING:
+        check_spoof(img, [probe], [identity])
+    area = image_prep.to_original(probe["facial_area"], scale)
+    return {
+        "identity": identity,
+        "verified": bool(verified),
+        "distance": distance,
+        "threshold": threshold,
+        "confidence": confidence,
+        "enrolled_embeddings": enrolled,
+        "source_x": int(area["x"]),
+        "source_y": int(area["y"]),
+        "source_w": int(area["w"]),
+        "source_h": int(area["h"]),
+    }
+
+
+def verify(img_path, identity: str, shards: Optional[Sequence[Optional[str]]] = None) -> Dict[str, Any]:
+    """1:1 check of the largest face in `img_path` against `identity`'s enrolled embeddings.
+
+    Raises LookupError when the identity has no embeddings in `shards` (default gallery when None).
+    Searches this node's resident gallery; a coordinator uses verify_on_peers.
+    """
+    _, indexes = resident_indexes(shards)
+    if not any(index.rows_for(identity).size for index in indexes):
+        raise LookupError(f"Identity {identity} is not enrolled")
+
+    img, scale, probe, embedding = probe_face(img_path)
+    deadline.check("search")
+    with metrics.stage("search"):
+        distance, enrolled = identity_distance(indexes, embedding, identity)
+    return finish_verify(img, scale, probe, identity, distance, enrolled)
+
+
+async def verify_on_peers(img_path, identity: str, shards: Optional[Sequence[Optional[str]]] = None, request=None) -> Dict[str, Any]:
+    """verify() for a coordinator: embedded on a worker, compared on the peers from the event loop."""
+    img, scale, probe, embedding = await run_inference("verify", probe_face, img_path, request=request)
+    with on_event_loop(request):
+        deadline.check("search")
+        with metrics.stage("search"):
+            distance, enrolled = await cluster.verify(embedding, identity, shards)
+    if config.ANTI_SPOOFING and distance is not None and distance <= search_threshold():
+        return await run_inference("verify", finish_verify, img, scale, probe, identity, distance, enrolled, request=request)
+    return finish_verify(img, scale, probe, identity, distance, enrolled)
@@ -1,35 +1,119 @@
+import math
 import time
-from typing import Dict
+import zlib
 from threading import Lock
+from typing import Callable, Dict, List, Optional
 
-# Simple in-memory rate limiter. Not distributed; ok for single-process dev.
+from fastapi import HTTPException, Request
+
+from .. import config
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+# In-memory token-bucket rate limiter. Not distributed; limits apply per process.
 class RateLimiter:
-    def __init__(self, calls: int = 60, period: int = 60):
+    """Token buckets keyed by caller, O(1) per call.
+
+    Each key refills at ``calls / period`` tokens per second up to ``burst``.
+    Keys are spread over ``shards`` independently locked dicts so unrelated
+    callers don't contend on one lock, and buckets idle for ``idle_ttl``
+    seconds are swept out so the table doesn't grow without bound.
+    """
+
+    def __init__(
+        self,
+        calls: int = 60,
+        period: float = 60,
+        burst: Optional[int] = None,
+        shards: int = 16,
+        idle_ttl: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ):
         self.calls = calls
         self.period = period
-        self.storage: Dict[str, list] = {}
-        self.lock = Lock()
+        self.rate = calls / float(period)
+        self.burst = float(burst if burst is not None else calls)
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        self._shards: List[Dict[str, _Bucket]] = [{} for _ in range(shards)]
+        self._locks = [Lock() for _ in range(shards)]
+        self._next_sweep = [clock() + idle_ttl for _ in range(shards)]
+
+    def _shard(self, key: str) -> int:
+        return zlib.crc32(key.encode("utf-8")) % len(self._shards)
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Take `cost` tokens for `key`. Returns 0.0 if allowed, else seconds until it would be."""
+        i = self._shard(key)
+        now = self._clock()
+        with self._locks[i]:
+            buckets = self._shards[i]
+            if now >= self._next_sweep[i]:
+                self._sweep(buckets, now)
+                self._next_sweep[i] = now + self.idle_ttl
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = _Bucket(self.burst, now)
+            else:
+                b.tokens = min(self.burst, b.tokens + (now - b.updated) * self.rate)
+                b.updated = now
+            if b.tokens >= cost:
+                b.tokens -= cost
+                return 0.0
+            return (cost - b.tokens) / self.rate
 
     def allow(self, key: str) -> bool:
-        now = time.time()
-        with self.lock:
-            q = self.storage.setdefault(key, [])
-            # pop outdated
-            while q and q[0] <= now - self.period:
-                q.pop(0)
-            if len(q) >= self.calls:
-                return False
-            q.append(now)
-            return True
-
-
-default_limiter = RateLimiter(calls=60, period=60)
-
-def require_rate_limit(key: str):
-    def _inner():
-        if not default_limiter.allow(key):
-            from fastapi import HTTPException
-
-            raise HTTPException(status_code=429, detail="Too many requests")
+        return self.acquire(key) == 0.0
+
+    def _sweep(self, buckets: Dict[str, _Bucket], now: float) -> None:
+        cutoff = now - self.idle_ttl
+        for k in [k for k, b in buckets.items() if b.updated < cutoff]:
+            del buckets[k]
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self._shards)
+
+
+# One limiter per protected route, sized from config.RATE_LIMITS
+limiters: Dict[str, RateLimiter] = {
+    route: RateLimiter(calls=calls, period=period, burst=burst, idle_ttl=config.RATE_LIMIT_IDLE_SECONDS)
+    for route, (calls, period, burst) in config.RATE_LIMITS.items()
+}
+
+
+# Sent by a caller that multiplexes several cameras / sessions over one API key
+# (main_backend), so each stream gets its own bucket under that key
+STREAM_HEADER = "x-stream-id"
+
+
+def _caller_key(request: Request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        stream = request.headers.get(STREAM_HEADER, "")[:64]
+        return "key:" + api_key + (":stream:" + stream if stream else "")
+    client = request.client
+    return "ip:" + (client.host if client else "unknown")
+
+
+def require_rate_limit(route: str):
+    """FastAPI dependency limiting `route` per API key and X-Stream-Id (or client IP when no key is sent)."""
+    if route not in limiters:
+        raise KeyError(f"No rate limit configured for route {route!r}")
+
+    def _inner(request: Request):
+        retry_after = limiters[route].acquire(_caller_key(request))
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
 
     return _inner
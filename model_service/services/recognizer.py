@@ -0,0 +1,224 @@
+"""Embedding backends for the face recognizer.
+
+Two variants can serve embeddings:
+
+- ``fp32``: the ArcFace Keras graph loaded by DeepFace (default).
+- ``int8``: a post-training-quantised TFLite copy built and gated by
+  ``python -m model_service.quantize``. It is only served when its manifest
+  says the recall check passed; otherwise we fall back to fp32.
+
+Both expose ``embed(batch)`` on preprocessed ``(N, H, W, 3)`` float32 batches
+and return an ``(N, D)`` float32 array.
+"""
+import json
+import logging
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+from .. import config
+
+LOG = logging.getLogger("model_service.recognizer")
+
+_active = None
+_active_lock = threading.Lock()
+
+
+class KerasRecognizer:
+    """fp32 recognizer backed by the DeepFace FacialRecognition client."""
+
+    variant = "fp32"
+
+    def __init__(self, client):
+        self.client = client
+        self.input_shape = tuple(client.input_shape)
+        self.output_shape = int(client.output_shape)
+
+    def preprocess(self, faces) -> np.ndarray:
+        return preprocess_faces(faces, self.input_shape)
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        model = self.client.model
+        if batch.shape[0] == 1:
+            out = model(batch, training=False).numpy()
+        else:
+            out = model.predict_on_batch(batch)
+        return np.asarray(out, dtype=np.float32)
+
+
+class TFLiteRecognizer:
+    """int8 recognizer backed by a TFLite interpreter.
+
+    The interpreter is not thread-safe, so calls are serialised with a lock; the
+    input tensor is resized to the batch size when it changes.
+    """
+
+    variant = "int8"
+
+    def __init__(self, model_path: str, input_shape, output_shape: int):
+        try:
+            import tensorflow as tf
+        except Exception as exc:
+            raise RuntimeError("tensorflow is required to serve the int8 recognizer") from exc
+
+        self.input_shape = tuple(input_shape)
+        self.output_shape = int(output_shape)
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=config.TFLITE_NUM_THREADS)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+    def preprocess(self, faces) -> np.ndarray:
+        return preprocess_faces(faces, self.input_shape)
+
+    def embed(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch:
+                self._interpreter.resize_tensor_input(self._input["index"], list(batch.shape))
+                self._interpreter.allocate_tensors()
+                self._batch = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            out = self._interpreter.get_tensor(self._output["index"])
+        return np.asarray(out, dtype=np.float32)
+
+
+# Bumped whenever preprocess_faces changes what the model is fed; int8 models
+# calibrated on an older version must be rebuilt with model_service.quantize.
+# 2: crops are flipped to BGR as representation.represent does.
+PREPROCESS_VERSION = 2
+
+
+def read_manifest(path: str = None) -> Optional[dict]:
+    """Return the int8 manifest written by the quantisation tool, or None."""
+    path = path or config.QUANT_MANIFEST_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        LOG.exception("could not read quantisation manifest %s", path)
+        return None
+
+
+def int8_available() -> bool:
+    """True when an activated int8 model for the configured MODEL_NAME exists."""
+    manifest = read_manifest()
+    return bool(
+        manifest
+        and manifest.get("active")
+        and manifest.get("model_name") == config.MODEL_NAME
+        and manifest.get("preprocess_version") == PREPROCESS_VERSION
+        and os.path.exists(config.QUANT_MODEL_PATH)
+    )
+
+
+def build_recognizer(client, variant: str = None):
+    """Build the recognizer for `variant`, falling back to fp32 when int8 isn't activated."""
+    variant = (variant or config.RECOGNIZER_VARIANT).lower()
+    fp32 = KerasRecognizer(client)
+    if variant != "int8":
+        return fp32
+    if not int8_available():
+        LOG.warning("RECOGNIZER_VARIANT=int8 but no activated int8 model found at %s; serving fp32", config.QUANT_MODEL_PATH)
+        return fp32
+    try:
+        rec = TFLiteRecognizer(config.QUANT_MODEL_PATH, fp32.input_shape, fp32.output_shape)
+    except Exception:
+        LOG.exception("failed to load int8 recognizer; serving fp32")
+        return fp32
+    LOG.info("serving int8 recognizer from %s", config.QUANT_MODEL_PATH)
+    return rec
+
+
+def install(client, variant: str = None):
+    """Select the active recognizer and route the DeepFace client's forward() through it.
+
+    DeepFace caches one FacialRecognition instance per model name, so overriding
+    ``forward`` on that instance makes every ``representation.represent`` call
+    (including the ones inside ``DeepFace.find``) use the selected variant.
+    """
+    global _active
+    rec = build_recognizer(client, variant)
+    with _active_lock:
+        _active = rec
+    if rec.variant != "fp32":
+        client.forward = _forward_adapter(rec)
+    return rec
+
+
+def set_active(rec) -> None:
+    """Install an already built recognizer (e.g. the fake backend's) as the active one."""
+    global _active
+    with _active_lock:
+        _active = rec
+
+
+def get_active():
+    """Return the installed recognizer, building the fp32 one on first use if needed."""
+    global _active
+    if _active is None:
+        if config.FAKE_BACKEND:
+            from . import fake_backend
+
+            fake_backend.install()
+        else:
+            from deepface import DeepFace
+
+            install(DeepFace.build_model(config.MODEL_NAME))
+    return _active
+
+
+def embed_faces(faces, batch_size: int = None) -> np.ndarray:
+    """Embed face crops with as few forward passes as possible.
+
+    All crops are preprocessed and stacked into one tensor, then run through the
+    active recognizer in chunks of ``batch_size`` (EMBED_BATCH_SIZE). Row i of
+    the result belongs to ``faces[i]``.
+    """
+    rec = get_active()
+    if len(faces) == 0:
+        return np.empty((0, rec.output_shape), dtype=np.float32)
+    batch_size = batch_size or config.EMBED_BATCH_SIZE
+    batch = rec.preprocess(faces)
+    chunks = [rec.embed(batch[i : i + batch_size]) for i in range(0, batch.shape[0], batch_size)]
+    return np.concatenate(chunks, axis=0)
+
+
+def _forward_adapter(rec):
+    """Mimic FacialRecognition.forward's return shape (list for one, list of lists for many)."""
+
+    def forward(img: np.ndarray) -> List:
+        if img.ndim == 3:
+            img = np.expand_dims(img, axis=0)
+        embeddings = rec.embed(img)
+        if embeddings.shape[0] == 1:
+            return embeddings[0].tolist()
+        return embeddings.tolist()
+
+    return forward
+
+
+def preprocess_faces(faces, input_shape, normalization: str = None) -> np.ndarray:
+    """Resize + normalise face crops (as returned by extract_faces) into one model batch.
+
+    Matches representation.represent step for step, including its RGB -> BGR
+    flip, so embeddings equal the ones DeepFace.represent/find compute.
+    """
+    from deepface.modules import preprocessing
+
+    normalization = normalization or config.NORMALIZATION
+    batch = []
+    for face in faces:
+        # extract_faces returns RGB; represent feeds the model BGR
+        img = np.asarray(face)[:, :, ::-1]
+        img = preprocessing.resize_image(img=img, target_size=(input_shape[1], input_shape[0]))
+        img = preprocessing.normalize_input(img=img, normalization=normalization)
+        batch.append(img)
+    return np.concatenate(batch, axis=0).astype(np.float32)
@@ -0,0 +1,406 @@
+"""Gallery replication between model_service replicas through sequence-numbered deltas.
+
+Every gallery mutation (rows appended to a shard by /refresh-db or
+/cluster/enroll) is given the next sequence number and appended to this
+node's change log under ``ARC_DB_DIR/replication/``. The primary serves
+``GET /replication/changes?since=N`` (the changes after N, oldest first) and
+``GET /replication/snapshot`` (every shard plus the sequence it reflects).
+
+A node with ``REPLICATION_PRIMARY`` set is a read-only replica. A background
+thread polls the primary every ``REPLICATION_POLL_SECONDS``. It applies the
+new changes to its gallery files and resident indexes in order, logging them
+under the primary's sequence numbers. A new node, or a node that fell behind
+the primary's retained log (``REPLICATION_LOG_MAX_ENTRIES``), bootstraps
+from a snapshot first. Both endpoints require ``CLUSTER_SECRET``.
+
+Replica progress is exported as ``model_service_replication_applied_seq``,
+``model_service_replication_lag_changes`` (changes the primary has that this
+replica has not applied) and ``model_service_replication_lag_seconds`` (how
+long since the replica was last caught up). The primary exports
+``model_service_replication_head_seq``.
+"""
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .. import config
+
+LOG = logging.getLogger("model_service.replication")
+
+
+def encode_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """JSON-safe records: the embedding as base64 float32, without the duplicate rep/representations copies."""
+    out = []
+    for rec in records:
+        rec = {k: v for k, v in rec.items() if k not in ("rep", "representations")}
+        emb = rec.get("embedding")
+        if emb is not None:
+            rec["embedding"] = base64.b64encode(np.asarray(emb, dtype="<f4").tobytes()).decode("ascii")
+        out.append(rec)
+    return out
+
+
+def decode_records(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    out = []
+    for rec in records:
+        rec = dict(rec)
+        if rec.get("embedding") is not None:
+            emb = np.frombuffer(base64.b64decode(rec["embedding"]), dtype="<f4").tolist()
+            # same layout as add_face_arcface writes
+            rec["embedding"] = rec["rep"] = rec["representations"] = emb
+        out.append(rec)
+    return out
+
+
+class ChangeLog:
+    """Append-only JSON-lines log of gallery changes with contiguous sequence numbers.
+
+    ``base_seq`` is the sequence the oldest retained entry follows: a node
+    that has applied less than that must bootstrap from a snapshot. Callers
+    serialise appends (arcface_refresh holds its DB lock around the append
+    and the gallery write), so file order is sequence order.
+
+    Changes are logged (and fsync'd) before their rows are written to the
+    shard PKLs; ``applied_seq`` is the last change known to have reached
+    them. A crash in between leaves logged changes past ``applied_seq``,
+    which ``recover()`` writes at the next startup.
+    """
+
+    def __init__(self, directory: str, max_entries: int):
+        self.directory = directory
+        self.max_entries = max(1, int(max_entries))
+        self.path = os.path.join(directory, "changes.jsonl")
+        self._state_path = os.path.join(directory, "state.json")
+        self._applied_path = os.path.join(directory, "applied.json")
+        self._lock = threading.Lock()
+        self._offsets: List[int] = []  # byte offset of each retained entry, entry i has seq base_seq + 1 + i
+        self.base_seq = 0
+        self.applied_seq = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @property
+    def head_seq(self) -> int:
+        return self.base_seq + len(self._offsets)
+
+    @property
+    def bootstrapped(self) -> bool:
+        """Whether this log has a recorded starting point (set by a snapshot bootstrap or compaction)."""
+        return os.path.exists(self._state_path)
+
+    def _load(self) -> None:
+        try:
+            with open(self._state_path) as f:
+                self.base_seq = int(json.load(f)["base_seq"])
+        except FileNotFoundError:
+            self.base_seq = 0
+        self._offsets = []
+        if not os.path.exists(self.path):
+            self._load_applied()
+            return
+        end = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self._offsets.append(end)
+                end += len(line)
+        if os.path.getsize(self.path) != end:
+            # torn last write from a crash; that change was never acknowledged
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        self._load_applied()
+
+    def _load_applied(self) -> None:
+        try:
+            with open(self._applied_path) as f:
+                self.applied_seq = int(json.load(f)["seq"])
+        except FileNotFoundError:
+            # logs written before applied.json existed logged each change after its PKL write
+            self.applied_seq = self.head_seq
+
+    def _save_state(self) -> None:
+        tmp = self._state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"base_seq": self.base_seq}, f)
+        os.replace(tmp, self._state_path)
+
+    def append(self, shard: Optional[str], records: List[Dict[str, Any]], seq: Optional[int] = None) -> int:
+        """Log a change and return its sequence number (`seq`, when replaying a primary's change)."""
+        return self.append_many([(shard, records, seq)])[0]
+
+    def append_many(self, changes: List[Tuple[Optional[str], List[Dict[str, Any]], Optional[int]]]) -> List[int]:
+        """Log (shard, records, seq or None) changes in one durable write; returns their sequence numbers."""
+        with self._lock:
+            seqs, lines = [], []
+            for shard, records, seq in changes:
+                expected = self.head_seq + len(seqs) + 1
+                seq = expected if seq is None else seq
+                if seq != expected:
+                    raise ValueError(f"Change {seq} does not follow {expected - 1}")
+                seqs.append(seq)
+                lines.append(json.dumps({"seq": seq, "shard": shard, "records": encode_records(records)}, separators=(",", ":")).encode("utf-8") + b"\n")
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            for line in lines:
+                self._offsets.append(offset)
+                offset += len(line)
+            if len(self._offsets) > self.max_entries * 2:
+                self._compact(len(self._offsets) - self.max_entries)
+            return seqs
+
+    def mark_applied(self, seq: int) -> None:
+        """Record that every change up to `seq` has reached the shard PKLs."""
+        tmp = self._applied_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"seq": seq}, f)
+        os.replace(tmp, self._applied_path)
+        self.applied_seq = seq
+
+    def _compact(self, drop: int) -> None:
+        """Forget the oldest `drop` entries (replicas behind them bootstrap from a snapshot)."""
+        start = self._offsets[drop]
+        tmp = self.path + ".tmp"
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            src.seek(start)
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        self.base_seq += drop
+        self._save_state()
+        os.replace(tmp, self.path)
+        self._offsets = [o - start for o in self._offsets[drop:]]
+
+    def since(self, seq: int, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Encoded changes after `seq` (at most `limit`), or None when they are no longer retained.
+
+        Also None for a `seq` beyond the head: that caller has diverged from this log.
+        """
+        with self._lock:
+            if seq < self.base_seq or seq > self.head_seq:
+                return None
+            first = seq - self.base_seq
+            offsets = self._offsets[first:first + limit]
+            if not offsets:
+                return []
+            with open(self.path, "rb") as f:
+                f.seek(offsets[0])
+                return [json.loads(f.readline()) for _ in offsets]
+
+    def reset(self, seq: int) -> None:
+        """Start over at `seq` (after a snapshot bootstrap): no entries retained."""
+        with self._lock:
+            self.base_seq = seq
+            self._save_state()
+            open(self.path, "wb").close()
+            self._offsets = []
+            self.mark_applied(seq)
+
+
+_log: Optional[ChangeLog] = None
+_log_lock = threading.Lock()
+
+
+def change_log() -> ChangeLog:
+    global _log
+    with _log_lock:
+        if _log is None or _log.directory != os.path.join(config.ARC_DB_DIR, "replication"):
+            _log = ChangeLog(os.path.join(config.ARC_DB_DIR, "replication"), config.REPLICATION_LOG_MAX_ENTRIES)
+        return _log
+
+
+def force_resync() -> None:
+    """Move the change log past its retained entries, after an offline rewrite of the gallery files.
+
+    Replicas asking for changes after the old head are then behind the log and
+    re-bootstrap from a snapshot. A no-op on a replica.
+    """
+    if not is_replica():
+        log = change_log()
+        log.reset(log.head_seq + 1)
+
+
+def is_replica() -> bool:
+    return bool(config.REPLICATION_PRIMARY)
+
+
+def snapshot() -> Dict[str, Any]:
+    """Every shard's records and the sequence they reflect, taken under the gallery write lock."""
+    from . import arcface_refresh, gallery
+
+    with arcface_refresh.db_lock:
+        shards = {shard or "": encode_records(arcface_refresh.load_db(shard)) for shard in gallery.list_shards()}
+        return {"seq": change_log().head_seq, "shards": shards}
+
+
+def apply_snapshot(snap: Dict[str, Any]) -> None:
+    """Replace this node's gallery with a primary's snapshot."""
+    from . import arcface_refresh, gallery
+
+    with arcface_refresh.db_lock:
+        keep = set()
+        for name, records in snap["shards"].items():
+            arcface_refresh.save_db(decode_records(records), name or None)
+            keep.add(name or None)
+        for shard in gallery.list_shards():
+            if shard not in keep:
+                os.remove(gallery.shard_path(shard))
+                gallery.invalidate(shard)
+        change_log().reset(int(snap["seq"]))
+
+
+def apply_changes(changes: List[Dict[str, Any]]) -> int:
+    """Apply a page of a primary's changes, writing each shard they touch once; returns the sequence reached."""
+    from . import arcface_refresh
+
+    arcface_refresh.write_changes([(change["shard"], decode_records(change["records"]), int(change["seq"])) for change in changes])
+    return change_log().head_seq
+
+
+def recover() -> int:
+    """Write logged changes that never reached their shard PKLs (a crash between the two); returns how many.
+
+    Rows are stamped with the sequence of the change that added them, so a
+    change whose PKL write did complete (only applied.json was missed) is
+    recognised and not added twice.
+    """
+    from . import arcface_refresh
+
+    with arcface_refresh.db_lock:
+        log = change_log()
+        if log.applied_seq >= log.head_seq:
+            return 0
+        pending = log.since(max(log.applied_seq, log.base_seq), log.head_seq) or []
+        written: Dict[Optional[str], int] = {}
+        missing = []
+        for change in pending:
+            shard = change["shard"]
+            if shard not in written:
+                written[shard] = max((r.get("seq") or 0 for r in arcface_refresh.load_db(shard)), default=0)
+            if change["seq"] > written[shard]:
+                missing.append((shard, decode_records(change["records"]), change["seq"]))
+        arcface_refresh.write_shards(missing)
+        log.mark_applied(log.head_seq)
+    if missing:
+        LOG.warning("wrote %d logged gallery change(s) missing from the shard files", len(missing))
+    return len(missing)
+
+
+class Replicator:
+    """Background thread pulling a primary's changes into this replica."""
+
+    def __init__(self, primary: str):
+        self.primary = primary.rstrip("/")
+        self.lag_changes = 0
+        self.caught_up_at: Optional[float] = None
+        self.started_at = time.monotonic()
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def lag_seconds(self) -> float:
+        if self.lag_changes == 0 and self.caught_up_at is not None:
+            return 0.0
+        return time.monotonic() - (self.caught_up_at or self.started_at)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="replication", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _get(self, client, path: str, **params) -> Dict[str, Any]:
+        from .cluster import SECRET_HEADER
+
+        resp = client.get(self.primary + path, params=params, headers={SECRET_HEADER: config.CLUSTER_SECRET})
+        resp.raise_for_status()
+        return resp.json()
+
+    def sync_once(self, client) -> int:
+        """Pull and apply everything new on the primary; returns the changes applied."""
+        from . import metrics
+
+        applied = 0
+        while True:
+            log = change_log()
+            since = log.head_seq
+            page = self._get(client, "/replication/changes", since=since, limit=config.REPLICATION_BATCH)
+            if page["changes"] is None or not log.bootstrapped:
+                # brand new, or too far behind the primary's retained log: start from a snapshot
+                snap = self._get(client, "/replication/snapshot")
+                apply_snapshot(snap)
+                metrics.REPLICATION_SNAPSHOTS.inc()
+                LOG.info("replica bootstrapped from snapshot at seq %s", snap["seq"])
+                continue
+            if page["changes"]:
+                applied += len(page["changes"])
+                apply_changes(page["changes"])
+                metrics.REPLICATION_APPLIED.inc(len(page["changes"]))
+            self.lag_changes = max(0, int(page["head_seq"]) - change_log().head_seq)
+            if self.lag_changes == 0:
+                self.caught_up_at = time.monotonic()
+                return applied
+
+    def _run(self) -> None:
+        import httpx
+
+        from . import metrics
+
+        with httpx.Client(timeout=config.REPLICATION_TIMEOUT_SECONDS) as client:
+            while not self._stop.is_set():
+                try:
+                    self.sync_once(client)
+                    self.last_error = None
+                except Exception as exc:
+                    metrics.REPLICATION_ERRORS.inc()
+                    if str(exc) != self.last_error:
+                        LOG.warning("replication from %s failed: %s", self.primary, exc)
+                    self.last_error = str(exc)
+                self._stop.wait(config.REPLICATION_POLL_SECONDS)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "primary": self.primary,
+            "applied_seq": change_log().head_seq,
+            "lag_changes": self.lag_changes,
+            "lag_seconds": round(self.lag_seconds(), 3),
+            "last_error": self.last_error,
+        }
+
+
+replicator: Optional[Replicator] = None
+
+
+def start() -> None:
+    """Start pulling from REPLICATION_PRIMARY (no-op on a primary)."""
+    global replicator
+    if is_replica() and replicator is None:
+        replicator = Replicator(config.REPLICATION_PRIMARY)
+        replicator.start()
+
+
+def stop() -> None:
+    global replicator
+    if replicator is not None:
+        replicator.stop()
+        replicator = None
+
+
+def status() -> Dict[str, Any]:
+    if replicator is not None:
+        return dict(replicator.status(), role="replica")
+    return {"role": "primary", "head_seq": change_log().head_seq}
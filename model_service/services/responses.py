@@ -0,0 +1,79 @@
+"""Typed response schema and content negotiation for model endpoints.
+
+Match payloads are declared as TypedDicts and serialised with pydantic-core's
+schema-driven encoder (no per-field Python walk). Clients that send
+``Accept: application/msgpack`` get msgpack instead when the optional
+``msgpack`` package is installed.
+"""
+from typing import Any, List
+
+from typing_extensions import TypedDict
+
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import TypeAdapter
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+class FaceMatch(TypedDict):
+    identity: str
+    distance: float
+    confidence: float
+    source_x: int
+    source_y: int
+    source_w: int
+    source_h: int
+
+
+# /recognise: one list per detected face, holding its best matches (up to top_k, nearest first) or nothing
+RecogniseResult = List[List[FaceMatch]]
+
+
+class VerifyResult(TypedDict):
+    identity: str
+    verified: bool
+    distance: float
+    threshold: float
+    confidence: float
+    enrolled_embeddings: int
+    source_x: int
+    source_y: int
+    source_w: int
+    source_h: int
+
+_adapters = {}
+
+
+def _adapter(schema) -> TypeAdapter:
+    ad = _adapters.get(schema)
+    if ad is None:
+        ad = _adapters[schema] = TypeAdapter(schema)
+    return ad
+
+
+def wants_msgpack(request: Request) -> bool:
+    if msgpack is None:
+        return False
+    accept = request.headers.get("accept", "")
+    return any(mt in accept for mt in MSGPACK_MEDIA_TYPES)
+
+
+def render(request: Request, content: Any, schema=None, status_code: int = 200) -> Response:
+    """Encode `content` as msgpack or JSON depending on the request's Accept header."""
+    headers = {"Vary": "Accept"}
+    if wants_msgpack(request):
+        return Response(
+            msgpack.packb(content, use_bin_type=True),
+            status_code=status_code,
+            media_type="application/msgpack",
+            headers=headers,
+        )
+    body = _adapter(schema).dump_json(content) if schema is not None else _adapter(Any).dump_json(content)
+    return Response(body, status_code=status_code, media_type="application/json", headers=headers)
@@ -0,0 +1,22 @@
+import os
+import shutil
+import tempfile
+
+_run_dir = None
+
+
+def pytest_configure(config):
+    """Keep the auth database and log file of a test run out of the repository.
+
+    model_service reads both paths once at import, so they are set here, before
+    any test module imports it.
+    """
+    global _run_dir
+    _run_dir = tempfile.mkdtemp(prefix="model_service_tests_")
+    os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{os.path.join(_run_dir, 'auth.db')}"
+    os.environ["LOG_FILE"] = os.path.join(_run_dir, "model_service.log")
+
+
+def pytest_unconfigure(config):
+    if _run_dir:
+        shutil.rmtree(_run_dir, ignore_errors=True)
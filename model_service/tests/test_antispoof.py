@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service.services import antispoof, fake_backend, pipeline, recognizer
+from model_service.services.gallery import GalleryIndex
+
+
+class CountingSpoofModel:
+    def __init__(self, real=True):
+        self.real = real
+        self.calls = []
+
+    def analyze(self, img, facial_area):
+        self.calls.append(facial_area)
+        return self.real, 0.9
+
+
+class FixedGallery:
+    path = "memory"
+
+    def __init__(self, records):
+        self.index = GalleryIndex.from_records(records)
+
+    def refresh(self):
+        return self.index
+
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    monkeypatch.setattr(pipeline.config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(pipeline.config, "ANTI_SPOOFING", True)
+    monkeypatch.setattr(pipeline.config, "FAKE_FACES_PER_FRAME", 2)
+    monkeypatch.setattr(pipeline.config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(pipeline, "search_threshold", lambda: 0.4)
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    antispoof.verdict_cache.clear()
+
+    frame = tmp_path / "frame.jpg"
+    frame.write_bytes(b"frame-bytes")
+    # enroll only the frame's first face
+    face0 = fake_backend.detection.extract_faces(img_path=str(frame))[0]
+    emb = fake_backend.FakeRecognizer().embed(fake_backend.FakeRecognizer().preprocess([face0["face"]]))[0]
+    monkeypatch.setattr("model_service.services.gallery.get_gallery", lambda shard=None: FixedGallery([{"identity": "alice", "embedding": emb}]))
+
+    model = CountingSpoofModel()
+    monkeypatch.setattr(fake_backend.modeling, "build_model", lambda task, model_name: model)
+    return str(frame), model
+
+
+def test_only_matched_faces_are_spoof_checked_and_verdicts_cached(fake):
+    frame, model = fake
+    res = pipeline.recognise(frame)
+    assert [len(r) for r in res] == [1, 0]
+    assert model.calls == [(0, 0, 96, 96)]
+
+    pipeline.recognise(frame)
+    assert len(model.calls) == 1  # second frame served from the verdict cache
+
+
+def test_spoof_on_matched_face_raises(fake):
+    frame, model = fake
+    model.real = False
+    with pytest.raises(ValueError, match="Spoof detected"):
+        pipeline.recognise(frame)
+
+
+def test_verdict_cache_expires_and_snaps_to_grid(monkeypatch):
+    cache = antispoof.VerdictCache(ttl_seconds=1.0, max_entries=10, grid_px=16)
+    now = [100.0]
+    monkeypatch.setattr(antispoof.time, "monotonic", lambda: now[0])
+    cache.put(cache.key("a", {"x": 33, "y": 40, "w": 60, "h": 60}), (True, 0.9))
+    assert cache.get(cache.key("a", {"x": 35, "y": 44, "w": 62, "h": 63})) == (True, 0.9)
+    assert cache.get(cache.key("b", {"x": 35, "y": 44, "w": 62, "h": 63})) is None
+    now[0] += 1.5
+    assert cache.get(cache.key("a", {"x": 33, "y": 40, "w": 60, "h": 60})) is None
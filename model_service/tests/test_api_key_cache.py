@@ -0,0 +1,88 @@
+import base64
+import io
+import os
+import sys
+import time
+import uuid
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import model_service.main as main_mod
+from model_service.services import auth as auth_srv
+from model_service.services import pipeline
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def test_cache_respects_ttl_key_expiry_and_size():
+    cache = auth_srv.ApiKeyCache(max_entries=2, ttl_seconds=60)
+    cache.put(auth_srv.ApiKeyPrincipal("a", 1, None))
+    cache.put(auth_srv.ApiKeyPrincipal("b", 1, time.time() - 1))  # key already expired
+    assert cache.get("a").user_id == 1
+    assert cache.get("b") is None
+
+    cache.put(auth_srv.ApiKeyPrincipal("c", 1, None))
+    cache.put(auth_srv.ApiKeyPrincipal("d", 1, None))
+    assert cache.get("a") is None  # evicted as least recently used
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] >= 1
+    assert 0 < stats["hit_rate"] < 1
+
+
+def test_revocation_invalidates_cached_key(monkeypatch):
+    monkeypatch.setattr(main_mod.deepface_service, "DeepFace", object())
+    monkeypatch.setattr(main_mod.deepface_service, "ensure_deepface", lambda: None)
+    monkeypatch.setattr(pipeline, "recognise", lambda img_path, *args: [])
+    client = TestClient(main_mod.app)
+
+    username = "cache_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    key = client.post("/apikey/create", data={"username": username, "password": "pw"}).json()["api_key"]
+    body = {"image_b64": base64.b64encode(_jpeg()).decode()}
+
+    assert client.post("/recognise", json=body, headers={"X-API-KEY": key}).status_code == 200
+    hits = auth_srv.api_key_cache.hits
+    assert client.post("/recognise", json=body, headers={"X-API-KEY": key}).status_code == 200
+    assert auth_srv.api_key_cache.hits == hits + 1
+
+    r = client.post("/apikey/revoke", data={"username": username, "password": "pw", "api_key": key})
+    assert r.status_code == 200
+    assert client.post("/recognise", json=body, headers={"X-API-KEY": key}).status_code == 401
+
+
+
+def test_revocation_by_another_process_reaches_this_cache(monkeypatch):
+    monkeypatch.setattr(main_mod.deepface_service, "DeepFace", object())
+    monkeypatch.setattr(main_mod.deepface_service, "ensure_deepface", lambda: None)
+    monkeypatch.setattr(pipeline, "recognise", lambda img_path, *args: [])
+    monkeypatch.setattr(auth_srv.config, "API_KEY_REVOCATION_POLL_SECONDS", 0)
+    monkeypatch.setattr(auth_srv, "_revocations_next_poll", 0.0)
+    client = TestClient(main_mod.app)
+
+    username = "xproc_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    key = client.post("/apikey/create", data={"username": username, "password": "pw"}).json()["api_key"]
+    body = {"image_b64": base64.b64encode(_jpeg()).decode()}
+    assert client.post("/recognise", json=body, headers={"X-API-KEY": key}).status_code == 200
+
+    # another worker revokes it: the DB changes, this process's cache is not touched
+    db = auth_srv.SessionLocal()
+    try:
+        db.query(auth_srv.ApiKey).filter(auth_srv.ApiKey.key == key).update({"revoked": True})
+        db.add(auth_srv.ApiKeyRevocation(key=key))
+        db.commit()
+    finally:
+        db.close()
+    assert auth_srv.api_key_cache.get(key) is not None
+
+    assert client.post("/recognise", json=body, headers={"X-API-KEY": key}).status_code == 401
+    assert auth_srv.api_key_cache.get(key) is None
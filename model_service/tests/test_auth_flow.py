@@ -11,8 +11,17 @@ if repo_root not in sys.path:
     sys.path.insert(0, repo_root)
 
 from fastapi.testclient import TestClient
+from PIL import Image
 
 import model_service.main as main_mod
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buf, "JPEG")
+    return buf.getvalue()
+
+
 @pytest.fixture(autouse=True)
 def patch_deepface(monkeypatch):
     # Replace heavy DeepFace behaviors with lightweight stubs for tests
@@ -77,7 +86,7 @@ def test_register_login_and_protected_detect(tmp_path):
     api_key = r.json()["api_key"]
 
     # Call protected detect endpoint
-    files = {"img1": ("a.jpg", io.BytesIO(b"\xff\xd8\xff"), "image/jpeg"), "img2": ("b.jpg", io.BytesIO(b"\xff\xd8\xff"), "image/jpeg")}
+    files = {"img1": ("a.jpg", io.BytesIO(_jpeg()), "image/jpeg"), "img2": ("b.jpg", io.BytesIO(_jpeg()), "image/jpeg")}
     headers = {"X-API-KEY": api_key, "Authorization": f"Bearer {access}"}
     r = client.post("/detect", files=files, headers=headers)
     assert r.status_code == 200
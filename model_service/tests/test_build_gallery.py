@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import build_gallery, config
+from model_service.services import arcface_refresh, crop_store, fake_backend, gallery, recognizer
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(config, "KEEP_ENROLLMENT_CROPS", True)
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path / "db"))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "db" / "default.pkl"))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setattr(crop_store, "_stores", {})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    photos = tmp_path / "photos"
+    for identity in ("2022001", "2022002", "2022003"):
+        for i in range(2):
+            (photos / identity).mkdir(parents=True, exist_ok=True)
+            (photos / identity / f"{i}.jpg").write_bytes(f"{identity}-{i}".encode())
+    return tmp_path
+
+
+def test_build_resumes_after_interruption_without_duplicates(db, monkeypatch):
+    real = build_gallery.process_batch
+    calls = []
+
+    def interrupted(job):
+        calls.append(job)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return real(job)
+
+    monkeypatch.setattr(build_gallery, "process_batch", interrupted)
+    args = ["--images", str(db / "photos"), "--shard", "CSE/sem5", "--workers", "0", "--batch-size", "2", "--checkpoint", "2"]
+    assert build_gallery.main(args) == 130
+    assert len(arcface_refresh.load_db("CSE/sem5")) == 4
+
+    monkeypatch.setattr(build_gallery, "process_batch", real)
+    assert build_gallery.main(args) == 0
+    records = arcface_refresh.load_db("CSE/sem5")
+    assert sorted(r["identity"] for r in records) == ["2022001", "2022001", "2022002", "2022002", "2022003", "2022003"]
+    assert len({r["hash"] for r in records}) == 6
+    assert len(crop_store.store("CSE/sem5")) == 6
+    # the resident index reads the file as /refresh-db writes it
+    assert gallery.get_gallery("CSE/sem5").refresh().identities.shape == (6,)
+
+
+def test_manifest_shards_and_failures(db):
+    manifest = db / "photos.csv"
+    manifest.write_text("path,identity,shard\nphotos/2022001/0.jpg,2022001,\nphotos/2022002/0.jpg,2022002,ECE/sem3\nphotos/missing.jpg,2022009,\n")
+    assert build_gallery.main(["--manifest", str(manifest), "--workers", "0"]) == 0
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["2022001"]
+    assert [r["identity"] for r in arcface_refresh.load_db("ECE/sem3")] == ["2022002"]
+    with pytest.raises(SystemExit):
+        build_gallery.main(["--images", str(db / "photos"), "--workers", "0"])  # the state belongs to the manifest
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import pickle
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service.services import cluster, gallery, inference_queue, pipeline
+
+PEERS = ["http://peer0", "http://peer1"]
+
+
+class FakePeers:
+    """Stands in for the HTTP hop: each peer answers from its own records, like /cluster/search would."""
+
+    def __init__(self, records_by_peer, down=()):
+        self.indexes = {p: gallery.GalleryIndex.from_records(r) for p, r in records_by_peer.items()}
+        self.down = set(down)
+        self.calls = []
+        self.busy_workers = []
+
+    async def post(self, peer, path, payload, timeout):
+        self.calls.append((peer, path))
+        self.busy_workers.append(inference_queue.inference_queue.busy)
+        if peer in self.down:
+            raise cluster.PeerUnavailable(peer, TimeoutError("timed out"))
+        if path == "/cluster/verify":
+            distance, count = gallery.identity_distance([self.indexes[peer]], np.asarray([payload["embedding"]]), payload["identity"])
+            return {"distance": distance, "enrolled": count}
+        ids, dist = gallery.top_k_many([self.indexes[peer]], np.asarray(payload["embeddings"]), payload["k"])
+        found = np.isfinite(dist)
+        return {"identities": [i[f].tolist() for i, f in zip(ids, found)], "distances": [d[f].tolist() for d, f in zip(dist, found)]}
+
+
+@pytest.fixture
+def coordinator(monkeypatch):
+    monkeypatch.setattr(cluster.config, "CLUSTER_PEERS", PEERS)
+    monkeypatch.setattr(cluster.config, "CLUSTER_PARTITION_BY", "identity")
+    monkeypatch.setattr(pipeline, "search_threshold", lambda: 0.4)
+    monkeypatch.setattr(pipeline, "load_scaled", lambda img_path, max_side=0: (np.zeros((10, 10, 3), dtype=np.uint8), 1.0))
+    monkeypatch.setattr(pipeline, "check_spoof", lambda img, objs, identities: None)
+    monkeypatch.setattr(pipeline, "detect_faces", lambda img_path, img=None: [{"facial_area": {"x": 0, "y": 0, "w": 10, "h": 10}}])
+    monkeypatch.setattr(pipeline, "embed_faces", lambda objs: np.array([[1.0, 0.05, 0.0]], dtype=np.float32))
+    return monkeypatch
+
+
+def test_coordinator_merges_top_k_from_every_partition(coordinator):
+    peers = FakePeers(
+        {
+            "http://peer0": [{"identity": "a", "embedding": [1.0, 0.0, 0.0]}, {"identity": "x", "embedding": [0.0, 1.0, 0.0]}],
+            "http://peer1": [{"identity": "b", "embedding": [1.0, 0.2, 0.0]}, {"identity": "c", "embedding": [1.0, 0.4, 0.0]}],
+        }
+    )
+    coordinator.setattr(cluster, "_post_async", peers.post)
+
+    res = asyncio.run(pipeline.recognise_on_peers("probe.jpg", None, 3))
+    assert [m["identity"] for m in res[0]] == ["a", "b", "c"]
+    assert res[0][0]["distance"] < res[0][1]["distance"] < res[0][2]["distance"]
+    assert sorted(p for p, _ in peers.calls) == PEERS
+    assert [m["identity"] for m in asyncio.run(pipeline.recognise_on_peers("probe.jpg"))[0]] == ["a"]
+    # the peers are awaited on the event loop, after the worker has handed back the embeddings
+    assert peers.busy_workers == [0] * len(peers.calls)
+
+
+def test_coordinator_verifies_on_the_owning_peer(coordinator):
+    records = [{"identity": "a", "embedding": [1.0, 0.0, 0.0]}, {"identity": "a", "embedding": [0.0, 1.0, 0.0]}]
+    owner = PEERS[cluster.partition_of("a")]
+    peers = FakePeers({p: records if p == owner else [] for p in PEERS})
+    coordinator.setattr(cluster, "_post_async", peers.post)
+
+    res = asyncio.run(pipeline.verify_on_peers("probe.jpg", "a"))
+    assert res["verified"] is True and res["enrolled_embeddings"] == 2
+    assert peers.calls == [(owner, "/cluster/verify")] and peers.busy_workers == [0]
+    with pytest.raises(LookupError):
+        asyncio.run(pipeline.verify_on_peers("probe.jpg", "nobody"))
+
+
+def test_unreachable_partition_fails_the_search(coordinator):
+    peers = FakePeers({"http://peer0": [{"identity": "a", "embedding": [1.0, 0.0, 0.0]}], "http://peer1": []}, down={"http://peer1"})
+    coordinator.setattr(cluster, "_post_async", peers.post)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(pipeline.recognise_on_peers("probe.jpg"))
+    assert exc.value.status_code == 503
+
+
+def test_shard_partitioning_only_asks_the_owning_peers(coordinator):
+    coordinator.setattr(cluster.config, "CLUSTER_PARTITION_BY", "shard")
+    owner = cluster.partition_of("anyone", "CSE/sem5")
+    assert owner == cluster.partition_of("someone-else", "CSE/sem5")
+    peers = FakePeers({p: [] for p in PEERS})
+    coordinator.setattr(cluster, "_post_async", peers.post)
+    asyncio.run(cluster.search(np.ones((1, 3)), ["CSE/sem5"], 1))
+    assert peers.calls == [(PEERS[owner], "/cluster/search")]
+
+
+def test_peer_endpoint_requires_secret_and_searches_local_shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(main_mod.config, "CLUSTER_SECRET", "s3cret")
+    monkeypatch.setattr(main_mod.config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    path = gallery.shard_path("CSE/sem5")
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        pickle.dump([{"identity": "a", "embedding": [1.0, 0.0]}, {"identity": "b", "embedding": [0.0, 1.0]}], f)
+    client = TestClient(main_mod.app)
+    body = {"embeddings": [[1.0, 0.1]], "shards": ["CSE/sem5"], "k": 5}
+
+    assert client.post("/cluster/search", json=body).status_code == 403
+    assert client.post("/cluster/search", json=body, headers={"X-Cluster-Secret": "wrong"}).status_code == 403
+    r = client.post("/cluster/search", json=body, headers={"X-Cluster-Secret": "s3cret"})
+    assert r.status_code == 200
+    assert r.json()["identities"] == [["a", "b"]]
+    r = client.post("/cluster/search", json=dict(body, shards=["../x"]), headers={"X-Cluster-Secret": "s3cret"})
+    assert r.status_code == 400
+    for k in ("five", None, [5]):
+        r = client.post("/cluster/search", json=dict(body, k=k), headers={"X-Cluster-Secret": "s3cret"})
+        assert r.status_code == 400
+
+
+def test_peer_endpoints_refuse_malformed_bodies(monkeypatch):
+    monkeypatch.setattr(main_mod.config, "CLUSTER_SECRET", "s3cret")
+    client = TestClient(main_mod.app)
+    headers = {"X-Cluster-Secret": "s3cret"}
+    bad = [
+        ("/cluster/search", {"shards": [None], "k": 1}),
+        ("/cluster/search", {"embeddings": "abc"}),
+        ("/cluster/search", {"embeddings": [[1.0, 0.0], [1.0]]}),
+        ("/cluster/search", {"embeddings": [[1.0, 0.0]], "shards": "CSE/sem5"}),
+        ("/cluster/verify", {"embedding": [1.0, 0.0]}),
+        ("/cluster/verify", {"identity": "a", "embedding": [["x"]]}),
+        ("/cluster/enroll", {"identity": "a"}),
+        ("/cluster/enroll", {"identity": "a", "records": ["x"]}),
+        ("/cluster/enroll", ["not", "an", "object"]),
+    ]
+    for path, body in bad:
+        assert client.post(path, json=body, headers=headers).status_code == 400, (path, body)
+
+
+def test_async_client_is_closed_when_the_loop_changes_and_on_shutdown(monkeypatch):
+    monkeypatch.setattr(cluster, "_async_client", None)
+    monkeypatch.setattr(cluster, "_async_loop", None)
+
+    async def client():
+        return cluster._async_http()
+
+    old_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=old_loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        first = asyncio.run_coroutine_threadsafe(client(), old_loop).result(5)
+
+        async def switch_and_shut_down():
+            second = cluster._async_http()
+            assert second is not first and cluster._async_http() is second
+            await cluster.aclose()
+            return second
+
+        second = asyncio.run(switch_and_shut_down())
+        asyncio.run_coroutine_threadsafe(asyncio.sleep(0), old_loop).result(5)  # let the scheduled close run
+        assert first.is_closed and second.is_closed
+        assert cluster._async_client is None
+    finally:
+        old_loop.call_soon_threadsafe(old_loop.stop)
+        thread.join(5)
+        old_loop.close()
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi import HTTPException
+
+from model_service.services import deadline, metrics
+from model_service.services import inference_queue as iq
+
+
+class FakeRequest:
+    def __init__(self, headers=None, disconnect_after=None):
+        self.headers = headers or {}
+        self.state = type("State", (), {})()
+        self.polls = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.polls += 1
+        return self.disconnect_after is not None and self.polls >= self.disconnect_after
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    q = iq.InferenceQueue(workers=1, max_queue=4)
+    monkeypatch.setattr(iq, "inference_queue", q)
+    monkeypatch.setattr(iq.config, "DISCONNECT_POLL_SECONDS", 0.01)
+    return q
+
+
+def test_from_headers_and_check():
+    assert deadline.from_headers({}).expires_at is None
+    assert deadline.from_headers({"x-request-deadline-ms": "junk"}).expires_at is None
+    assert 9.0 < deadline.from_headers({"x-request-deadline-ms": "10000"}).remaining() <= 10.0
+
+    before = metrics.INFERENCE_SKIPPED.value(stage="search")
+    with deadline.bound(deadline.Deadline(0)):
+        with pytest.raises(deadline.DeadlineExceeded):
+            deadline.check("search")
+    assert metrics.INFERENCE_SKIPPED.value(stage="search") == before + 1
+    deadline.check("search")  # no deadline outside a request
+
+
+def test_expired_request_is_skipped_without_running(queue):
+    ran = []
+    before = metrics.INFERENCE_SKIPPED.value(stage="queue")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(iq.run_inference("recognise", ran.append, 1, request=FakeRequest({"x-request-deadline-ms": "0"})))
+    assert exc.value.status_code == 504
+    assert ran == []
+    assert metrics.INFERENCE_SKIPPED.value(stage="queue") == before + 1
+
+
+def test_disconnect_cancels_running_work_at_next_checkpoint(queue):
+    reached = threading.Event()
+    gate = threading.Event()
+    outcome = []
+
+    def work():
+        reached.set()
+        gate.wait(5)
+        try:
+            deadline.check("represent")
+            outcome.append("finished")
+        except deadline.DeadlineExceeded as exc:
+            outcome.append(exc.stage)
+            raise
+
+    async def scenario():
+        request = FakeRequest(disconnect_after=3)
+        with pytest.raises(HTTPException) as exc:
+            await iq.run_inference("recognise", work, request=request)
+        assert exc.value.status_code == 499
+        gate.set()
+        while queue.busy:
+            await asyncio.sleep(0.01)
+
+    before = metrics.INFERENCE_CANCELLED.value(stage="represent")
+    asyncio.run(scenario())
+    assert reached.is_set()
+    assert outcome == ["represent"]
+    assert metrics.INFERENCE_CANCELLED.value(stage="represent") == before + 1
+
+
+def test_one_budget_for_every_entry_of_a_request(queue):
+    request = FakeRequest({"x-request-deadline-ms": "50"})
+    ran = []
+
+    async def scenario():
+        # e.g. /refresh-db: one queue entry per image, the first one slow
+        await iq.run_inference("enroll", lambda: (time.sleep(0.08), ran.append(1)), request=request)
+        with pytest.raises(HTTPException) as exc:
+            await iq.run_inference("enroll", ran.append, 2, request=request)
+        assert exc.value.status_code == 504
+
+    asyncio.run(scenario())
+    assert ran == [1]
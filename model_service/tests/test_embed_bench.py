@@ -0,0 +1,25 @@
+import os
+import sys
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import config
+from model_service.benchmarks import embed_bench
+from model_service.services import fake_backend, recognizer
+
+
+def test_batching_cuts_forward_passes_and_per_face_latency(monkeypatch):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_COST_MODE", "sleep")
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {"represent": 2.0, "represent_per_face": 0.1})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+
+    report = embed_bench.run(faces=16, batch_sizes=[1, 4, 16], repeats=2)
+    rows = {r["batch_size"]: r for r in report["results"]}
+    assert [rows[b]["forward_passes"] for b in (1, 4, 16)] == [16, 4, 1]
+    # 16 x (2 + 0.1) ms one face at a time vs 2 + 1.6 ms in one pass
+    assert rows[16]["per_face_ms"] < rows[4]["per_face_ms"] < rows[1]["per_face_ms"]
+    assert report["variant"] == "fake"
+    assert "embed" not in vars(recognizer.get_active())  # the pass counter is removed again
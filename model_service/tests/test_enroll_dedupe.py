@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import config
+from model_service.services import arcface_refresh, crop_store, face_detection, fake_backend, gallery, recognizer
+
+
+@pytest.fixture
+def detections(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(config, "FAKE_FACES_PER_FRAME", 2)
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "default.pkl"))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setattr(crop_store, "_stores", {})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    calls = []
+    real = face_detection.detect
+
+    def counting(*args, **kwargs):
+        calls.append(1)
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(face_detection, "detect", counting)
+    return calls
+
+
+def test_exact_reuploads_are_skipped_before_inference(detections):
+    first = arcface_refresh.add_faces_from_uploads([b"photo-a", b"photo-b"], "2022001", shard="CSE/sem5")
+    assert [r["status"] for r in first] == ["success", "success"]
+    assert len(detections) == 2
+
+    # a retry after a partial failure re-sends both photos plus a new one
+    again = arcface_refresh.add_faces_from_uploads([b"photo-a", b"photo-b", b"photo-c"], "2022001", shard="CSE/sem5")
+    assert [r["status"] for r in again] == ["duplicate", "duplicate", "success"]
+    assert len(detections) == 3
+    records = arcface_refresh.load_db("CSE/sem5")
+    assert len(records) == 6  # two faces per photo, each photo once
+    assert len({r["hash"] for r in records}) == 3
+
+    # the same photo for someone else is not a duplicate
+    assert arcface_refresh.add_faces_from_uploads([b"photo-a"], "2022002", shard="CSE/sem5")[0]["status"] == "success"
+
+
+def test_append_drops_rows_already_enrolled(detections):
+    rec = {"identity": "a", "embedding": [1.0, 0.0], "hash": "h1"}
+    assert arcface_refresh.append_records([rec]) == 1
+    assert arcface_refresh.append_records([rec, dict(rec, hash="h2")]) == 1
+    assert [r["hash"] for r in arcface_refresh.load_db()] == ["h1", "h2"]
+
+
+def test_append_checks_duplicates_without_reloading_the_pkl(detections, monkeypatch):
+    import pickle
+
+    rec = {"identity": "a", "embedding": [1.0, 0.0], "hash": "h1"}
+    arcface_refresh.append_records([rec], "CSE/batch2022")
+    loads, real = [], pickle.load
+    monkeypatch.setattr(pickle, "load", lambda f: loads.append(f.name) or real(f))
+
+    assert arcface_refresh.append_records([rec], "CSE/batch2022") == 0
+    assert loads == []  # answered from the resident index
+    assert arcface_refresh.append_records([dict(rec, hash="h2")], "CSE/batch2022") == 1
+    assert len(loads) == 1  # only the write reads the shard
+    assert [r["hash"] for r in arcface_refresh.load_db("CSE/batch2022")] == ["h1", "h2"]
+
+
+def test_refresh_db_keeps_partial_results_when_the_queue_fills(detections, monkeypatch):
+    import uuid
+
+    import model_service.main as main_mod
+    from model_service.routes import refresh_db as route
+
+    real, calls = route.run_inference, []
+
+    async def filling(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise HTTPException(503, "Inference queue is full; retry later", headers={"Retry-After": "1"})
+        return await real(*args, **kwargs)
+
+    monkeypatch.setattr(route, "run_inference", filling)
+    client = TestClient(main_mod.app)
+    username = "dd_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    headers = {"X-API-KEY": client.post("/apikey/create", data={"username": username, "password": "pw"}).json()["api_key"]}
+    photos = [("files", (f"{i}.jpg", f"photo-{i}".encode(), "image/jpeg")) for i in range(3)]
+
+    r = client.post("/refresh-db", data={"identity": "2022001"}, files=photos, headers=headers)
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+    assert [res["status"] for res in r.json()["results"]] == ["success"]
+
+    # the retry re-sends everything; the image already enrolled is skipped
+    r = client.post("/refresh-db", data={"identity": "2022001"}, files=photos, headers=headers)
+    assert [res["status"] for res in r.json()["results"]] == ["duplicate", "success", "success"]
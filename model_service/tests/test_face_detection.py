@@ -0,0 +1,155 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service.services import face_detection, metrics
+
+
+def face(x, y, w, h, conf=0.95):
+    return {"face": np.zeros((2, 2, 3)), "facial_area": {"x": x, "y": y, "w": w, "h": h, "left_eye": None, "right_eye": None}, "confidence": conf}
+
+
+class StubDetection:
+    """extract_faces stand-in returning canned faces per backend and recording the probe sizes."""
+
+    def __init__(self, by_backend):
+        self.by_backend = by_backend
+        self.calls = []
+
+    def extract_faces(self, img_path, detector_backend, **kwargs):
+        self.calls.append((detector_backend, img_path.shape[:2]))
+        faces = self.by_backend.get(detector_backend, [])
+        if not faces:
+            raise ValueError("Face could not be detected.")
+        return [dict(f) for f in faces]
+
+
+@pytest.fixture
+def cascade(monkeypatch):
+    monkeypatch.setitem(face_detection.CASCADES, "test", face_detection.parse_cascade("cheap@400, heavy"))
+    monkeypatch.setattr(face_detection.config, "CASCADE_MIN_FACE_PX", 40)
+    monkeypatch.setattr(face_detection.config, "CASCADE_MIN_CONFIDENCE", 0.8)
+    # nearest-neighbour stand-ins for cv2 / DeepFace cropping
+    monkeypatch.setattr(face_detection, "_resize", lambda img, scale: img[:: int(round(1 / scale)), :: int(round(1 / scale))])
+    monkeypatch.setattr(face_detection, "_crop_faces", lambda detection, img, objs: objs)
+    return np.zeros((800, 1200, 3), dtype=np.uint8)
+
+
+def runs(stage, result):
+    return metrics.DETECTOR_CASCADE_RUNS.value(cascade="test", stage=stage, result=result)
+
+
+def test_parse_cascade():
+    assert face_detection.parse_cascade("yolov8n@640,retinaface") == (
+        face_detection.Stage("yolov8n", 640),
+        face_detection.Stage("retinaface", 0),
+    )
+    with pytest.raises(ValueError):
+        face_detection.parse_cascade("yolov8n@big")
+
+
+def test_cheap_hit_skips_heavy_stage_and_maps_boxes_back(cascade):
+    det = StubDetection({"cheap": [face(30, 20, 50, 60)], "heavy": [face(0, 0, 300, 300)]})
+    before = runs("cheap@400", "hit")
+    objs = face_detection.detect(det, cascade, "test")
+    # ran once, on the 1/3-scale copy; the box is reported in full-resolution pixels
+    assert det.calls == [("cheap", (267, 400))]
+    assert {k: objs[0]["facial_area"][k] for k in "xywh"} == {"x": 90, "y": 60, "w": 150, "h": 180}
+    assert runs("cheap@400", "hit") == before + 1
+
+
+@pytest.mark.parametrize("cheap_faces, result", [([], "miss"), ([face(10, 10, 10, 10)], "below_floor"), ([face(10, 10, 50, 50, conf=0.5)], "below_floor")])
+def test_escalates_on_miss_small_or_unsure_faces(cascade, cheap_faces, result):
+    det = StubDetection({"cheap": cheap_faces, "heavy": [face(5, 5, 60, 60)]})
+    before = runs("cheap@400", result)
+    objs = face_detection.detect(det, cascade, "test")
+    assert [c[0] for c in det.calls] == ["cheap", "heavy"]
+    assert det.calls[1][1] == (800, 1200)
+    assert objs[0]["facial_area"]["w"] == 60
+    assert runs("cheap@400", result) == before + 1
+
+
+def test_keeps_cheap_faces_when_heavy_stage_finds_nothing(cascade):
+    det = StubDetection({"cheap": [face(10, 10, 10, 10)]})
+    objs = face_detection.detect(det, cascade, "test")
+    assert len(objs) == 1 and objs[0]["facial_area"]["w"] == 30
+    assert face_detection.detect(StubDetection({}), cascade, "test") == []
+
+
+def test_a_few_small_faces_do_not_escalate_and_stages_are_merged(cascade, monkeypatch):
+    monkeypatch.setattr(face_detection.config, "CASCADE_ESCALATE_FRACTION", 0.5)
+    large = [face(10, 10, 50, 50), face(100, 10, 50, 50), face(200, 10, 50, 50)]
+    back_row = face(300, 10, 6, 6)  # 18 px at full resolution
+    det = StubDetection({"cheap": large + [back_row], "heavy": [face(0, 0, 300, 300)]})
+    before = runs("cheap@400", "hit")
+    objs = face_detection.detect(det, cascade, "test")
+    assert [c[0] for c in det.calls] == ["cheap"]
+    assert len(objs) == 4
+    assert runs("cheap@400", "hit") == before + 1
+
+    # mostly back-row faces: the heavy stage runs and its faces are merged with
+    # the cheap ones, one box per face
+    small = [face(10, 10, 8, 8), face(100, 10, 8, 8), face(200, 10, 8, 8)]
+    heavy = [face(30, 30, 26, 26, conf=0.97), face(600, 30, 24, 24, conf=0.9)]
+    det = StubDetection({"cheap": small + [face(300, 10, 50, 50)], "heavy": heavy})
+    objs = face_detection.detect(det, cascade, "test")
+    assert [c[0] for c in det.calls] == ["cheap", "heavy"]
+    boxes = sorted((o["facial_area"]["x"], o["facial_area"]["w"]) for o in objs)
+    assert boxes == [(30, 26), (300, 24), (600, 24), (900, 150)]
+
+
+def test_tile_grid_covers_frame_with_overlap():
+    tiles = face_detection.tile_grid(600, 800, 320, 64)
+    assert {t[0] for t in tiles} == {0, 256, 480} and {t[1] for t in tiles} == {0, 256, 280}
+    assert all(x1 - x0 == 320 and y1 - y0 == 320 for x0, y0, x1, y1 in tiles)
+    assert face_detection.tile_grid(200, 300, 320, 64) == [(0, 0, 300, 200)]
+
+
+def test_nms_drops_duplicates_and_partial_edge_boxes():
+    full = face(100, 100, 40, 40, conf=0.9)
+    dup = face(102, 101, 40, 40, conf=0.8)
+    partial = face(100, 100, 18, 40, conf=0.6)  # same face cut by a tile edge
+    other = face(300, 100, 40, 40, conf=0.7)
+    assert face_detection.nms([partial, dup, other, full], 0.4) == [full, other]
+
+
+class Region:
+    def __init__(self, x, y, w, h, confidence=0.9):
+        self.x, self.y, self.w, self.h, self.confidence = x, y, w, h, confidence
+        self.left_eye = self.right_eye = None
+
+
+class TileDetector:
+    """Sees one 20 px face at frame (500, 400) whenever it is fully inside the window."""
+
+    def detect_faces(self, img):
+        h, w = img.shape[:2]
+        x0, y0 = int(img[0, 0, 0]) * 4, int(img[0, 0, 1]) * 4  # window origin encoded in the pixels
+        if x0 <= 500 and y0 <= 400 and 520 <= x0 + w and 420 <= y0 + h and w < 800:
+            return [Region(500 - x0, 400 - y0, 20, 20)]
+        return []
+
+
+class TileModeling:
+    def build_model(self, task, model_name):
+        return TileDetector()
+
+
+def test_tiled_stage_finds_small_face_once(monkeypatch):
+    monkeypatch.setattr(face_detection.config, "DETECTOR_TILE_SIZE", 320)
+    monkeypatch.setattr(face_detection.config, "DETECTOR_TILE_OVERLAP", 64)
+    monkeypatch.setattr(face_detection, "_crop_faces", lambda detection, img, objs: objs)
+    img = np.zeros((600, 800, 3), dtype=np.uint8)
+    for x0, y0, _, _ in face_detection.tile_grid(600, 800, 320, 64):
+        img[y0, x0] = (x0 // 4, y0 // 4, 0)
+
+    stage = face_detection.parse_cascade("yolov8n@tiles")[0]
+    objs = face_detection.run_stage(None, img, stage, TileModeling())
+    # seen by several overlapping tiles (not by the whole-frame pass), merged to one box
+    assert [{k: o["facial_area"][k] for k in "xywh"} for o in objs] == [{"x": 500, "y": 400, "w": 20, "h": 20}]
@@ -0,0 +1,199 @@
+import os
+import pickle
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service.services import gallery as gallery_mod
+from model_service.services import pipeline
+
+
+def _write_pkl(path, rng, identities=20, dim=32):
+    records = []
+    for i in range(identities):
+        records.append({"identity": f"id{i}", "embedding": rng.normal(size=dim).tolist()})
+    records.append({"identity": "no_face", "embedding": None})
+    with open(path, "wb") as f:
+        pickle.dump(records, f)
+    return records
+
+
+def test_search_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "db.pkl")
+    records = _write_pkl(path, rng)
+    gal = gallery_mod.Gallery(path)
+    index = gal.refresh()
+    assert index.size == 20  # row without embedding is dropped
+
+    vectors = np.array([r["embedding"] for r in records[:20]])
+    probes = vectors[[3, 7]] + 0.01 * rng.normal(size=(2, vectors.shape[1]))
+    best, dist = index.search(probes, metric="cosine")
+    assert index.identities[best].tolist() == ["id3", "id7"]
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    p_unit = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+    expected = (1 - p_unit @ unit.T).min(axis=1)
+    assert np.allclose(dist, expected, atol=1e-5)
+
+
+def test_top_k_lists_each_identity_once():
+    rng = np.random.default_rng(1)
+    base = rng.normal(size=(3, 16))
+    # "a" enrolled from three photos, all nearer the probe than anyone else
+    records = [{"identity": "a", "embedding": (base[0] + 0.01 * rng.normal(size=16)).tolist()} for _ in range(3)]
+    records += [{"identity": "b", "embedding": base[1].tolist()}, {"identity": "c", "embedding": base[2].tolist()}]
+    index = gallery_mod.GalleryIndex.from_records(records)
+    probe = base[0][None, :]
+
+    ids, dist = gallery_mod.top_k_many([index], probe, 3, metric="cosine")
+    assert ids[0, 0] == "a"
+    assert sorted(ids[0].tolist()) == ["a", "b", "c"]
+    assert dist[0, 0] == index.top_k(probe, 1, metric="cosine")[1][0, 0]
+
+    # the same identity in two shards (or from two peers) keeps its nearest distance
+    other = gallery_mod.GalleryIndex.from_records([{"identity": "a", "embedding": base[1].tolist()}])
+    ids, dist = gallery_mod.top_k_many([other, index], probe, 5, metric="cosine")
+    assert ids[0].tolist() == ["a", ids[0, 1], ids[0, 2], None, None]
+    assert sorted(ids[0, 1:3].tolist()) == ["b", "c"]
+    assert dist[0, 0] < 0.01 and np.isinf(dist[0, 3:]).all()
+
+
+def test_refresh_picks_up_rewrites(tmp_path):
+    rng = np.random.default_rng(1)
+    path = str(tmp_path / "db.pkl")
+    _write_pkl(path, rng, identities=3)
+    gal = gallery_mod.Gallery(path)
+    gal.refresh()
+    assert gal.size == 3
+    _write_pkl(path, rng, identities=5)
+    gal.invalidate()
+    gal.refresh()
+    assert gal.size == 5
+
+
+def test_confidences_respect_verified_bands():
+    d = np.linspace(0.0, 1.2, 50)
+    verified = d <= 0.4
+    conf = gallery_mod.find_confidences(d, verified, "ArcFace", "cosine")
+    assert (conf[verified] >= 51).all() and (conf[verified] <= 100).all()
+    assert (conf[~verified] <= 49).all() and (conf[~verified] >= 0).all()
+    assert np.all(np.diff(conf[verified]) <= 0)
+
+
+def test_materialise_emits_slim_records(monkeypatch):
+    monkeypatch.setattr(pipeline, "search_threshold", lambda: 0.4)
+    source_objs = [
+        {"facial_area": {"x": 1, "y": 2, "w": 3, "h": 4}},
+        {"facial_area": {"x": 5, "y": 6, "w": 7, "h": 8}},
+    ]
+    out = pipeline.materialise(source_objs, np.array([1, 0]), np.array([0.2, 0.9]), np.array(["a", "b"], dtype=object))
+    assert out[1] == []
+    assert set(out[0][0]) == {"identity", "distance", "confidence", "source_x", "source_y", "source_w", "source_h"}
+    assert out[0][0]["identity"] == "b"
+    assert out[0][0]["source_w"] == 3
+
+
+def test_verify_compares_only_claimed_identity(tmp_path, monkeypatch):
+    path = str(tmp_path / "db.pkl")
+    records = [
+        {"identity": "alice", "embedding": [1.0, 0.0, 0.0]},
+        {"identity": "alice", "embedding": [0.9, 0.1, 0.0]},
+        {"identity": "bob", "embedding": [0.0, 1.0, 0.0]},
+    ]
+    with open(path, "wb") as f:
+        pickle.dump(records, f)
+    gal = gallery_mod.Gallery(path)
+    monkeypatch.setattr(gallery_mod, "get_gallery", lambda shard=None: gal)
+    monkeypatch.setattr(pipeline, "search_threshold", lambda: 0.4)
+    monkeypatch.setattr(pipeline, "load_scaled", lambda img_path, max_side=0: (np.zeros((10, 10, 3), dtype=np.uint8), 1.0))
+    monkeypatch.setattr(pipeline, "check_spoof", lambda img, objs, identities: None)
+    monkeypatch.setattr(pipeline, "detect_faces", lambda img_path, img=None: [{"facial_area": {"x": 0, "y": 0, "w": 10, "h": 10}}])
+    monkeypatch.setattr(pipeline, "embed_faces", lambda objs: np.array([[0.0, 1.0, 0.0]], dtype=np.float32))
+
+    res = pipeline.verify("probe.jpg", "alice")
+    assert res["verified"] is False
+    assert res["enrolled_embeddings"] == 2
+    assert pipeline.verify("probe.jpg", "bob")["verified"] is True
+
+    import pytest
+
+    with pytest.raises(LookupError):
+        pipeline.verify("probe.jpg", "carol")
+
+
+def _write_shard(shard, records):
+    path = gallery_mod.shard_path(shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(records, f)
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(gallery_mod.config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(gallery_mod.config, "ARC_PKL_PATH", str(tmp_path / "default.pkl"))
+    monkeypatch.setattr(gallery_mod.config, "GALLERY_SEARCH_DEFAULT_SHARD", False)
+    monkeypatch.setattr(gallery_mod, "_galleries", {})
+    return tmp_path
+
+
+def test_shard_names_and_selector(shards, monkeypatch):
+    assert gallery_mod.shard_path("CSE/sem5").startswith(str(shards / "shards" / "CSE" / "sem5"))
+    for bad in ("../etc", "CSE/../x", "/abs", "a b"):
+        with pytest.raises(ValueError):
+            gallery_mod.shard_path(bad)
+    assert gallery_mod.parse_shards(None) == [None]
+    assert gallery_mod.parse_shards("CSE/sem5, CSE/sem5,conference/IC25") == ["CSE/sem5", "conference/IC25"]
+    monkeypatch.setattr(gallery_mod.config, "GALLERY_SEARCH_DEFAULT_SHARD", True)
+    assert gallery_mod.parse_shards(["CSE/sem5"]) == ["CSE/sem5", None]
+
+
+def test_recognise_searches_only_selected_shards(shards, monkeypatch):
+    _write_shard("CSE/sem5", [{"identity": "cse", "embedding": [1.0, 0.0, 0.0]}])
+    _write_shard("ECE/sem5", [{"identity": "ece", "embedding": [0.0, 1.0, 0.0]}])
+    _write_shard("conference/IC25", [{"identity": "guest_1", "embedding": [0.0, 0.0, 1.0]}])
+    monkeypatch.setattr(pipeline, "search_threshold", lambda: 0.4)
+    monkeypatch.setattr(pipeline, "load_scaled", lambda img_path, max_side=0: (np.zeros((10, 10, 3), dtype=np.uint8), 1.0))
+    faces = [{"facial_area": {"x": 0, "y": 0, "w": 10, "h": 10}}, {"facial_area": {"x": 20, "y": 0, "w": 10, "h": 10}}]
+    monkeypatch.setattr(pipeline, "detect_faces", lambda img_path, img=None: faces)
+    monkeypatch.setattr(pipeline, "embed_faces", lambda objs: np.array([[0.0, 1.0, 0.0], [0.0, 0.1, 1.0]], dtype=np.float32))
+    monkeypatch.setattr(pipeline, "check_spoof", lambda img, objs, identities: None)
+
+    res = pipeline.recognise("probe.jpg", ["CSE/sem5"])
+    assert res == [[], []]
+    res = pipeline.recognise("probe.jpg", ["ECE/sem5", "conference/IC25"])
+    assert [r[0]["identity"] for r in res] == ["ece", "guest_1"]
+    assert set(gallery_mod.resident_shards()) == {"CSE/sem5", "ECE/sem5", "conference/IC25"}
+
+
+def test_idle_shards_are_evicted_but_default_stays(shards, monkeypatch):
+    _write_shard("CSE/sem5", [{"identity": "cse", "embedding": [1.0, 0.0]}])
+    monkeypatch.setattr(gallery_mod.config, "GALLERY_SHARD_IDLE_SECONDS", 60)
+    gallery_mod.get_gallery().refresh()
+    cse = gallery_mod.get_gallery("CSE/sem5")
+    assert cse.refresh().size == 1
+    cse.last_used -= 120
+    gallery_mod.get_gallery(None).last_used -= 120
+    assert gallery_mod.get_gallery("ECE/sem5") is not cse
+    assert set(gallery_mod.resident_shards()) == {"", "ECE/sem5"}
+
+
+def test_enrollment_rewrites_only_its_shard(shards):
+    from model_service.services import arcface_refresh
+
+    _write_shard("ECE/sem5", [{"identity": "ece", "embedding": [0.0, 1.0]}])
+    other = gallery_mod.shard_path("ECE/sem5")
+    before = os.stat(other).st_mtime_ns
+    cse = gallery_mod.get_gallery("CSE/sem5")
+    assert cse.refresh().size == 0
+
+    arcface_refresh.save_db(arcface_refresh.load_db("CSE/sem5") + [{"identity": "cse", "embedding": [1.0, 0.0]}], "CSE/sem5")
+    assert cse.refresh().size == 1
+    assert os.stat(other).st_mtime_ns == before
+    assert not os.path.exists(gallery_mod.config.ARC_PKL_PATH)
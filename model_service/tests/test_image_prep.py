@@ -0,0 +1,50 @@
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import config
+from model_service.services import image_prep
+
+
+def _phone_photo(path):
+    """A 4000x3000 JPEG stored sideways (EXIF orientation 6), with a red block in its stored top-left corner."""
+    img = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    img[:600, :600] = (255, 0, 0)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise to display
+    Image.fromarray(img).save(path, "JPEG", exif=exif, quality=90)
+
+
+def test_decode_applies_exif_and_shrinks_jpegs(tmp_path):
+    path = str(tmp_path / "phone.jpg")
+    _phone_photo(path)
+    img, scale = image_prep.decode(path, max_side=1280)
+    assert img.shape == (1280, 960, 3)  # upright portrait, longer side capped
+    assert scale == pytest.approx(1280 / 4000)
+    # the stored top-left corner is the displayed top-right one; BGR order
+    assert tuple(img[20, -20]) == pytest.approx((0, 0, 255), abs=8)
+    assert image_prep.to_original({"x": 10, "y": 20, "w": 32, "h": 64}, scale) == {"x": 31, "y": 62, "w": 100, "h": 200}
+
+    full, scale = image_prep.decode(path)
+    assert full.shape == (4000, 3000, 3) and scale == 1.0
+
+
+def test_check_reads_only_the_header(tmp_path, monkeypatch):
+    buf = io.BytesIO()
+    Image.new("RGB", (400, 300)).save(buf, "JPEG")
+    assert image_prep.check(buf.getvalue()) == (400, 300)
+    monkeypatch.setattr(config, "IMAGE_MAX_PIXELS", 100_000)
+    with pytest.raises(image_prep.ImageRejected) as exc:
+        image_prep.check(buf.getvalue())
+    assert exc.value.too_large
+    with pytest.raises(image_prep.ImageRejected) as exc:
+        image_prep.check(b"not an image")
+    assert not exc.value.too_large
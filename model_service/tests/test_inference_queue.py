@@ -0,0 +1,119 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi import HTTPException
+
+from model_service.services import inference_queue as iq
+from model_service.services import metrics
+
+
+def test_full_queue_rejects_and_waiters_run_in_order():
+    async def scenario():
+        q = iq.InferenceQueue(workers=1, max_queue=2)
+        gate = threading.Event()
+        order = []
+
+        def work(name):
+            gate.wait(5)
+            order.append(name)
+            return name
+
+        running = asyncio.ensure_future(q.run("recognise", work, "a"))
+        await asyncio.sleep(0.05)
+        waiting = [asyncio.ensure_future(q.run("recognise", work, n)) for n in ("b", "c")]
+        await asyncio.sleep(0.05)
+        assert (q.busy, q.depth) == (1, 2)
+
+        before = metrics.INFERENCE_REJECTED.value(kind="recognise")
+        with pytest.raises(iq.QueueFull) as exc:
+            await q.run("recognise", work, "d")
+        assert exc.value.retry_after >= 1
+        assert metrics.INFERENCE_REJECTED.value(kind="recognise") == before + 1
+
+        gate.set()
+        assert await asyncio.gather(running, *waiting) == ["a", "b", "c"]
+        assert order == ["a", "b", "c"]
+        assert (q.busy, q.depth) == (0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_request_keeps_worker_until_call_returns():
+    async def scenario():
+        q = iq.InferenceQueue(workers=1, max_queue=1)
+        gate = threading.Event()
+        first = asyncio.ensure_future(q.run("recognise", gate.wait, 5))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        await asyncio.sleep(0.05)
+        # the abandoned call is still on the worker
+        assert q.busy == 1
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert q.busy == 0
+
+    asyncio.run(scenario())
+
+
+def test_run_inference_maps_full_queue_to_503(monkeypatch):
+    full = iq.InferenceQueue(workers=1, max_queue=0)
+    full._busy = 1
+    monkeypatch.setattr(iq, "inference_queue", full)
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(iq.run_inference("enroll", lambda: None))
+    assert exc.value.status_code == 503
+    assert exc.value.headers["Retry-After"] == "1"
+
+
+async def _drain(q, jobs):
+    """Hold the single worker, queue `jobs` as (kind, name, flow, weight), then release; returns run order."""
+    gate = threading.Event()
+    order = []
+
+    def work(name):
+        if name == "hold":
+            gate.wait(5)
+        order.append(name)
+
+    tasks = [asyncio.ensure_future(q.run("recognise", work, "hold"))]
+    await asyncio.sleep(0.05)
+    for kind, name, flow, weight in jobs:
+        tasks.append(asyncio.ensure_future(q.run(kind, work, name, flow=flow, weight=weight)))
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+    gate.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    return order[1:], results[1:]
+
+
+def test_priority_classes_then_fair_share_within_class():
+    q = iq.InferenceQueue(workers=1, max_queue=20, priorities={"recognise": 0, "verify": 1, "enroll": 2})
+    jobs = [("enroll", "e1", "bulk", 1.0), ("verify", "v1", "kiosk", 1.0)]
+    jobs += [("recognise", f"a{i}", "hall-a", 1.0) for i in range(4)]
+    jobs += [("recognise", f"b{i}", "hall-b", 1.0) for i in range(2)]
+    order, _ = asyncio.run(_drain(q, jobs))
+    # hall-b's frames interleave with hall-a's backlog; verify and enrollment only run after
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3", "v1", "e1"]
+
+
+def test_weights_skew_the_share():
+    q = iq.InferenceQueue(workers=1, max_queue=20, priorities={"recognise": 0})
+    jobs = [("recognise", f"a{i}", "heavy", 2.0) for i in range(4)] + [("recognise", f"b{i}", "light", 1.0) for i in range(2)]
+    order, _ = asyncio.run(_drain(q, jobs))
+    assert order == ["a0", "b0", "a1", "a2", "b1", "a3"]
+
+
+def test_full_queue_displaces_lower_priority_waiter():
+    q = iq.InferenceQueue(workers=1, max_queue=2, priorities={"recognise": 0, "enroll": 2})
+    jobs = [("enroll", "e1", "bulk", 1.0), ("enroll", "e2", "bulk", 1.0), ("recognise", "r1", "hall", 1.0)]
+    order, results = asyncio.run(_drain(q, jobs))
+    assert order == ["r1", "e1"]
+    assert isinstance(results[1], iq.QueueFull)
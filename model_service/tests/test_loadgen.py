@@ -0,0 +1,39 @@
+import asyncio
+import os
+import sys
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+import httpx
+
+import model_service.main as main_mod
+from model_service import config
+from model_service.benchmarks import loadgen
+from model_service.services import deepface_service, gallery, rate_limiter, recognizer
+
+
+def test_loadgen_against_fake_backend(tmp_path, monkeypatch):
+    pkl = str(tmp_path / "gallery.pkl")
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {"detect": 1.0, "represent_per_face": 0.5})
+    monkeypatch.setattr(deepface_service, "DeepFace", None)
+    monkeypatch.setattr(deepface_service, "DEEPFACE_MODELS", None)
+    monkeypatch.setattr(recognizer, "_active", None)
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", pkl)
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setitem(rate_limiter.limiters, "recognise", rate_limiter.RateLimiter(calls=10000, period=1))
+
+    args = loadgen.build_parser().parse_args(
+        ["--url", "http://model", "--cameras", "2", "--fps", "20", "--duration", "0.5", "--pool", "3", "--enroll-first"]
+    )
+    report = asyncio.run(loadgen.run_load(args, transport=httpx.ASGITransport(app=main_mod.app)))
+
+    rec = report["recognise"]
+    assert rec["scheduled"] >= 10
+    assert rec["completed"] == rec["scheduled"]
+    # every frame comes from the enrolled pool, so all of them match
+    assert rec["status_codes"] == {"200": rec["completed"]}
+    assert rec["p50_ms"] <= rec["p99_ms"]
@@ -0,0 +1,28 @@
+import logging
+import os
+import sys
+import uuid
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from common import log_setup
+
+
+def test_queued_logger_samples_and_formats_key_values(tmp_path):
+    name = "log_setup_test_" + uuid.uuid4().hex[:6]
+    log_file = tmp_path / "svc.log"
+    logger = log_setup.configure_logging(name, log_file=str(log_file), rotate=False)
+
+    for i in range(10):
+        logger.info("frame", extra=log_setup.sampled(5, i=i))
+    logger.warning("frame", extra=log_setup.sampled(5, i="warn"))
+    logger.info("done", extra=log_setup.fields(path="/recognise", ua="curl 8.0"))
+    log_setup.shutdown_logging(name)
+
+    lines = log_file.read_text().splitlines()
+    frames = [l for l in lines if " frame " in l]
+    assert [l.rsplit("i=", 1)[1] for l in frames] == ["0", "5", "warn"]
+    assert lines[-1].endswith('done path=/recognise ua="curl 8.0"')
+    assert logging.getLogger(name).propagate is False
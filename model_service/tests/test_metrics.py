@@ -0,0 +1,43 @@
+import os
+import sys
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+import numpy as np
+
+from model_service.services import fake_backend, metrics, pipeline, recognizer
+
+
+def test_histogram_buckets_are_cumulative():
+    h = metrics.Histogram("t_seconds", "test", ["stage"], buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.5, 3.0):
+        h.observe(v, stage="detect")
+    lines = h.render()
+    assert 't_seconds_bucket{stage="detect",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="detect",le="1"} 3' in lines
+    assert 't_seconds_bucket{stage="detect",le="+Inf"} 4' in lines
+    assert 't_seconds_count{stage="detect"} 4' in lines
+
+
+def test_recognise_times_each_stage(monkeypatch):
+    monkeypatch.setattr(pipeline.config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(pipeline.config, "ANTI_SPOOFING", False)
+    monkeypatch.setattr("model_service.services.gallery.get_gallery", lambda shard=None: _OneRowGallery())
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+
+    stages = ("decode", "detect", "represent", "search")
+    before = {s: (metrics.STAGE_SECONDS.snapshot(stage=s) or (0, 0, 0))[2] for s in stages}
+    pipeline.recognise(__file__)
+    for s, n in before.items():
+        assert metrics.STAGE_SECONDS.snapshot(stage=s)[2] == n + 1
+
+
+class _OneRowGallery:
+    path = "memory"
+
+    def refresh(self):
+        from model_service.services.gallery import GalleryIndex
+
+        return GalleryIndex.from_records([{"identity": "x", "embedding": np.ones(512, dtype=np.float32)}])
@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import quantize
+
+
+def _clustered(rng, identities=5, per_id=4, dim=64):
+    centers = rng.normal(size=(identities, dim))
+    emb = np.repeat(centers, per_id, axis=0) + 0.05 * rng.normal(size=(identities * per_id, dim))
+    labels = [f"id{i}" for i in range(identities) for _ in range(per_id)]
+    return emb.astype(np.float32), labels
+
+
+def test_identical_embeddings_pass_gate():
+    rng = np.random.default_rng(0)
+    emb, labels = _clustered(rng)
+    report = quantize.evaluate(emb, emb.copy(), labels)
+    assert report["recall_at_1_fp32"] == 1.0
+    assert report["recall_drop"] == 0.0
+    assert report["distance_shift_max"] < 1e-5
+    assert quantize.check_gate(report, 0.01, 0.03) == []
+
+
+def test_degraded_embeddings_are_refused():
+    rng = np.random.default_rng(1)
+    emb, labels = _clustered(rng)
+    noisy = emb + 2.0 * rng.normal(size=emb.shape).astype(np.float32)
+    report = quantize.evaluate(emb, noisy, labels)
+    reasons = quantize.check_gate(report, 0.01, 0.03)
+    assert report["recall_drop"] > 0.01
+    assert reasons
+
+
+def test_single_image_identities_cannot_be_gated():
+    rng = np.random.default_rng(2)
+    emb, labels = _clustered(rng, per_id=1)
+    report = quantize.evaluate(emb, emb, labels)
+    assert report["probes"] == 0
+    assert quantize.check_gate(report, 0.01, 0.03)
+
+
+def test_int8_models_from_older_preprocessing_are_not_served(monkeypatch, tmp_path):
+    from model_service import config
+    from model_service.services import recognizer
+
+    monkeypatch.setattr(config, "QUANT_MANIFEST_PATH", str(tmp_path / "manifest.json"))
+    monkeypatch.setattr(config, "QUANT_MODEL_PATH", str(tmp_path / "model.tflite"))
+    (tmp_path / "model.tflite").write_bytes(b"")
+    manifest = quantize.write_manifest({}, active=True, reasons=[])
+    assert recognizer.int8_available()
+
+    # calibrated before crops were flipped to BGR: needs rebuilding
+    del manifest["preprocess_version"]
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+    assert not recognizer.int8_available()
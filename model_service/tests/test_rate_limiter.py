@@ -0,0 +1,74 @@
+import os
+import sys
+import uuid
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service.services import rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_refill_and_idle_expiry():
+    clock = FakeClock()
+    limiter = rate_limiter.RateLimiter(calls=60, period=60, burst=3, shards=4, idle_ttl=30, clock=clock)
+
+    assert [limiter.allow("a") for _ in range(3)] == [True, True, True]
+    retry = limiter.acquire("a")
+    assert retry > 0 and abs(retry - 1.0) < 1e-9  # one token per second
+    assert limiter.allow("b")  # other callers are unaffected
+
+    clock.now += 1.0
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+
+    clock.now += 31
+    limiter.allow("c")  # triggers the sweep on c's shard
+    for k in ("a", "b"):
+        limiter.allow(k)
+    assert len(limiter) == 3  # swept keys come back as fresh full buckets
+
+
+def test_login_returns_429_with_retry_after(monkeypatch):
+    clock = FakeClock()
+    limiter = rate_limiter.RateLimiter(calls=1, period=60, burst=2, clock=clock)
+    monkeypatch.setitem(rate_limiter.limiters, "login", limiter)
+    client = TestClient(main_mod.app)
+
+    data = {"username": "nobody_" + uuid.uuid4().hex[:8], "password": "x"}
+    assert client.post("/login", data=data).status_code == 401
+    assert client.post("/login", data=data).status_code == 401
+    r = client.post("/login", data=data)
+    assert r.status_code == 429
+    assert r.headers["retry-after"] == "60"
+
+
+def test_streams_sharing_an_api_key_get_their_own_buckets(monkeypatch):
+    limiter = rate_limiter.RateLimiter(calls=1, period=60, burst=2, clock=FakeClock())
+    monkeypatch.setitem(rate_limiter.limiters, "recognise", limiter)
+    check = rate_limiter.require_rate_limit("recognise")
+
+    class Req:
+        def __init__(self, **headers):
+            self.headers, self.client = headers, None
+
+    for _ in range(2):
+        check(Req(**{"x-api-key": "k", "x-stream-id": "cam-1"}))
+    with pytest.raises(HTTPException) as exc:
+        check(Req(**{"x-api-key": "k", "x-stream-id": "cam-1"}))
+    assert exc.value.status_code == 429
+    check(Req(**{"x-api-key": "k", "x-stream-id": "cam-2"}))  # another camera on the same key
+    check(Req(**{"x-api-key": "k"}))
@@ -0,0 +1,98 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service import config, rebuild_gallery
+from model_service.services import arcface_refresh, crop_store, fake_backend, gallery, recognizer, replication
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(config, "KEEP_ENROLLMENT_CROPS", True)
+    monkeypatch.setattr(config, "CROP_STORE_CHUNK_ROWS", 2)
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_NAME", "old.pkl")
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "old.pkl"))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setattr(crop_store, "_stores", {})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    return tmp_path
+
+
+def test_crop_store_chunks_and_survives_torn_index(tmp_path):
+    store = crop_store.CropStore(str(tmp_path), chunk_rows=2)
+    crops = [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(3)]
+    store.append([{"identity": f"id{i}", "embedding": [0.0]} for i in range(3)], crops)
+    entries = list(store.entries())
+    assert [(e["chunk"], e["row"]) for e in entries] == [(0, 0), (0, 1), (1, 0)]
+    assert entries[2]["record"] == {"identity": "id2"}
+    assert store.read_chunk(0)[1].max() == 1 and store.read_chunk(1, [0])[0].max() == 2
+    with pytest.raises(ValueError):
+        store.append([{"identity": "x"}], [np.zeros((2, 2, 3), dtype=np.uint8)])
+
+    with open(os.path.join(str(tmp_path), "index.jsonl"), "ab") as f:
+        f.write(b'{"chunk": 1, "ro')  # crash mid-append
+    reopened = crop_store.CropStore(str(tmp_path), chunk_rows=2)
+    assert len(reopened) == 3
+    reopened.append([{"identity": "id3"}], [np.full((4, 4, 3), 3, dtype=np.uint8)])
+    assert [(e["chunk"], e["row"]) for e in reopened.entries()][-1] == (1, 1)
+
+
+def test_rebuild_re_embeds_every_shard_under_the_new_pkl_name(db, monkeypatch):
+    for i in range(3):
+        arcface_refresh.add_face_arcface(f"photo-{i}".encode(), f"id{i}", index=i)
+    arcface_refresh.add_face_arcface(b"photo-cse", "cse1", shard="CSE/sem5")
+    old = {shard: arcface_refresh.load_db(shard) for shard in (None, "CSE/sem5")}
+    assert crop_store.list_shards() == [None, "CSE/sem5"]
+    assert len(crop_store.store(None)) == 3
+    head = replication.change_log().head_seq
+
+    # e.g. a new detector or normalization: a new file name, nothing re-uploaded
+    monkeypatch.setattr(config, "ARC_PKL_NAME", "new.pkl")
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(db / "new.pkl"))
+    assert rebuild_gallery.main(["--workers", "0", "--batch-size", "2"]) == 0
+
+    for shard, records in old.items():
+        rebuilt = arcface_refresh.load_db(shard)
+        assert gallery.shard_path(shard).endswith("new.pkl")
+        assert [r["identity"] for r in rebuilt] == [r["identity"] for r in records]
+        assert [r["hash"] for r in rebuilt] == [r["hash"] for r in records]
+        np.testing.assert_allclose([r["embedding"] for r in rebuilt], [r["embedding"] for r in records], rtol=1e-6)
+    # replicas fall behind the retained log and re-bootstrap
+    assert replication.change_log().base_seq == head + 1
+
+
+def test_rebuild_refuses_to_drop_rows_without_crops(db):
+    arcface_refresh.add_face_arcface(b"photo", "id0")
+    arcface_refresh.append_records([dict(arcface_refresh.load_db()[0], identity="legacy")])
+    assert rebuild_gallery.main(["--workers", "0"]) == 1
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["id0", "legacy"]
+    assert rebuild_gallery.main(["--workers", "0", "--allow-drop"]) == 0
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["id0"]
+
+
+def test_rebuild_counts_rows_in_the_pkl_the_crops_came_from(db, monkeypatch):
+    arcface_refresh.add_face_arcface(b"photo", "id0")
+    arcface_refresh.append_records([dict(arcface_refresh.load_db()[0], identity="legacy")])
+    assert crop_store.store(None).pkl_name == "old.pkl"
+
+    # the new PKL does not exist yet; the legacy row is only in old.pkl
+    monkeypatch.setattr(config, "ARC_PKL_NAME", "new.pkl")
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(db / "new.pkl"))
+    assert rebuild_gallery.main(["--workers", "0"]) == 1
+    assert arcface_refresh.load_db() == []
+
+    assert rebuild_gallery.main(["--workers", "0", "--allow-drop"]) == 0
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["id0"]
+    # later rebuilds compare against the gallery just written
+    monkeypatch.setattr(crop_store, "_stores", {})
+    assert crop_store.store(None).pkl_name == "new.pkl"
+    assert rebuild_gallery.main(["--workers", "0"]) == 0
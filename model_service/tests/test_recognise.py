@@ -0,0 +1,84 @@
+import base64
+import io
+import os
+import sys
+import uuid
+
+import pytest
+from PIL import Image
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service.services import pipeline
+
+
+def _jpeg() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8)).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+MATCHES = [[{"identity": "202200248", "distance": 0.21, "confidence": 88.5, "source_x": 10, "source_y": 20, "source_w": 30, "source_h": 40}], []]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main_mod.deepface_service, "DeepFace", object())
+    monkeypatch.setattr(main_mod.deepface_service, "ensure_deepface", lambda: None)
+    monkeypatch.setattr(pipeline, "recognise", lambda img_path, *args: MATCHES)
+    return TestClient(main_mod.app)
+
+
+def _api_key(client):
+    username = "rec_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    r = client.post("/apikey/create", data={"username": username, "password": "pw"})
+    return r.json()["api_key"]
+
+
+def test_recognise_returns_slim_json(client):
+    headers = {"X-API-KEY": _api_key(client)}
+    r = client.post("/recognise", json={"image_b64": base64.b64encode(_jpeg()).decode()}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/json")
+    assert r.json() == MATCHES
+    stages = [part.split(";")[0] for part in r.headers["server-timing"].split(", ")]
+    assert stages == ["upload", "queue", "serialize", "total"]
+
+
+def test_recognise_negotiates_msgpack(client):
+    msgpack = pytest.importorskip("msgpack")
+    headers = {"X-API-KEY": _api_key(client), "Accept": "application/msgpack"}
+    r = client.post("/recognise", json={"image_b64": base64.b64encode(_jpeg()).decode()}, headers=headers)
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(r.content, raw=False) == MATCHES
+
+
+def test_metrics_expose_stage_and_route_latencies(client):
+    headers = {"X-API-KEY": _api_key(client)}
+    client.post("/recognise", json={"image_b64": base64.b64encode(_jpeg()).decode()}, headers=headers)
+    r = client.get("/metrics", headers=headers)
+    assert r.status_code == 200
+    text = r.text
+    assert 'model_service_stage_seconds_count{stage="serialize"}' in text
+    assert 'model_service_request_seconds_bucket{route="/recognise",status="200",le="+Inf"}' in text
+    assert 'model_service_inference_busy_seconds_total{kind="recognise"}' in text
+    assert "model_service_gallery_size" in text
+
+
+def test_metrics_need_an_api_key_or_the_cluster_secret(client, monkeypatch):
+    monkeypatch.setattr(main_mod.config, "CLUSTER_SECRET", "s3cret")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"X-API-KEY": "not-a-key"}).status_code == 401
+    assert client.get("/metrics", headers={"X-Cluster-Secret": "wrong"}).status_code == 403
+    assert client.get("/metrics", headers={"X-Cluster-Secret": "s3cret"}).status_code == 200
+    assert client.get("/metrics", headers={"X-API-KEY": _api_key(client)}).status_code == 200
+
+    monkeypatch.setattr(main_mod.config, "METRICS_PUBLIC", True)
+    assert client.get("/metrics").status_code == 200
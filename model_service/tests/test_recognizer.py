@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service.services import recognizer
+
+
+class CountingRecognizer:
+    variant = "fp32"
+    input_shape = (4, 4)
+    output_shape = 3
+
+    def __init__(self):
+        self.calls = []
+
+    def preprocess(self, faces):
+        return np.stack(faces).astype(np.float32)
+
+    def embed(self, batch):
+        self.calls.append(batch.shape[0])
+        # embedding = mean pixel value, so rows can be traced back to faces
+        return np.repeat(batch.reshape(batch.shape[0], -1).mean(axis=1, keepdims=True), 3, axis=1)
+
+
+def test_embed_faces_batches_in_chunks(monkeypatch):
+    rec = CountingRecognizer()
+    monkeypatch.setattr(recognizer, "_active", rec)
+
+    faces = [np.full((4, 4, 3), float(i)) for i in range(70)]
+    out = recognizer.embed_faces(faces, batch_size=32)
+
+    assert rec.calls == [32, 32, 6]
+    assert out.shape == (70, 3)
+    assert np.allclose(out[:, 0], np.arange(70))
+
+
+def test_embed_faces_empty(monkeypatch):
+    monkeypatch.setattr(recognizer, "_active", CountingRecognizer())
+    assert recognizer.embed_faces([]).shape == (0, 3)
+
+
+def test_embed_faces_matches_deepface_represent(monkeypatch):
+    pytest.importorskip("deepface")
+    from deepface import DeepFace
+
+    from model_service import config
+
+    monkeypatch.setattr(recognizer, "_active", recognizer.KerasRecognizer(DeepFace.build_model(config.MODEL_NAME)))
+    # an extract_faces crop: RGB float in [0, 1], not square
+    face = np.random.default_rng(0).random((120, 100, 3)).astype(np.float32)
+
+    ours = recognizer.embed_faces([face])[0]
+    theirs = DeepFace.represent(
+        img_path=face, model_name=config.MODEL_NAME, detector_backend="skip", normalization=config.NORMALIZATION, align=False
+    )[0]["embedding"]
+    assert np.allclose(ours, theirs, atol=1e-4)
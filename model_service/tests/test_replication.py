@@ -0,0 +1,144 @@
+import contextlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service import config
+from model_service.services import arcface_refresh, gallery, replication
+
+
+def rec(identity, *emb):
+    return {"identity": identity, "embedding": list(emb), "rep": list(emb), "representations": list(emb), "target_x": 1}
+
+
+def test_change_log_sequences_compaction_and_torn_writes(tmp_path):
+    log = replication.ChangeLog(str(tmp_path), max_entries=2)
+    assert [log.append("CSE/sem5", [rec(f"id{i}", 1.0, 0.0)]) for i in range(4)] == [1, 2, 3, 4]
+    assert [c["seq"] for c in log.since(1, 10)] == [2, 3, 4]
+    assert log.since(4, 10) == [] and log.since(5, 10) is None
+
+    log.append(None, [rec("id4", 0.0, 1.0)])  # 5 entries > 2 * max: keep the newest 2
+    assert (log.base_seq, log.head_seq) == (3, 5)
+    assert log.since(2, 10) is None
+    assert [c["seq"] for c in log.since(3, 10)] == [4, 5]
+    with pytest.raises(ValueError):
+        log.append(None, [], seq=9)
+
+    with open(log.path, "ab") as f:
+        f.write(b'{"seq": 6, "sha')  # crash mid-append
+    reopened = replication.ChangeLog(str(tmp_path), max_entries=2)
+    assert (reopened.base_seq, reopened.head_seq) == (3, 5)
+    assert reopened.since(4, 10)[0]["records"][0]["identity"] == "id4"
+    assert replication.decode_records(reopened.since(4, 10)[0]["records"])[0]["embedding"] == [0.0, 1.0]
+
+
+class Nodes:
+    """Primary and replica in one process: each has its own ARC_DB_DIR and resident galleries."""
+
+    def __init__(self, tmp_path, monkeypatch):
+        self.monkeypatch = monkeypatch
+        self.galleries = {"primary": {}, "replica": {}}
+        self.dirs = {name: str(tmp_path / name) for name in self.galleries}
+        self.client = TestClient(main_mod.app)
+
+    @contextlib.contextmanager
+    def on(self, name):
+        with self.monkeypatch.context() as m:
+            m.setattr(config, "ARC_DB_DIR", self.dirs[name])
+            m.setattr(config, "ARC_PKL_PATH", os.path.join(self.dirs[name], "default.pkl"))
+            m.setattr(gallery, "_galleries", self.galleries[name])
+            yield
+
+    def get(self, url, params=None, headers=None):
+        """httpx.Client.get stand-in for the replica: served by the primary's routes."""
+        with self.on("primary"):
+            return self.client.get(url.replace("http://primary", ""), params=params, headers=headers)
+
+
+def test_replica_bootstraps_then_applies_deltas_to_its_resident_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CLUSTER_SECRET", "s3cret")
+    nodes = Nodes(tmp_path, monkeypatch)
+    with nodes.on("primary"):
+        arcface_refresh.append_records([rec("a", 1.0, 0.0)])
+        arcface_refresh.append_records([rec("b", 0.0, 1.0)], "CSE/sem5")
+        assert nodes.client.get("/replication/changes", params={"since": 0}).status_code == 403
+
+    replica = replication.Replicator("http://primary")
+    with nodes.on("replica"):
+        replica.sync_once(nodes)
+        assert replication.change_log().head_seq == 2
+        cse = gallery.get_gallery("CSE/sem5")
+        assert cse.refresh().identities.tolist() == ["b"]
+        assert gallery.get_gallery().refresh().identities.tolist() == ["a"]
+
+    with nodes.on("primary"):
+        arcface_refresh.append_records([rec("c", 0.6, 0.8)], "CSE/sem5")
+    with nodes.on("replica"):
+        assert replica.sync_once(nodes) == 1
+        # applied in place: the loaded index grew without a reload
+        assert cse.index.identities.tolist() == ["b", "c"]
+        assert cse.refresh() is cse.index
+        assert arcface_refresh.load_db("CSE/sem5")[1]["rep"] == pytest.approx([0.6, 0.8])
+        status = replica.status()
+        assert status["applied_seq"] == 3 and status["lag_changes"] == 0 and status["lag_seconds"] == 0.0
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "default.pkl"))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    return tmp_path
+
+
+def test_a_page_of_changes_writes_each_shard_once(node, monkeypatch):
+    writes = []
+    real = arcface_refresh._write_db
+    monkeypatch.setattr(arcface_refresh, "_write_db", lambda data, shard: (writes.append(shard), real(data, shard)))
+    replication.change_log().reset(10)  # as after a snapshot bootstrap
+    page = [{"seq": 11 + i, "shard": "CSE/sem5" if i % 2 else None, "records": replication.encode_records([rec(f"id{i}", 1.0, 0.0)])} for i in range(5)]
+
+    assert replication.apply_changes(page) == 15
+    assert sorted(writes, key=str) == ["CSE/sem5", None]
+    assert [(r["identity"], r["seq"]) for r in arcface_refresh.load_db()] == [("id0", 11), ("id2", 13), ("id4", 15)]
+    assert [r["identity"] for r in arcface_refresh.load_db("CSE/sem5")] == ["id1", "id3"]
+    assert replication.change_log().applied_seq == 15
+
+
+def test_changes_logged_before_a_crash_are_written_at_startup(node, monkeypatch):
+    arcface_refresh.append_records([rec("a", 1.0, 0.0)])
+
+    def crash(data, shard):
+        raise OSError("power cut")
+
+    # logged, then the node dies before the PKL write
+    with monkeypatch.context() as m:
+        m.setattr(arcface_refresh, "_write_db", crash)
+        with pytest.raises(OSError):
+            arcface_refresh.append_records([rec("b", 0.0, 1.0)])
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["a"]
+
+    # the next startup writes it, once
+    monkeypatch.setattr(replication, "_log", None)
+    assert replication.recover() == 1
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["a", "b"]
+    assert replication.recover() == 0
+
+    # written, but the node dies before recording it: not written again
+    with monkeypatch.context() as m:
+        m.setattr(replication.ChangeLog, "mark_applied", lambda self, seq: crash(None, None))
+        with pytest.raises(OSError):
+            arcface_refresh.append_records([rec("c", 0.6, 0.8)])
+    monkeypatch.setattr(replication, "_log", None)
+    assert replication.recover() == 0
+    assert [r["identity"] for r in arcface_refresh.load_db()] == ["a", "b", "c"]
+    assert replication.change_log().applied_seq == 3
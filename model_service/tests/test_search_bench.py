@@ -0,0 +1,19 @@
+import os
+import sys
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from model_service.benchmarks import search_bench
+
+
+def test_kernels_agree_on_small_gallery_with_missing_rows():
+    report = search_bench.run(sizes=[300], missing=[0.2], kernels=list(search_bench.KERNELS), faces_per_frame=3, repeats=5)
+    rows = {r["kernel"]: r for r in report["results"]}
+    assert set(rows) == set(search_bench.KERNELS)
+    for r in rows.values():
+        assert r["recall_at_1"] == 1.0
+        assert r["p50_ms"] <= r["p99_ms"]
+        assert r["gallery_size"] == 300 and r["missing_fraction"] == 0.2
+    assert rows["gallery_index_fp16"]["index_bytes"] < rows["gallery_index"]["index_bytes"]
@@ -0,0 +1,85 @@
+import base64
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service import config
+from model_service.services import arcface_refresh, crop_store, fake_backend, gallery, pipeline, recognizer
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "default.pkl"))
+    monkeypatch.setattr(config, "MAX_UPLOAD_SIZE_MB", 0.01)  # ~10 KB
+    monkeypatch.setattr(config, "MAX_UPLOAD_FILES", 3)
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setattr(crop_store, "_stores", {})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    monkeypatch.setattr(pipeline, "recognise", lambda *args: pytest.fail("oversized request reached inference"))
+    return TestClient(main_mod.app)
+
+
+def _api_key(client):
+    username = "up_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    return client.post("/apikey/create", data={"username": username, "password": "pw"}).json()["api_key"]
+
+
+def test_body_over_limit_is_refused_before_it_is_read(client):
+    image_b64 = base64.b64encode(b"x" * 200_000).decode()
+    # no credentials: the Content-Length alone decides
+    r = client.post("/recognise", json={"image_b64": image_b64})
+    assert r.status_code == 413
+
+    def chunks():
+        yield b'{"image_b64": "'
+        for _ in range(200):
+            yield b"A" * 1024
+        yield b'"}'
+
+    # sent chunked, without a Content-Length: refused once the bytes pass the limit
+    r = client.post("/recognise", content=chunks(), headers={"X-API-KEY": _api_key(client), "Content-Type": "application/json"})
+    assert r.status_code == 413
+
+
+def test_refresh_db_refuses_too_many_or_too_large_files(client):
+    headers = {"X-API-KEY": _api_key(client)}
+    photos = [("files", (f"{i}.jpg", f"photo-{i}".encode(), "image/jpeg")) for i in range(4)]
+    r = client.post("/refresh-db", data={"identity": "2022001"}, files=photos, headers=headers)
+    assert r.status_code == 413
+
+    big = [photos[0], ("files", ("big.jpg", b"x" * 12_000, "image/jpeg"))]
+    r = client.post("/refresh-db", data={"identity": "2022001"}, files=big, headers=headers)
+    assert r.status_code == 413
+    assert "big.jpg" in r.json()["detail"]
+    assert arcface_refresh.load_db() == []  # nothing enrolled from a refused request
+
+    r = client.post("/refresh-db", data={"identity": "2022001"}, files=photos[:3], headers=headers)
+    assert r.status_code == 200
+    assert [res["status"] for res in r.json()["results"]] == ["success"] * 3
+
+
+def test_detect_removes_the_first_upload_when_the_second_is_too_large(client, monkeypatch, tmp_path):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(spool))
+    monkeypatch.setattr(main_mod.deepface_service, "ensure_deepface", lambda: None)
+    monkeypatch.setattr(main_mod.deepface_service, "DeepFace", object())
+
+    files = [("img1", ("a.jpg", b"x" * 1_000, "image/jpeg")), ("img2", ("b.jpg", b"x" * 12_000, "image/jpeg"))]
+    r = client.post("/detect", files=files, headers={"X-API-KEY": _api_key(client)})
+    assert r.status_code == 413
+    assert list(spool.iterdir()) == []
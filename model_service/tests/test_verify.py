@@ -0,0 +1,99 @@
+import base64
+import io
+import os
+import sys
+import uuid
+
+import pytest
+from PIL import Image
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+if repo_root not in sys.path:
+    sys.path.insert(0, repo_root)
+
+from fastapi.testclient import TestClient
+
+import model_service.main as main_mod
+from model_service import config
+from model_service.services import arcface_refresh, crop_store, fake_backend, gallery, rate_limiter, recognizer
+
+
+def _jpeg(color) -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+ENROLLED, STRANGER = _jpeg("red"), _jpeg("blue")
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "FAKE_BACKEND", True)
+    monkeypatch.setattr(config, "FAKE_STAGE_COSTS_MS", {})
+    monkeypatch.setattr(config, "ANTI_SPOOFING", False)
+    monkeypatch.setattr(config, "ARC_DB_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "ARC_PKL_PATH", str(tmp_path / "default.pkl"))
+    monkeypatch.setattr(gallery, "_galleries", {})
+    monkeypatch.setattr(crop_store, "_stores", {})
+    monkeypatch.setattr(recognizer, "_active", fake_backend.FakeRecognizer())
+    monkeypatch.setattr(main_mod.deepface_service, "DeepFace", None)  # installs the fake on first use
+    monkeypatch.setattr(main_mod.deepface_service, "DEEPFACE_MODELS", None)
+    arcface_refresh.add_faces_from_uploads([ENROLLED], "2022001", shard="CSE/batch2022")
+    return TestClient(main_mod.app)
+
+
+def _api_key(client):
+    username = "ver_" + uuid.uuid4().hex[:8]
+    client.post("/register", data={"username": username, "password": "pw"})
+    r = client.post("/apikey/create", data={"username": username, "password": "pw"})
+    return r.json()["api_key"]
+
+
+def _verify(client, image, headers, **fields):
+    return client.post("/verify", json={"image_b64": base64.b64encode(image).decode(), **fields}, headers=headers)
+
+
+def test_verify_match_and_non_match(client):
+    headers = {"X-API-KEY": _api_key(client)}
+    r = _verify(client, ENROLLED, headers, identity="2022001", shard="CSE/batch2022")
+    assert r.status_code == 200
+    match = r.json()
+    assert set(match) == {"identity", "verified", "distance", "threshold", "confidence", "enrolled_embeddings", "source_x", "source_y", "source_w", "source_h"}
+    assert match["identity"] == "2022001" and match["verified"] is True
+    assert match["distance"] <= match["threshold"] and match["enrolled_embeddings"] == 1
+
+    # multipart form fields work the same way
+    files = {"file": ("probe.jpg", STRANGER, "image/jpeg")}
+    r = client.post("/verify", data={"identity": "2022001", "shard": "CSE/batch2022"}, files=files, headers=headers)
+    assert r.status_code == 200
+    miss = r.json()
+    assert set(miss) == set(match)
+    assert miss["verified"] is False and miss["distance"] > miss["threshold"]
+
+
+def test_verify_needs_an_identity_and_an_enrolled_one(client):
+    headers = {"X-API-KEY": _api_key(client)}
+    r = _verify(client, ENROLLED, headers, shard="CSE/batch2022")
+    assert r.status_code == 400
+    assert "identity" in r.json()["detail"]
+
+    r = _verify(client, ENROLLED, headers, identity="2022999", shard="CSE/batch2022")
+    assert r.status_code == 404
+    assert r.json()["reason"] == "identity_not_enrolled"
+    # enrolled, but not in the shard asked for
+    assert _verify(client, ENROLLED, headers, identity="2022001", shard="ECE/batch2022").status_code == 404
+
+    assert _verify(client, ENROLLED, headers, identity="2022001", shard="../x").status_code == 400
+
+
+def test_verify_requires_an_api_key_and_is_rate_limited(client, monkeypatch):
+    assert _verify(client, ENROLLED, {}, identity="2022001").status_code == 401
+    assert _verify(client, ENROLLED, {"X-API-KEY": "not-a-key"}, identity="2022001").status_code == 401
+
+    monkeypatch.setitem(rate_limiter.limiters, "verify", rate_limiter.RateLimiter(calls=1, period=60, burst=1))
+    headers = {"X-API-KEY": _api_key(client)}
+    assert _verify(client, ENROLLED, headers, identity="2022001", shard="CSE/batch2022").status_code == 200
+    r = _verify(client, ENROLLED, headers, identity="2022001", shard="CSE/batch2022")
+    assert r.status_code == 429
+    assert int(r.headers["retry-after"]) > 0